@@ -0,0 +1,372 @@
+import ctypes
+import os
+import time
+from pathlib import Path
+
+import numpy as np
+from PIL import Image
+
+from backends import MODEL_INPUT_SIZE, load_backend
+from image_loader import PREVIEW_SIZE, load_image
+from lesions import find_lesions
+from metrics import registry, span
+from overlay import render_overlay
+
+
+BASE_DIR = Path(__file__).resolve().parent
+
+MASK_THRESHOLD = 0.5
+
+MIN_AREA_RATIO = 0.001
+
+IMAGE_EXTENSIONS = {".png", ".jpg", ".jpeg", ".bmp", ".dcm", ".dicom"}
+
+# Примерная память на один снимок в пачке: вход, активации U-Net и выходная маска.
+BATCH_MEMORY_PER_IMAGE = 96 * 1024 * 1024
+
+DEFAULT_BATCH_SIZE = 4
+
+MAX_BATCH_SIZE = 32
+
+# Этапы анализа в том порядке, в котором они идут. По ним считается прогресс в окне.
+ANALYSIS_STAGES = [
+    ('cache', "Поиск в кэше"),
+    ('decode', "Загрузка изображения"),
+    ('preprocess', "Предобработка"),
+    ('predict', "Анализ моделью"),
+    ('postprocess', "Обработка маски"),
+    ('overlay', "Построение наложения"),
+    ('save', "Сохранение результата"),
+]
+
+STAGE_TITLES = dict(ANALYSIS_STAGES)
+
+
+# Засекаем время этапов и сообщаем наружу, когда очередной этап закончился.
+# Каждый этап заодно попадает в общие метрики (metrics.py) под своим именем.
+class StageTimer:
+    def __init__(self, progress_callback=None):
+        self.progress_callback = progress_callback
+        self.timings = {}
+        self.started = time.perf_counter()
+
+    def finish(self, stage):
+        now = time.perf_counter()
+        self.timings[stage] = now - self.started
+        self.started = now
+        registry.observe(stage, self.timings[stage])
+        if self.progress_callback:
+            self.progress_callback(stage, self.timings[stage])
+
+
+# Загружаем модель сегментации через выбранный движок (keras, tflite или onnx).
+# По умолчанию движок берётся из VKLADKI_BACKEND, а модель лежит рядом с программой.
+# TensorFlow импортируется только внутри движка: это долго, и окну он для старта не нужен.
+def load_segmentation_model(model_path=None, backend=None, num_threads=None):
+    return load_backend(backend, model_path, num_threads)
+
+
+# То же, что mobilenet_v2.preprocess_input: пиксели из 0..255 в -1..1.
+# Своя копия, чтобы ради одной формулы не тянуть TensorFlow.
+def preprocess_input(img_array):
+    img_array /= 127.5
+    img_array -= 1.0
+    return img_array
+
+
+# Приводим снимок к входу модели: 256x256, RGB, нормализация как у MobileNetV2.
+def prepare_input(original_img):
+    with span("resize"):
+        img_resized = original_img.resize(MODEL_INPUT_SIZE)
+    with span("normalize"):
+        img_array = np.array(img_resized, dtype=np.float32)
+        return preprocess_input(img_array)
+
+
+# По вероятностной маске находим очаги (см. lesions.py) и считаем площадь, итог и уверенность.
+# Мелкие пятна шума выбрасываются до подсчёта, поэтому одна случайная точка не делает снимок "с переломом".
+def evaluate_mask(pred_mask, mask_threshold=MASK_THRESHOLD, min_area_ratio=MIN_AREA_RATIO):
+    lesions, binary_mask = find_lesions(pred_mask, mask_threshold)
+
+    area_ratio = sum(lesion['area_ratio'] for lesion in lesions)
+    has_fracture = bool(lesions) and area_ratio >= min_area_ratio
+
+    if has_fracture:
+        total_area = sum(lesion['area_px'] for lesion in lesions)
+        confidence = int(sum(lesion['mean_prob'] * lesion['area_px'] for lesion in lesions) / total_area * 100)
+    else:
+        confidence = int((1.0 - np.max(pred_mask)) * 100)
+
+    confidence = max(0, min(confidence, 100))
+
+    return {
+        'has_fracture': bool(has_fracture),
+        'confidence': confidence,
+        'area_ratio': float(area_ratio),
+        'lesions': lesions,
+        'binary_mask': binary_mask,
+    }
+
+
+# Прогоняем один снимок через модель: чтение, предобработка, маска и наложение ('overlay_array', uint8 HxWx3).
+# Тут нет ничего от Qt, поэтому функцию можно спокойно звать из фонового потока.
+# progress_callback(stage, seconds) вызывается после каждого этапа.
+# Если передан cache (ResultCache), сначала ищем готовый результат для этого снимка, модели и порогов.
+# tiled=True включает анализ в полном разрешении по перекрывающимся плиткам (см. tiling.py).
+# overlay_mode: 'mask' - красная подсветка маски, 'heatmap' - тепловая карта вероятностей (colormap).
+# tta=True - режим повышенной чувствительности: отражения и масштабы снимка одной пачкой, маски усредняются
+# (см. tta.py). В режиме плиток не используется.
+# with_overlay=False - наложение не строим, 'overlay_array' будет None.
+def analyze_image(model, image_path, mask_threshold=MASK_THRESHOLD, min_area_ratio=MIN_AREA_RATIO,
+                  progress_callback=None, timer=None, cache=None, tiled=False, tile_overlap=None,
+                  overlay_mode='mask', colormap='jet', tta=False, with_overlay=True):
+    tta = tta and not tiled
+    timer = timer or StageTimer(progress_callback)
+
+    cache_key = None
+    if cache is not None:
+        cache_key = cache.make_key(
+            image_path,
+            getattr(model, 'model_path', None),
+            {
+                'mask_threshold': mask_threshold,
+                'min_area_ratio': min_area_ratio,
+                'tiled': tiled,
+                'tile_overlap': tile_overlap if tiled else None,
+                'tta': tta,
+                'postprocess': 'lesions',
+            },
+        )
+        cached = cache.get(cache_key)
+        timer.finish('cache')
+
+        if cached is not None:
+            # Очаги и наложение в кэше не храним, а строим по маске заново: это миллисекунды.
+            lesions, binary_mask = find_lesions(cached['pred_mask'], mask_threshold)
+            overlay = None
+            if with_overlay:
+                preview = load_image(image_path).preview
+                overlay = overlay_array(preview, cached['pred_mask'], binary_mask, overlay_mode, colormap)
+            cached.update({
+                'image_path': str(image_path),
+                'original_size': tuple(cached['original_size']),
+                'lesions': lesions,
+                'binary_mask': binary_mask,
+                'overlay_array': overlay,
+                'timings': timer.timings,
+                'from_cache': True,
+            })
+            return cached
+
+    # Для обычного режима хватает уменьшенной копии, её же потом показывает окно.
+    decoded = load_image(image_path)
+    original_img = decoded.full() if tiled else decoded.preview
+    original_size = decoded.original_size
+    timer.finish('decode')
+
+    if tiled:
+        # Плитки нарезаются и нормализуются прямо внутри predict_tiled.
+        from tiling import DEFAULT_OVERLAP, predict_tiled
+
+        timer.finish('preprocess')
+        overlap = DEFAULT_OVERLAP if tile_overlap is None else tile_overlap
+        pred_mask = predict_tiled(model, original_img, overlap)
+        timer.finish('predict')
+    elif tta:
+        from tta import tta_inputs, merge_tta
+
+        inputs = np.stack(tta_inputs(original_img))
+        timer.finish('preprocess')
+
+        pred_masks = model.predict(inputs, verbose=0, batch_size=len(inputs))
+        timer.finish('predict')
+        with span("tta_merge"):
+            pred_mask = merge_tta(pred_masks)
+    else:
+        img_array = np.expand_dims(prepare_input(original_img), axis=0)
+        timer.finish('preprocess')
+
+        pred_mask = model.predict(img_array, verbose=0)[0]
+        pred_mask = np.squeeze(pred_mask)
+        timer.finish('predict')
+
+    result = evaluate_mask(pred_mask, mask_threshold, min_area_ratio)
+    timer.finish('postprocess')
+
+    overlay = None
+    if with_overlay:
+        overlay = overlay_array(original_img, pred_mask, result['binary_mask'], overlay_mode, colormap)
+        timer.finish('overlay')
+
+    result.update({
+        'image_path': str(image_path),
+        'original_size': original_size,
+        'pred_mask': pred_mask,
+        'overlay_array': overlay,
+        'timings': timer.timings,
+        'from_cache': False,
+    })
+
+    if cache is not None:
+        cache.put(cache_key, result)
+
+    return result
+
+
+# Сколько свободной оперативной памяти сейчас есть, в байтах. None, если узнать не вышло.
+def available_memory():
+    if os.name == "nt":
+        class MemoryStatus(ctypes.Structure):
+            _fields_ = [
+                ("dwLength", ctypes.c_ulong),
+                ("dwMemoryLoad", ctypes.c_ulong),
+                ("ullTotalPhys", ctypes.c_ulonglong),
+                ("ullAvailPhys", ctypes.c_ulonglong),
+                ("ullTotalPageFile", ctypes.c_ulonglong),
+                ("ullAvailPageFile", ctypes.c_ulonglong),
+                ("ullTotalVirtual", ctypes.c_ulonglong),
+                ("ullAvailVirtual", ctypes.c_ulonglong),
+                ("ullAvailExtendedVirtual", ctypes.c_ulonglong),
+            ]
+
+        status = MemoryStatus()
+        status.dwLength = ctypes.sizeof(MemoryStatus)
+        if ctypes.windll.kernel32.GlobalMemoryStatusEx(ctypes.byref(status)):
+            return status.ullAvailPhys
+        return None
+
+    try:
+        return os.sysconf("SC_AVPHYS_PAGES") * os.sysconf("SC_PAGE_SIZE")
+    except (ValueError, OSError, AttributeError):
+        return None
+
+
+# Подбираем размер пачки под свободную память: берём половину свободного объёма
+# и делим на примерную стоимость одного снимка внутри модели.
+def pick_batch_size(memory=None):
+    memory = available_memory() if memory is None else memory
+    if not memory:
+        return DEFAULT_BATCH_SIZE
+
+    batch_size = int(memory * 0.5 // BATCH_MEMORY_PER_IMAGE)
+    return max(1, min(batch_size, MAX_BATCH_SIZE))
+
+
+# Собираем снимки из папки, подходящие по расширению. recursive=True заходит и в подпапки.
+def collect_images(folder, recursive=False):
+    folder = Path(folder)
+    paths = folder.rglob("*") if recursive else folder.iterdir()
+    return sorted(
+        str(path) for path in paths
+        if path.is_file() and path.suffix.lower() in IMAGE_EXTENSIONS
+    )
+
+
+# Пакетный анализ: снимки идут в модель пачками, а не по одному predict на снимок.
+# По умолчанию наложения не строим, только маска и метрики. С with_overlays=True исходники
+# пачки держим в памяти до конца predict и добавляем 'overlay_img'.
+# Результаты отдаём по мере готовности. Если снимок не открылся, приходит словарь с ключом 'error'.
+# С tiled=True каждый снимок идёт в полном разрешении, а пачками в модель уходят его плитки.
+# С tta=True в пачку идут все варианты каждого снимка (см. tta.py), снимков в пачке во столько же раз меньше.
+def analyze_batch(model, image_paths, batch_size=None, mask_threshold=MASK_THRESHOLD,
+                  min_area_ratio=MIN_AREA_RATIO, with_overlays=False, tiled=False, tile_overlap=None,
+                  overlay_mode='mask', colormap='jet', tta=False):
+    if tiled:
+        yield from analyze_tiled_batch(model, image_paths, mask_threshold, min_area_ratio,
+                                       with_overlays, tile_overlap, overlay_mode, colormap)
+        return
+
+    variants = 1
+    if tta:
+        from tta import augmentations, merge_tta, tta_inputs
+
+        variants = len(augmentations())
+
+    batch_size = max(1, (batch_size or pick_batch_size()) // variants)
+    image_paths = list(image_paths)
+    # Без наложений снимок нужен только для модели, поэтому читаем его совсем маленьким.
+    decode_size = PREVIEW_SIZE if with_overlays else MODEL_INPUT_SIZE
+
+    for start in range(0, len(image_paths), batch_size):
+        chunk = image_paths[start:start + batch_size]
+
+        inputs = []
+        loaded = []
+        for image_path in chunk:
+            try:
+                with span("decode"):
+                    decoded = load_image(image_path, decode_size, use_cache=False)
+            except Exception as e:
+                yield {'image_path': str(image_path), 'error': str(e)}
+                continue
+
+            if tta:
+                inputs.extend(tta_inputs(decoded.preview))
+            else:
+                inputs.append(prepare_input(decoded.preview))
+            loaded.append((str(image_path), decoded))
+
+        if not inputs:
+            continue
+
+        # Время всей пачки, а не снимка: делить на размер пачки при чтении метрик.
+        with span("batch_predict"):
+            pred_masks = model.predict(np.stack(inputs), verbose=0, batch_size=len(inputs))
+
+        if tta:
+            with span("tta_merge"):
+                pred_masks = [
+                    merge_tta(pred_masks[i:i + variants]) for i in range(0, len(pred_masks), variants)
+                ]
+
+        for (image_path, decoded), pred_mask in zip(loaded, pred_masks):
+            pred_mask = np.squeeze(pred_mask)
+            with span("postprocess"):
+                result = evaluate_mask(pred_mask, mask_threshold, min_area_ratio)
+            binary_mask = result.pop('binary_mask')
+            result.update({
+                'image_path': image_path,
+                'original_size': decoded.original_size,
+                'pred_mask': pred_mask,
+            })
+            if with_overlays:
+                with span("overlay"):
+                    result['overlay_img'] = create_overlay(
+                        decoded.preview, pred_mask, binary_mask, overlay_mode, colormap,
+                    )
+            yield result
+
+        loaded.clear()
+
+
+# Пакет в режиме плиток: снимки по одному, каждый целиком через analyze_image.
+def analyze_tiled_batch(model, image_paths, mask_threshold, min_area_ratio, with_overlays, tile_overlap,
+                        overlay_mode, colormap):
+    for image_path in image_paths:
+        try:
+            result = analyze_image(model, image_path, mask_threshold, min_area_ratio,
+                                   tiled=True, tile_overlap=tile_overlap,
+                                   overlay_mode=overlay_mode, colormap=colormap)
+        except (OSError, ValueError, ImportError) as e:
+            yield {'image_path': str(image_path), 'error': str(e)}
+            continue
+
+        result.pop('binary_mask')
+        overlay = result.pop('overlay_array')
+        if with_overlays:
+            result['overlay_img'] = Image.fromarray(overlay)
+        yield result
+
+
+# Накладываем подсветку на снимок. Рисуем прямо в uint8-массиве и только внутри рамки маски,
+# см. overlay.py. На выходе массив HxWx3 того же размера, что и переданная картинка:
+# окно отдаёт его в QImage без копии, а на диск он не пишется.
+def overlay_array(original_img, pred_mask, binary_mask, mode='mask', colormap='jet'):
+    image = np.array(original_img.convert("RGB"))
+    render_overlay(image, pred_mask, binary_mask, mode, colormap=colormap)
+    return image
+
+
+# То же, но PIL-картинкой: для сохранения наложений в файл (консольный режим).
+def create_overlay(original_img, pred_mask, binary_mask, mode='mask', colormap='jet'):
+    return Image.fromarray(overlay_array(original_img, pred_mask, binary_mask, mode, colormap))
@@ -0,0 +1,98 @@
+import io
+import json
+import os
+import threading
+import uuid
+from datetime import datetime
+from pathlib import Path
+
+import numpy as np
+from PIL import Image
+
+from image_loader import PREVIEW_SIZE, load_image
+from lesions import find_lesions
+from overlay import render_overlay
+
+
+BASE_DIR = Path(__file__).resolve().parent
+
+ARTIFACT_DIR = Path(os.environ.get("VKLADKI_ARTIFACTS", BASE_DIR / "artifacts"))
+
+
+# Маска исследования в хранилище: вероятности в uint8 (шаг 1/255, для порога этого хватает),
+# сжатый npz на несколько килобайт. Маску больше превью (анализ по плиткам) сначала уменьшаем
+# до размера превью: наложение всё равно рисуется на превью.
+def quantize_mask(pred_mask, max_size=PREVIEW_SIZE):
+    mask = np.clip(np.round(pred_mask * 255), 0, 255).astype(np.uint8)
+    height, width = mask.shape
+    if width > max_size[0] or height > max_size[1]:
+        img = Image.fromarray(mask)
+        img.thumbnail(max_size, Image.Resampling.BILINEAR)
+        mask = np.asarray(img)
+    return mask
+
+
+def dequantize_mask(mask):
+    return mask.astype(np.float32) / 255.0
+
+
+# Хранилище артефактов исследований: на каждое исследование один файл с маской вероятностей
+# и параметрами, по которым было построено наложение. Само наложение на диск не пишем,
+# его дёшево нарисовать заново из маски и снимка (render).
+class ArtifactStore:
+    def __init__(self, artifact_dir=ARTIFACT_DIR):
+        self.artifact_dir = Path(artifact_dir)
+        self.lock = threading.Lock()
+
+    # Сохраняем маску результата, возвращаем путь к файлу (его кладём в studies.mask_path).
+    # Имя уникальное, так что параллельные анализы и повторы одного снимка друг друга не затирают.
+    def save(self, result, mask_threshold, overlay_mode='mask', colormap='jet'):
+        meta = {
+            'image_path': str(result['image_path']),
+            'original_size': list(result['original_size']),
+            'mask_threshold': mask_threshold,
+            'overlay_mode': overlay_mode,
+            'colormap': colormap,
+            'created_at': datetime.now().isoformat(timespec="seconds"),
+        }
+
+        buffer = io.BytesIO()
+        np.savez_compressed(buffer, mask=quantize_mask(result['pred_mask']), meta=json.dumps(meta))
+
+        day_dir = self.artifact_dir / datetime.now().strftime("%Y-%m-%d")
+        path = day_dir / f"{uuid.uuid4().hex}.npz"
+        with self.lock:
+            day_dir.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_suffix(".npz.tmp")
+        tmp_path.write_bytes(buffer.getvalue())
+        os.replace(tmp_path, path)
+        return path
+
+    # Маска, к которой так и не привязали исследование: удаляем, чтобы не копились в artifacts/.
+    @staticmethod
+    def discard(path):
+        Path(path).unlink(missing_ok=True)
+
+    # Маска и параметры исследования. OSError/KeyError/ValueError, если файл пропал или испорчен.
+    @staticmethod
+    def load(path):
+        with np.load(path) as data:
+            meta = json.loads(str(data['meta']))
+            meta['pred_mask'] = dequantize_mask(data['mask'])
+        return meta
+
+    # Рисуем наложение в памяти: превью снимка (из общего кэша чтения) плюс маска.
+    # Возвращаем uint8-массив HxWx3, его можно без копии отдать в QImage.
+    # image_path - где снимок лежит сейчас (studies.image_path), если его перенесли после анализа.
+    @staticmethod
+    def render(artifact, overlay_mode=None, colormap=None, mask_threshold=None, image_path=None):
+        image = np.array(load_image(image_path or artifact['image_path']).preview.convert("RGB"))
+        pred_mask = artifact['pred_mask']
+        threshold = artifact['mask_threshold'] if mask_threshold is None else mask_threshold
+        binary_mask = find_lesions(pred_mask, threshold)[1]
+        render_overlay(
+            image, pred_mask, binary_mask,
+            overlay_mode or artifact['overlay_mode'],
+            colormap=colormap or artifact['colormap'],
+        )
+        return image
@@ -0,0 +1,158 @@
+import os
+from pathlib import Path
+
+import numpy as np
+
+
+BASE_DIR = Path(__file__).resolve().parent
+
+# Размер входа модели (ширина, высота). Все пути анализа подают снимки ровно такого размера.
+MODEL_INPUT_SIZE = (256, 256)
+
+# Какой движок использовать, если явно не указали. Можно переопределить переменной окружения.
+DEFAULT_BACKEND = os.environ.get("VKLADKI_BACKEND", "keras")
+
+MODEL_FILES = {
+    'keras': BASE_DIR / "model.keras",
+    'tflite': BASE_DIR / "model.tflite",
+    'onnx': BASE_DIR / "model.onnx",
+}
+
+
+# Обычная keras-модель. Самый тяжёлый вариант, но зато эталон для сравнения.
+# model.predict на каждый снимок заново собирает адаптер данных и цикл предсказания,
+# поэтому зовём модель напрямую через tf.function с фиксированной сигнатурой входа.
+# Граф собирается один раз при прогреве сразу после загрузки.
+# num_threads ограничивает потоки внутри операций; задать можно только до первого вызова TensorFlow
+# в процессе, поэтому имеет смысл в отдельных процессах анализа (см. process_pool.py).
+class KerasBackend:
+    name = 'keras'
+
+    def __init__(self, model_path, num_threads=None):
+        import tensorflow as tf
+        from tensorflow import keras
+
+        if num_threads:
+            try:
+                tf.config.threading.set_intra_op_parallelism_threads(num_threads)
+                tf.config.threading.set_inter_op_parallelism_threads(1)
+            except RuntimeError:
+                # TensorFlow уже запущен в этом процессе, остаются его настройки.
+                pass
+
+        self.tf = tf
+        self.model = keras.models.load_model(str(model_path), compile=False)
+        # Полностью свёрточная U-Net может быть сохранена с входом (None, None, 3): тогда размер
+        # не узнать из модели, а tf.zeros с None не создать. Сигнатуру фиксируем по MODEL_INPUT_SIZE.
+        channels = self.model.input_shape[-1] or 3
+        width, height = MODEL_INPUT_SIZE
+        self.input_shape = (height, width, channels)
+
+        self.forward = tf.function(
+            self.call_model,
+            input_signature=[tf.TensorSpec((None, *self.input_shape), tf.float32)],
+            reduce_retracing=True,
+        )
+        self.warmup()
+
+    def call_model(self, x):
+        return self.model(x, training=False)
+
+    # Один пустой прогон, чтобы граф собрался до первого настоящего снимка.
+    def warmup(self):
+        self.forward(self.tf.zeros((1, *self.input_shape), dtype=self.tf.float32))
+
+    def predict(self, x, verbose=0, batch_size=None):
+        x = self.tf.convert_to_tensor(x, dtype=self.tf.float32)
+        return self.forward(x).numpy()
+
+
+# Модель, сконвертированная в TFLite. Если стоит лёгкий tflite_runtime, TensorFlow не нужен вовсе.
+# Для int8-модели сами переводим вход и выход через scale/zero_point.
+class TFLiteBackend:
+    name = 'tflite'
+
+    def __init__(self, model_path, num_threads=None):
+        try:
+            from tflite_runtime.interpreter import Interpreter
+        except ImportError:
+            from tensorflow.lite import Interpreter
+
+        self.interpreter = Interpreter(model_path=str(model_path), num_threads=num_threads or os.cpu_count())
+        self.input_detail = self.interpreter.get_input_details()[0]
+        self.output_index = self.interpreter.get_output_details()[0]['index']
+        self.batch_size = None
+
+    # Размер батча меняется редко, поэтому тензоры перераспределяем только при смене размера.
+    def resize(self, batch_size):
+        if batch_size == self.batch_size:
+            return
+
+        shape = list(self.input_detail['shape'])
+        shape[0] = batch_size
+        self.interpreter.resize_tensor_input(self.input_detail['index'], shape)
+        self.interpreter.allocate_tensors()
+        self.output_detail = self.interpreter.get_output_details()[0]
+        self.batch_size = batch_size
+
+    def predict(self, x, verbose=0, batch_size=None):
+        self.resize(len(x))
+
+        input_dtype = self.input_detail['dtype']
+        if input_dtype != np.float32:
+            scale, zero_point = self.input_detail['quantization']
+            x = np.clip(np.round(x / scale + zero_point), np.iinfo(input_dtype).min, np.iinfo(input_dtype).max)
+
+        self.interpreter.set_tensor(self.input_detail['index'], x.astype(input_dtype))
+        self.interpreter.invoke()
+        result = self.interpreter.get_tensor(self.output_index)
+
+        if result.dtype != np.float32:
+            scale, zero_point = self.output_detail['quantization']
+            result = (result.astype(np.float32) - zero_point) * scale
+
+        return result
+
+
+# Модель в ONNX через onnxruntime, только CPU.
+class OnnxBackend:
+    name = 'onnx'
+
+    def __init__(self, model_path, num_threads=None):
+        import onnxruntime
+
+        options = onnxruntime.SessionOptions()
+        if num_threads:
+            options.intra_op_num_threads = num_threads
+            options.inter_op_num_threads = 1
+
+        self.session = onnxruntime.InferenceSession(
+            str(model_path), options, providers=["CPUExecutionProvider"],
+        )
+        self.input_name = self.session.get_inputs()[0].name
+
+    def predict(self, x, verbose=0, batch_size=None):
+        return self.session.run(None, {self.input_name: x.astype(np.float32)})[0]
+
+
+BACKENDS = {
+    'keras': KerasBackend,
+    'tflite': TFLiteBackend,
+    'onnx': OnnxBackend,
+}
+
+
+# Создаём движок по имени. Путь к файлу модели по умолчанию берём из MODEL_FILES.
+def load_backend(name=None, model_path=None, num_threads=None):
+    name = (name or DEFAULT_BACKEND).lower()
+    if name not in BACKENDS:
+        raise ValueError(f"Неизвестный движок: {name}. Доступны: {', '.join(BACKENDS)}")
+
+    model_path = Path(model_path) if model_path else MODEL_FILES[name]
+    if not model_path.exists():
+        raise FileNotFoundError(f"Модель не найдена: {model_path}")
+
+    print(f"Загружаю модель ({name}): {model_path}")
+    backend = BACKENDS[name](model_path, num_threads=num_threads)
+    backend.model_path = model_path
+    return backend
@@ -0,0 +1,319 @@
+import argparse
+import ctypes
+import importlib
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+from PIL import Image
+
+from analysis import (
+    BASE_DIR, MODEL_INPUT_SIZE, create_overlay, evaluate_mask, load_segmentation_model, prepare_input,
+)
+from backends import BACKENDS, MODEL_FILES
+from image_loader import load_image
+
+
+# Размеры синтетических снимков (ширина, высота): кассета CR 24x30 и плоская панель DR 43x43.
+RADIOGRAPH_SIZES = [(2048, 2500), (3072, 3072)]
+
+BATCH_SIZES = [1, 4, 8, 16]
+
+# Сколько раз повторяем каждое измерение. Первые прогоны не считаем: там прогрев кэшей.
+REPEATS = 20
+WARMUP_REPEATS = 3
+
+BASELINE_PATH = BASE_DIR / "benchmark_baseline.json"
+
+# Насколько метрика может ухудшиться относительно эталона, прежде чем считаем это регрессией.
+DEFAULT_TOLERANCE = 0.15
+
+# Тяжёлые модули каждого движка: время их импорта - первая часть холодного старта.
+# Для tflite берём первый, что установлен, как и сам движок.
+BACKEND_MODULES = {
+    'keras': ["tensorflow"],
+    'tflite': ["tflite_runtime.interpreter", "tensorflow"],
+    'onnx': ["onnxruntime"],
+}
+
+# Метрики, где больше - лучше. У остальных (время, память) лучше меньше.
+HIGHER_IS_BETTER = ("images_per_s",)
+
+
+# Разбираем аргументы командной строки.
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Замеры скорости и памяти анализа снимков")
+    parser.add_argument("--backends", nargs="+", choices=sorted(BACKENDS), default=sorted(BACKENDS),
+                        help="какие движки мерить (по умолчанию все, для которых есть файл модели)")
+    parser.add_argument("--repeats", type=int, default=REPEATS)
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=BATCH_SIZES)
+    parser.add_argument("-o", "--output", default="benchmark_results.json", help="куда записать результаты")
+    parser.add_argument("--baseline", default=str(BASELINE_PATH), help="эталон для сравнения")
+    parser.add_argument("--save-baseline", action="store_true", help="записать результаты как новый эталон")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE,
+                        help="допустимое ухудшение относительно эталона, доля (по умолчанию 0.15)")
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    return parser.parse_args(argv)
+
+
+# Пиковая память процесса в мегабайтах.
+def peak_rss_mb():
+    if os.name == "nt":
+        class ProcessMemoryCounters(ctypes.Structure):
+            _fields_ = [
+                ("cb", ctypes.c_ulong),
+                ("PageFaultCount", ctypes.c_ulong),
+                ("PeakWorkingSetSize", ctypes.c_size_t),
+                ("WorkingSetSize", ctypes.c_size_t),
+                ("QuotaPeakPagedPoolUsage", ctypes.c_size_t),
+                ("QuotaPagedPoolUsage", ctypes.c_size_t),
+                ("QuotaPeakNonPagedPoolUsage", ctypes.c_size_t),
+                ("QuotaNonPagedPoolUsage", ctypes.c_size_t),
+                ("PagefileUsage", ctypes.c_size_t),
+                ("PeakPagefileUsage", ctypes.c_size_t),
+            ]
+
+        counters = ProcessMemoryCounters()
+        counters.cb = ctypes.sizeof(ProcessMemoryCounters)
+        process = ctypes.windll.kernel32.GetCurrentProcess()
+        if ctypes.windll.psapi.GetProcessMemoryInfo(process, ctypes.byref(counters), counters.cb):
+            return counters.PeakWorkingSetSize / 2**20
+        return None
+
+    import resource
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux отдаёт килобайты, macOS - байты.
+    return peak / 2**20 if sys.platform == "darwin" else peak / 2**10
+
+
+# Время одного вызова fn по repeats прогонам: медиана, p95 и среднее, в миллисекундах.
+def measure(fn, repeats, warmup=WARMUP_REPEATS):
+    for _ in range(warmup):
+        fn()
+
+    samples = []
+    for _ in range(repeats):
+        started = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - started) * 1000)
+
+    return {
+        'p50_ms': round(float(np.percentile(samples, 50)), 3),
+        'p95_ms': round(float(np.percentile(samples, 95)), 3),
+        'mean_ms': round(float(np.mean(samples)), 3),
+    }
+
+
+# Синтетический рентген: тёмный фон, светлая "кость"-эллипс с трещиной, шум детектора.
+# Генератор с фиксированным seed, чтобы снимки и их сжатие были одинаковыми от прогона к прогону.
+def synthetic_radiograph(size, seed=0):
+    width, height = size
+    rng = np.random.default_rng(seed)
+
+    y, x = np.ogrid[:height, :width]
+    image = 40 + 30 * (y / height)
+    bone = ((x - width / 2) / (width * 0.15)) ** 2 + ((y - height / 2) / (height * 0.4)) ** 2 <= 1
+    image = np.where(bone, 190.0, image)
+    crack = np.abs((y - height / 2) - 0.3 * (x - width / 2)) < max(2, width // 500)
+    image = np.where(bone & crack, 90.0, image)
+    image = image + rng.normal(0, 8, (height, width))
+
+    gray = np.clip(image, 0, 255).astype(np.uint8)
+    return Image.fromarray(gray).convert("RGB")
+
+
+# Пишем синтетические снимки во временную папку в тех форматах, что приходят от рентгена.
+def write_synthetic_images(folder):
+    paths = {}
+    for size in RADIOGRAPH_SIZES:
+        img = synthetic_radiograph(size)
+        label = f"{size[0]}x{size[1]}"
+        for ext in ("png", "jpg"):
+            path = Path(folder) / f"radiograph_{label}.{ext}"
+            if ext == "jpg":
+                img.save(path, quality=95)
+            else:
+                img.save(path)
+            paths[f"{label}_{ext}"] = path
+    return paths
+
+
+# Стоимость всего, что вокруг модели: чтение, предобработка, маска, наложение и его сохранение.
+# Модель не нужна: вместо её выхода берём синтетическую маску вероятностей.
+def bench_pipeline(image_paths, repeats):
+    rng = np.random.default_rng(0)
+    pred_mask = rng.random(MODEL_INPUT_SIZE).astype(np.float32) ** 8
+
+    results = {}
+    for label, path in image_paths.items():
+        decoded = load_image(path, use_cache=False)
+        preview = decoded.preview
+        binary_mask = evaluate_mask(pred_mask)['binary_mask']
+        overlay_img = create_overlay(preview, pred_mask, binary_mask)
+
+        def save_overlay():
+            overlay_img.save(io.BytesIO(), format="PNG")
+
+        results[label] = {
+            'decode': measure(lambda: load_image(path, use_cache=False), repeats),
+            'preprocess': measure(lambda: prepare_input(preview), repeats),
+            'postprocess': measure(lambda: evaluate_mask(pred_mask), repeats),
+            'overlay': measure(lambda: create_overlay(preview, pred_mask, binary_mask), repeats),
+            'overlay_heatmap': measure(lambda: create_overlay(preview, pred_mask, binary_mask, 'heatmap'), repeats),
+            'save_overlay': measure(save_overlay, repeats),
+        }
+    return results
+
+
+# Замеры одного движка. Идут в отдельном процессе, иначе холодный старт и пиковая память
+# смешаются с тем, что уже загрузили предыдущие движки.
+def bench_backend(backend, repeats, batch_sizes):
+    result = {}
+
+    started = time.perf_counter()
+    for module in BACKEND_MODULES[backend]:
+        try:
+            importlib.import_module(module)
+            break
+        except ImportError:
+            continue
+    result['import_s'] = round(time.perf_counter() - started, 3)
+
+    started = time.perf_counter()
+    model = load_segmentation_model(backend=backend)
+    result['load_s'] = round(time.perf_counter() - started, 3)
+
+    x = np.random.default_rng(0).uniform(-1, 1, (1, *MODEL_INPUT_SIZE, 3)).astype(np.float32)
+    started = time.perf_counter()
+    model.predict(x)
+    result['first_predict_ms'] = round((time.perf_counter() - started) * 1000, 3)
+
+    result['single'] = measure(lambda: model.predict(x), repeats)
+
+    result['batch'] = {}
+    for batch_size in batch_sizes:
+        batch = np.repeat(x, batch_size, axis=0)
+        timing = measure(lambda: model.predict(batch, batch_size=batch_size), max(3, repeats // 4))
+        timing['images_per_s'] = round(batch_size * 1000 / timing['p50_ms'], 2)
+        result['batch'][str(batch_size)] = timing
+
+    result['peak_rss_mb'] = round(peak_rss_mb(), 1)
+    return result
+
+
+# Запускаем замер движка в дочернем процессе и забираем его результат из последней строки вывода.
+def run_backend_process(backend, args):
+    command = [
+        sys.executable, str(Path(__file__).resolve()), "--child", backend,
+        "--repeats", str(args.repeats), "--batch-sizes", *map(str, args.batch_sizes),
+    ]
+    completed = subprocess.run(command, capture_output=True, text=True)
+    lines = completed.stdout.strip().splitlines()
+    if completed.returncode != 0 or not lines:
+        error = (completed.stderr.strip().splitlines() or ["неизвестная ошибка"])[-1]
+        return {'error': error}
+    return json.loads(lines[-1])
+
+
+# Плоский словарь "путь.к.метрике" -> число, чтобы сравнивать с эталоном по ключам.
+def flatten(data, prefix=""):
+    flat = {}
+    for key, value in data.items():
+        name = f"{prefix}{key}"
+        if isinstance(value, dict):
+            flat.update(flatten(value, name + "."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[name] = value
+    return flat
+
+
+# Сравниваем с эталоном. Регрессия - метрика ухудшилась больше чем на tolerance.
+def compare(results, baseline, tolerance):
+    current = flatten(results['metrics'])
+    reference = flatten(baseline['metrics'])
+
+    regressions = []
+    for name in sorted(current.keys() & reference.keys()):
+        old, new = reference[name], current[name]
+        if not old:
+            continue
+        change = (new - old) / old
+        if name.endswith(HIGHER_IS_BETTER):
+            change = -change
+        marker = ""
+        if change > tolerance:
+            marker = "  <-- регрессия"
+            regressions.append(name)
+        print(f"{name:60s} {old:>12.3f} -> {new:>12.3f} ({change:+.1%}){marker}")
+
+    return regressions
+
+
+def run(args):
+    if args.child:
+        print(json.dumps(bench_backend(args.child, args.repeats, args.batch_sizes)))
+        return 0
+
+    results = {
+        'machine': {
+            'platform': platform.platform(),
+            'processor': platform.processor(),
+            'cpu_count': os.cpu_count(),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+        },
+        'config': {
+            'repeats': args.repeats,
+            'batch_sizes': args.batch_sizes,
+            'radiograph_sizes': RADIOGRAPH_SIZES,
+        },
+        'metrics': {},
+    }
+
+    with tempfile.TemporaryDirectory() as folder:
+        print("Замеряю чтение, предобработку и наложение...")
+        results['metrics']['pipeline'] = bench_pipeline(write_synthetic_images(folder), args.repeats)
+
+    for backend in args.backends:
+        if not MODEL_FILES[backend].exists():
+            print(f"Пропускаю {backend}: нет файла {MODEL_FILES[backend]}")
+            continue
+        print(f"Замеряю движок {backend}...")
+        results['metrics'][backend] = run_backend_process(backend, args)
+        if 'error' in results['metrics'][backend]:
+            print(f"  ошибка: {results['metrics'][backend]['error']}")
+
+    Path(args.output).write_text(json.dumps(results, indent=2, ensure_ascii=False), encoding="utf-8")
+    print(f"Результаты записаны в {args.output}")
+
+    if args.save_baseline:
+        Path(args.baseline).write_text(json.dumps(results, indent=2, ensure_ascii=False), encoding="utf-8")
+        print(f"Эталон обновлён: {args.baseline}")
+        return 0
+
+    baseline_path = Path(args.baseline)
+    if not baseline_path.exists():
+        print("Эталона нет, сравнивать не с чем. Сохранить текущие результаты: --save-baseline")
+        return 0
+
+    regressions = compare(results, json.loads(baseline_path.read_text(encoding="utf-8")), args.tolerance)
+    if regressions:
+        print(f"Регрессий: {len(regressions)}")
+        return 1
+    print("Регрессий нет")
+    return 0
+
+
+def main(argv=None):
+    return run(parse_args(argv))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,202 @@
+import argparse
+import csv
+import json
+import sys
+import time
+from pathlib import Path
+
+from analysis import (
+    MASK_THRESHOLD, MIN_AREA_RATIO, analyze_batch, collect_images,
+    load_segmentation_model, pick_batch_size,
+)
+from backends import BACKENDS
+from lesions import lesion_in_image
+from metrics import profile, registry, span, start_exporters
+from overlay import COLORMAPS, OVERLAY_MODES
+from process_pool import AnalysisProcessPool
+
+
+CSV_FIELDS = ['image_path', 'has_fracture', 'confidence', 'area_ratio', 'lesion_count', 'overlay_path', 'error']
+
+
+# Разбираем аргументы командной строки.
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Пакетный анализ рентгеновских снимков без графического интерфейса",
+    )
+    parser.add_argument("input_dir", help="папка со снимками")
+    parser.add_argument("-o", "--output", default="results", help="папка для результатов (по умолчанию results)")
+    parser.add_argument("--model", default=None, help="путь к файлу модели (по умолчанию рядом с программой)")
+    parser.add_argument("--backend", choices=sorted(BACKENDS), default=None,
+                        help="движок инференса (по умолчанию из VKLADKI_BACKEND или keras)")
+    parser.add_argument("--format", choices=["csv", "json", "both"], default="both",
+                        help="формат таблицы результатов")
+    parser.add_argument("--batch-size", type=int, default=None,
+                        help="размер пачки (по умолчанию подбирается под свободную память)")
+    parser.add_argument("--mask-threshold", type=float, default=MASK_THRESHOLD)
+    parser.add_argument("--min-area-ratio", type=float, default=MIN_AREA_RATIO)
+    parser.add_argument("--overlay", choices=OVERLAY_MODES, default="mask",
+                        help="mask - подсветка маски, heatmap - тепловая карта вероятностей")
+    parser.add_argument("--colormap", choices=sorted(COLORMAPS), default="jet", help="цвета тепловой карты")
+    parser.add_argument("--no-overlays", action="store_true", help="не сохранять картинки с наложением")
+    parser.add_argument("--tiled", action="store_true",
+                        help="анализ в полном разрешении по перекрывающимся плиткам 256x256")
+    parser.add_argument("--tile-overlap", type=float, default=None,
+                        help="перекрытие плиток, доля от 0 до 1 (по умолчанию 0.25)")
+    parser.add_argument("--tta", action="store_true",
+                        help="повышенная чувствительность: отражения и масштабы снимка, маски усредняются")
+    parser.add_argument("-r", "--recursive", action="store_true", help="искать снимки и в подпапках")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="процессов анализа, у каждого своя модель (0 - по числу ядер и памяти)")
+    parser.add_argument("--threads-per-worker", type=int, default=None,
+                        help="потоков TensorFlow на процесс (по умолчанию 2)")
+    parser.add_argument("--profile", choices=["cprofile", "tf"], default=None,
+                        help="снять профиль прогона (файлы в папке profiles)")
+    parser.add_argument("--metrics", action="store_true",
+                        help="вывести в конце перцентили времени по этапам")
+    return parser.parse_args(argv)
+
+
+# Имя файла наложения: путь снимка относительно входной папки, чтобы одинаковые имена не затирались.
+def overlay_name(image_path, input_dir):
+    relative = Path(image_path).resolve().relative_to(Path(input_dir).resolve())
+    return "__".join(relative.with_suffix("").parts) + "_overlay.png"
+
+
+# Прогоняем папку через модель и пишем результаты по мере готовности,
+# чтобы ночной прогон не терял уже посчитанное, если его прервут.
+def analyze_folder(args):
+    image_paths = collect_images(args.input_dir, recursive=args.recursive)
+    if not image_paths:
+        print(f"В папке {args.input_dir} нет снимков")
+        return 1
+
+    output_dir = Path(args.output)
+    overlays_dir = output_dir / "overlays"
+    overlays_dir.mkdir(parents=True, exist_ok=True)
+
+    # С --workers снимки расходятся по процессам анализа, модель грузит каждый процесс сам.
+    pool = None
+    if args.workers != 1:
+        pool = AnalysisProcessPool(args.workers or None, args.model, args.backend, args.threads_per_worker)
+        print(f"Снимков: {len(image_paths)}, процессов анализа: {pool.workers}")
+    else:
+        batch_size = args.batch_size or pick_batch_size()
+        model = load_segmentation_model(args.model, args.backend)
+        print(f"Снимков: {len(image_paths)}, размер пачки: {batch_size}")
+
+    csv_file = None
+    json_file = None
+    if args.format in ("csv", "both"):
+        csv_file = open(output_dir / "results.csv", "w", newline="", encoding="utf-8")
+        csv_writer = csv.DictWriter(csv_file, fieldnames=CSV_FIELDS, extrasaction="ignore")
+        csv_writer.writeheader()
+    if args.format in ("json", "both"):
+        json_file = open(output_dir / "results.jsonl", "w", encoding="utf-8")
+
+    started = time.perf_counter()
+    done = 0
+    fractures = 0
+    failed = 0
+
+    try:
+        if pool is not None:
+            results = pool.analyze_many(
+                image_paths,
+                mask_threshold=args.mask_threshold,
+                min_area_ratio=args.min_area_ratio,
+                with_overlay=not args.no_overlays,
+                tiled=args.tiled,
+                tile_overlap=args.tile_overlap,
+                overlay_mode=args.overlay,
+                colormap=args.colormap,
+                tta=args.tta,
+            )
+        else:
+            results = analyze_batch(
+                model, image_paths, batch_size,
+                mask_threshold=args.mask_threshold,
+                min_area_ratio=args.min_area_ratio,
+                with_overlays=not args.no_overlays,
+                tiled=args.tiled,
+                tile_overlap=args.tile_overlap,
+                overlay_mode=args.overlay,
+                colormap=args.colormap,
+                tta=args.tta,
+            )
+        for result in results:
+            done += 1
+            row = {'image_path': result['image_path']}
+
+            if 'error' in result:
+                failed += 1
+                row['error'] = result['error']
+            else:
+                fractures += int(result['has_fracture'])
+                row.update({
+                    'has_fracture': result['has_fracture'],
+                    'confidence': result['confidence'],
+                    'area_ratio': round(result['area_ratio'], 6),
+                    'lesion_count': len(result['lesions']),
+                })
+                overlay_img = result.get('overlay_img')
+                if overlay_img is not None:
+                    overlay_path = overlays_dir / overlay_name(result['image_path'], args.input_dir)
+                    with span("save"):
+                        overlay_img.save(overlay_path)
+                    row['overlay_path'] = str(overlay_path)
+
+            if csv_file:
+                csv_writer.writerow(row)
+                csv_file.flush()
+            if json_file:
+                # В JSON идёт и полный список очагов в координатах снимка, в CSV - только их число.
+                if 'lesions' in result:
+                    row['lesions'] = [lesion_in_image(lesion, result['original_size']) for lesion in result['lesions']]
+                json_file.write(json.dumps(row, ensure_ascii=False) + "\n")
+                json_file.flush()
+
+            print(f"[{done}/{len(image_paths)}] {result['image_path']}")
+    finally:
+        if pool is not None:
+            pool.shutdown()
+        if csv_file:
+            csv_file.close()
+        if json_file:
+            json_file.close()
+
+    elapsed = time.perf_counter() - started
+    print(
+        f"Готово за {elapsed:.1f} с: снимков {done}, с переломом {fractures}, ошибок {failed}. "
+        f"Результаты в {output_dir}"
+    )
+    return 0
+
+
+# Перцентили по этапам за прогон, в миллисекундах.
+def print_metrics():
+    print(f"{'этап':20s} {'p50':>10s} {'p95':>10s} {'p99':>10s} {'раз':>8s}")
+    for name, summary in registry.snapshot().items():
+        print(
+            f"{name:20s} {summary['p50'] * 1000:>10.1f} {summary['p95'] * 1000:>10.1f} "
+            f"{summary['p99'] * 1000:>10.1f} {summary['count']:>8d}"
+        )
+
+
+def run(args):
+    start_exporters()
+    with profile("cli", args.profile):
+        code = analyze_folder(args)
+
+    if args.metrics:
+        print_metrics()
+    registry.flush()
+    return code
+
+
+def main(argv=None):
+    return run(parse_args(argv))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,165 @@
+import numpy as np
+from PIL import Image
+
+from image_loader import PREVIEW_SIZE, DecodedImage
+
+
+DICOM_EXTENSIONS = {".dcm", ".dicom"}
+
+PIXEL_DATA_TAG = 0x7FE00010
+
+# Если в файле нет окна (WindowCenter/WindowWidth), берём окно по перцентилям яркости.
+AUTO_WINDOW_PERCENTILES = (0.5, 99.5)
+
+
+# DICOM узнаём по расширению или по метке DICM после 128-байтной преамбулы.
+def is_dicom(path):
+    if str(path).lower().endswith(tuple(DICOM_EXTENSIONS)):
+        return True
+
+    try:
+        with open(path, "rb") as f:
+            f.seek(128)
+            return f.read(4) == b"DICM"
+    except OSError:
+        return False
+
+
+def _require_pydicom():
+    try:
+        import pydicom
+    except ImportError:
+        raise ImportError("Для открытия DICOM нужен пакет pydicom: pip install pydicom")
+    return pydicom
+
+
+# Первое значение атрибута, даже если в файле их несколько (бывает у окон).
+def _first_value(ds, name, default=None):
+    value = ds.get(name, default)
+    if value is None:
+        return default
+    try:
+        return float(value[0])
+    except (TypeError, IndexError):
+        return float(value)
+
+
+# Тип пикселей в файле по BitsAllocated и PixelRepresentation.
+def _pixel_dtype(ds, little_endian):
+    bits = int(ds.BitsAllocated)
+    signed = int(ds.get("PixelRepresentation", 0)) == 1
+    if bits == 8:
+        return np.dtype(np.int8 if signed else np.uint8)
+    if bits == 16:
+        dtype = np.dtype(np.int16 if signed else np.uint16)
+    elif bits == 32:
+        dtype = np.dtype(np.int32 if signed else np.uint32)
+    else:
+        raise ValueError(f"Неподдерживаемая глубина пикселей: {bits} бит")
+    return dtype.newbyteorder("<" if little_endian else ">")
+
+
+# Пиксели нужного кадра без чтения всего файла.
+# Несжатые данные открываем через memmap и сразу прореживаем с шагом step, так в память
+# попадают только нужные строки. Сжатые приходится декодировать, но только один кадр.
+def _read_frame(path, ds, frame, step):
+    rows, cols = int(ds.Rows), int(ds.Columns)
+    samples = int(ds.get("SamplesPerPixel", 1))
+    frames = int(ds.get("NumberOfFrames", 1) or 1)
+    frame = min(frame, frames - 1)
+
+    transfer_syntax = ds.file_meta.TransferSyntaxUID
+    # pydicom 3 по умолчанию дочитывает отложенное значение целиком, keep_deferred оставляет
+    # сырой элемент со смещением в файле. В pydicom 2 такого параметра нет, там он и так сырой.
+    try:
+        element = ds.get_item(PIXEL_DATA_TAG, keep_deferred=True)
+    except TypeError:
+        element = ds.get_item(PIXEL_DATA_TAG)
+
+    if not transfer_syntax.is_compressed and element is not None and getattr(element, "value_tell", None):
+        dtype = _pixel_dtype(ds, transfer_syntax.is_little_endian)
+        planar = int(ds.get("PlanarConfiguration", 0)) == 1 and samples > 1
+        frame_shape = (samples, rows, cols) if planar else (rows, cols, samples)
+
+        pixels = np.memmap(
+            path, dtype=dtype, mode="r", offset=element.value_tell,
+            shape=(frames, *frame_shape),
+        )[frame]
+        if planar:
+            pixels = pixels.transpose(1, 2, 0)
+        pixels = pixels[::step, ::step]
+    else:
+        try:
+            from pydicom.pixels import pixel_array
+            pixels = pixel_array(str(path), index=frame)
+        except ImportError:
+            pixels = ds.pixel_array
+            if frames > 1:
+                pixels = pixels[frame]
+        if pixels.ndim == 3 and samples == 1:
+            pixels = pixels[..., 0]
+        pixels = pixels[::step, ::step]
+
+    if pixels.ndim == 3 and pixels.shape[2] == 1:
+        pixels = pixels[..., 0]
+
+    return np.array(pixels)
+
+
+# Переводим значения детектора (12/16 бит) в 8 бит с учётом Rescale и окна.
+def apply_windowing(pixels, ds):
+    pixels = pixels.astype(np.float32)
+    pixels *= _first_value(ds, "RescaleSlope", 1.0)
+    pixels += _first_value(ds, "RescaleIntercept", 0.0)
+
+    center = _first_value(ds, "WindowCenter")
+    width = _first_value(ds, "WindowWidth")
+    if center is not None and width is not None and width > 1:
+        low = center - width / 2
+        high = center + width / 2
+    else:
+        low, high = np.percentile(pixels, AUTO_WINDOW_PERCENTILES)
+        if high <= low:
+            high = low + 1
+
+    pixels -= low
+    pixels *= 255.0 / (high - low)
+    np.clip(pixels, 0, 255, out=pixels)
+    pixels = pixels.astype(np.uint8)
+
+    if ds.get("PhotometricInterpretation", "MONOCHROME2") == "MONOCHROME1":
+        pixels = 255 - pixels
+
+    return pixels
+
+
+# Читаем DICOM в уменьшенном виде: обе стороны не меньше min_size, как и у обычных картинок.
+def decode_dicom(path, min_size=PREVIEW_SIZE, frame=0):
+    pydicom = _require_pydicom()
+    # Пиксели не читаем: их потом берём напрямую из файла через memmap.
+    ds = pydicom.dcmread(str(path), defer_size="1 KB")
+
+    rows, cols = int(ds.Rows), int(ds.Columns)
+    step = max(1, min(cols // min_size[0], rows // min_size[1]))
+
+    pixels = _read_frame(path, ds, frame, step)
+    if pixels.ndim == 3:
+        img = Image.fromarray(pixels.astype(np.uint8), "RGB")
+    else:
+        img = Image.fromarray(apply_windowing(pixels, ds)).convert("RGB")
+
+    return DecodedImage(
+        path, img, (cols, rows),
+        full_loader=lambda: decode_dicom(path, (cols, rows), frame).preview,
+    )
+
+
+# ID пациента из заголовка DICOM, без чтения пикселей. None, если не DICOM или поля нет.
+def read_patient_id(path):
+    pydicom = _require_pydicom()
+    try:
+        ds = pydicom.dcmread(str(path), stop_before_pixels=True)
+    except Exception:
+        return None
+    patient_id = ds.get("PatientID")
+    return str(patient_id).strip() if patient_id else None
@@ -0,0 +1,133 @@
+import argparse
+import sys
+import tempfile
+
+import numpy as np
+from PIL import Image
+
+from analysis import MASK_THRESHOLD, MODEL_INPUT_SIZE, collect_images, prepare_input
+from backends import MODEL_FILES, load_backend
+
+
+# Минимальное совпадение масок (IoU) с keras-моделью, ниже которого экспорт считаем неудачным.
+MIN_PARITY_IOU = 0.9
+
+
+# Разбираем аргументы командной строки.
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Экспорт model.keras в TFLite или ONNX и проверка совпадения масок",
+    )
+    parser.add_argument("format", choices=["tflite", "onnx"], help="во что экспортировать")
+    parser.add_argument("--model", default=str(MODEL_FILES['keras']), help="исходная keras-модель")
+    parser.add_argument("-o", "--output", default=None, help="куда сохранить (по умолчанию рядом с программой)")
+    parser.add_argument("--quantize", choices=["none", "float16", "int8"], default="none",
+                        help="квантование для TFLite")
+    parser.add_argument("--samples", default=None,
+                        help="папка со снимками для калибровки int8 и проверки масок")
+    parser.add_argument("--samples-count", type=int, default=32, help="сколько снимков брать из папки")
+    parser.add_argument("--skip-check", action="store_true", help="не сравнивать маски с keras-моделью")
+    return parser.parse_args(argv)
+
+
+# Входы для калибровки и проверки: настоящие снимки, если дали папку, иначе случайный шум.
+def load_samples(samples_dir, count):
+    if samples_dir:
+        paths = collect_images(samples_dir)[:count]
+        if paths:
+            inputs = []
+            for path in paths:
+                with Image.open(path) as img:
+                    inputs.append(prepare_input(img.convert("RGB")))
+            return np.stack(inputs)
+
+    print("Папка со снимками не задана, проверяю на случайных данных. Для int8 это плохая калибровка.")
+    rng = np.random.default_rng(0)
+    return rng.uniform(-1.0, 1.0, size=(count, *MODEL_INPUT_SIZE, 3)).astype(np.float32)
+
+
+# Конвертируем в TFLite через SavedModel: так конвертер нормально понимает модели Keras 3.
+def export_tflite(keras_model, output_path, quantize, samples):
+    import tensorflow as tf
+
+    with tempfile.TemporaryDirectory() as saved_model_dir:
+        keras_model.export(saved_model_dir, format="tf_saved_model")
+        converter = tf.lite.TFLiteConverter.from_saved_model(saved_model_dir)
+
+        if quantize == "float16":
+            converter.optimizations = [tf.lite.Optimize.DEFAULT]
+            converter.target_spec.supported_types = [tf.float16]
+        elif quantize == "int8":
+            def representative_dataset():
+                for sample in samples:
+                    yield [sample[np.newaxis]]
+
+            converter.optimizations = [tf.lite.Optimize.DEFAULT]
+            converter.representative_dataset = representative_dataset
+
+        tflite_model = converter.convert()
+
+    with open(output_path, "wb") as f:
+        f.write(tflite_model)
+
+
+# Конвертируем в ONNX средствами самого Keras.
+def export_onnx(keras_model, output_path):
+    keras_model.export(str(output_path), format="onnx")
+
+
+# Сравниваем маски keras-модели и экспортированной на одних и тех же входах.
+def check_parity(reference, candidate, samples):
+    ious = []
+    max_diff = 0.0
+
+    for sample in samples:
+        batch = sample[np.newaxis]
+        expected = np.squeeze(reference.predict(batch, verbose=0))
+        actual = np.squeeze(candidate.predict(batch, verbose=0))
+
+        max_diff = max(max_diff, float(np.max(np.abs(expected - actual))))
+
+        expected_mask = expected >= MASK_THRESHOLD
+        actual_mask = actual >= MASK_THRESHOLD
+        union = np.sum(expected_mask | actual_mask)
+        ious.append(1.0 if union == 0 else np.sum(expected_mask & actual_mask) / union)
+
+    return {
+        'min_iou': float(np.min(ious)),
+        'mean_iou': float(np.mean(ious)),
+        'max_prob_diff': max_diff,
+    }
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    output_path = args.output or MODEL_FILES[args.format]
+
+    reference = load_backend('keras', args.model)
+    samples = load_samples(args.samples, args.samples_count)
+
+    if args.format == "tflite":
+        export_tflite(reference.model, output_path, args.quantize, samples)
+    else:
+        export_onnx(reference.model, output_path)
+    print(f"Модель сохранена: {output_path}")
+
+    if args.skip_check:
+        return 0
+
+    candidate = load_backend(args.format, output_path)
+    parity = check_parity(reference, candidate, samples)
+    print(
+        f"Совпадение масок: IoU min {parity['min_iou']:.3f}, mean {parity['mean_iou']:.3f}, "
+        f"макс. разница вероятностей {parity['max_prob_diff']:.4f}"
+    )
+
+    if parity['min_iou'] < MIN_PARITY_IOU:
+        print(f"Маски расходятся сильнее допустимого (IoU < {MIN_PARITY_IOU}), эту модель лучше не использовать")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
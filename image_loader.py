@@ -0,0 +1,94 @@
+import threading
+from collections import OrderedDict
+from pathlib import Path
+
+from PIL import Image
+
+
+# До какого размера уменьшаем снимок при чтении. Этого хватает и на вход модели 256x256,
+# и на превью в окне, и на картинку с наложением.
+PREVIEW_SIZE = (1024, 1024)
+
+# Сколько прочитанных снимков держим в памяти.
+DECODE_CACHE_SIZE = 16
+
+
+# Прочитанный снимок: уменьшенная копия и размер исходника.
+# Полное разрешение читается отдельно и только по запросу (нужно для анализа по плиткам).
+# full_loader задают форматы, которые PIL сам не открывает (DICOM).
+class DecodedImage:
+    def __init__(self, path, preview, original_size, full_loader=None):
+        self.path = str(path)
+        self.preview = preview
+        self.original_size = original_size
+        self.full_loader = full_loader
+
+    def full(self):
+        if self.full_loader:
+            return self.full_loader()
+        with Image.open(self.path) as img:
+            return img.convert("RGB")
+
+
+# Читаем файл сразу в уменьшенном виде. JPEG умеет декодироваться в 1/2, 1/4, 1/8 размера
+# через draft, остальные форматы уменьшаем reduce сразу после чтения, пока картинка ещё одна.
+# Обе стороны результата не меньше min_size (если исходник сам не меньше).
+# DICOM читается своим путём, см. dicom_loader.py.
+def decode_reduced(path, min_size=PREVIEW_SIZE):
+    from dicom_loader import decode_dicom, is_dicom
+
+    if is_dicom(path):
+        return decode_dicom(path, min_size)
+
+    with Image.open(path) as img:
+        original_size = img.size
+
+        if img.format == "JPEG":
+            img.draft("RGB", min_size)
+
+        img = img.convert("RGB")
+
+    factor = min(img.width // min_size[0], img.height // min_size[1])
+    if factor >= 2:
+        img = img.reduce(factor)
+
+    return DecodedImage(path, img, original_size)
+
+
+# Кэш прочитанных снимков по пути, размеру и времени изменения файла.
+# Один и тот же снимок для превью, анализа и результата читается с диска один раз.
+class DecodeCache:
+    def __init__(self, max_items=DECODE_CACHE_SIZE):
+        self.max_items = max_items
+        self.items = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, path, min_size=PREVIEW_SIZE):
+        path = Path(path)
+        stat = path.stat()
+        key = (str(path.resolve()), stat.st_size, stat.st_mtime_ns, tuple(min_size))
+
+        with self.lock:
+            if key in self.items:
+                self.items.move_to_end(key)
+                return self.items[key]
+
+        decoded = decode_reduced(path, min_size)
+
+        with self.lock:
+            self.items[key] = decoded
+            while len(self.items) > self.max_items:
+                self.items.popitem(last=False)
+
+        return decoded
+
+
+decode_cache = DecodeCache()
+
+
+# Общая точка входа для окна, анализа и консольного режима.
+# use_cache=False для пакетов, чтобы тысячи снимков не вытесняли то, что открыто в окне.
+def load_image(path, min_size=PREVIEW_SIZE, use_cache=True):
+    if use_cache:
+        return decode_cache.get(path, min_size)
+    return decode_reduced(path, min_size)
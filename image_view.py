@@ -0,0 +1,92 @@
+from collections import OrderedDict
+
+import numpy as np
+from PIL import Image
+from PyQt6.QtCore import Qt
+from PyQt6.QtGui import QImage, QPixmap
+from PyQt6.QtWidgets import QLabel, QSizePolicy
+
+
+# Сколько отмасштабированных вариантов одной картинки держим. Обычно это текущий размер
+# виджета и пара предыдущих (окно развернули и вернули обратно).
+SCALED_CACHE_SIZE = 4
+
+QIMAGE_FORMATS = {
+    1: QImage.Format.Format_Grayscale8,
+    3: QImage.Format.Format_RGB888,
+    4: QImage.Format.Format_RGBA8888,
+}
+
+
+# QImage прямо поверх uint8-массива (HxW, HxWx3 или HxWx4), без копии пикселей.
+# QImage не владеет буфером: массив должен жить, пока жива картинка, поэтому держим его в атрибуте.
+# Такой QImage нельзя отдавать в сигнал с типом QImage: в другой поток уйдёт картинка без массива.
+def array_to_qimage(array):
+    array = np.ascontiguousarray(array, dtype=np.uint8)
+    height, width = array.shape[:2]
+    channels = array.shape[2] if array.ndim == 3 else 1
+    qimage = QImage(array.data, width, height, array.strides[0], QIMAGE_FORMATS[channels])
+    qimage.array = array
+    return qimage
+
+
+# Любая картинка приложения в QImage: QImage как есть, массив без копии.
+# PIL свой буфер наружу не отдаёт, поэтому из него одна копия в массив, дальше тоже без копий.
+def to_qimage(image):
+    if isinstance(image, QImage):
+        return image
+    if isinstance(image, Image.Image):
+        image = np.array(image.convert("RGB"))
+    return array_to_qimage(image)
+
+
+# Область просмотра снимка. Держит исходную картинку в памяти и масштабирует её под размер
+# виджета один раз: готовые QPixmap лежат в кэше по размеру, так что изменение размера окна
+# не читает файл заново и не пересчитывает уже виденные размеры.
+class ImageView(QLabel):
+    def __init__(self, placeholder="", parent=None):
+        super().__init__(parent)
+        self.placeholder = placeholder
+        self.source = None
+        self.scaled = OrderedDict()
+        self.setAlignment(Qt.AlignmentFlag.AlignCenter)
+        # Иначе QLabel просит размер по картинке, и окно растёт от каждого setPixmap.
+        self.setSizePolicy(QSizePolicy.Policy.Ignored, QSizePolicy.Policy.Ignored)
+        self.setText(placeholder)
+
+    def set_image(self, image):
+        self.source = to_qimage(image)
+        self.scaled.clear()
+        self.update_pixmap()
+
+    def clear_image(self):
+        self.source = None
+        self.scaled.clear()
+        self.clear()
+        self.setText(self.placeholder)
+
+    # Картинка под текущий размер: из кэша или масштабируем и запоминаем.
+    def scaled_pixmap(self, size):
+        key = (size.width(), size.height())
+        pixmap = self.scaled.get(key)
+        if pixmap is not None:
+            self.scaled.move_to_end(key)
+            return pixmap
+
+        pixmap = QPixmap.fromImage(self.source.scaled(
+            size, Qt.AspectRatioMode.KeepAspectRatio, Qt.TransformationMode.SmoothTransformation,
+        ))
+        self.scaled[key] = pixmap
+        if len(self.scaled) > SCALED_CACHE_SIZE:
+            self.scaled.popitem(last=False)
+        return pixmap
+
+    def update_pixmap(self):
+        size = self.contentsRect().size()
+        if self.source is None or size.isEmpty():
+            return
+        self.setPixmap(self.scaled_pixmap(size))
+
+    def resizeEvent(self, event):
+        super().resizeEvent(event)
+        self.update_pixmap()
@@ -0,0 +1,178 @@
+import os
+import queue
+import re
+import threading
+import time
+from pathlib import Path
+
+from analysis import BASE_DIR, IMAGE_EXTENSIONS
+
+
+# Папка, куда PACS или лаборант складывает новые снимки.
+INBOX_DIR = Path(os.environ.get("VKLADKI_INBOX", BASE_DIR / "inbox"))
+
+# Сколько готовых к анализу снимков может ждать в очереди. Когда очередь полная,
+# новые файлы просто лежат в папке и забираются, как только освободится место.
+INBOX_QUEUE_SIZE = 8
+
+POLL_INTERVAL = 2.0
+
+# Сколько раз возвращаем в очередь снимок, на котором отказала модель или сервер анализа.
+# Дальше он просто лежит во входящих до следующего запуска.
+INBOX_RETRIES = 3
+
+# Разобранные снимки уезжают из входящих в подпапки, иначе после перезапуска их проанализировали бы снова.
+PROCESSED_DIR = "processed"
+FAILED_DIR = "failed"
+
+# ID пациента в имени файла: первая группа из 3 и более цифр, например 001_hand.png.
+PATIENT_ID_PATTERN = re.compile(r"(\d{3,})")
+
+
+# ID пациента для снимка: сначала из заголовка DICOM, потом из имени файла.
+def patient_id_for(path):
+    try:
+        from dicom_loader import is_dicom, read_patient_id
+        if is_dicom(path):
+            patient_id = read_patient_id(path)
+            if patient_id:
+                return patient_id
+    except ImportError:
+        pass
+
+    match = PATIENT_ID_PATTERN.search(Path(path).stem)
+    return match.group(1) if match else None
+
+
+# Следит за папкой и складывает новые снимки в ограниченную очередь self.queue.
+# Если стоит watchdog, узнаём о файлах сразу (inotify и аналоги), иначе раз в POLL_INTERVAL
+# пересматриваем папку. Файл берём, только когда его размер перестал меняться,
+# чтобы не схватить недокопированный снимок.
+class InboxWatcher:
+    def __init__(self, inbox_dir=INBOX_DIR, queue_size=INBOX_QUEUE_SIZE, poll_interval=POLL_INTERVAL):
+        self.inbox_dir = Path(inbox_dir)
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.poll_interval = poll_interval
+
+        self.seen = set()
+        self.candidates = {}
+        self.retries = {}
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.stopped = threading.Event()
+
+        self.thread = None
+        self.observer = None
+
+    def start(self):
+        self.inbox_dir.mkdir(parents=True, exist_ok=True)
+        self.observer = self.start_observer()
+
+        self.thread = threading.Thread(target=self.run, name="inbox-watcher", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        self.wakeup.set()
+        if self.observer:
+            self.observer.stop()
+            self.observer.join(timeout=2)
+
+    # watchdog необязателен: без него работаем опросом папки.
+    def start_observer(self):
+        try:
+            from watchdog.events import FileSystemEventHandler
+            from watchdog.observers import Observer
+        except ImportError:
+            return None
+
+        watcher = self
+
+        class Handler(FileSystemEventHandler):
+            def on_any_event(self, event):
+                if not event.is_directory:
+                    watcher.wakeup.set()
+
+        observer = Observer()
+        observer.schedule(Handler(), str(self.inbox_dir), recursive=False)
+        observer.start()
+        return observer
+
+    # Файлы-кандидаты: подходящие по расширению и ещё не отправленные в очередь.
+    def scan(self):
+        found = {}
+        try:
+            entries = list(os.scandir(self.inbox_dir))
+        except OSError:
+            return found
+
+        for entry in entries:
+            if not entry.is_file() or Path(entry.name).suffix.lower() not in IMAGE_EXTENSIONS:
+                continue
+            stat = entry.stat()
+            key = (entry.path, stat.st_mtime_ns)
+            if key not in self.seen:
+                found[key] = stat.st_size
+        return found
+
+    # Убираем разобранный снимок из входящих: в processed/ или, если анализ не удался
+    # или пациент не найден, в failed/. Возвращаем новый путь (или старый, если переместить не вышло).
+    def archive(self, path, failed=False):
+        with self.lock:
+            self.retries.pop(str(path), None)
+        path = Path(path)
+        target_dir = self.inbox_dir / (FAILED_DIR if failed else PROCESSED_DIR)
+        target = target_dir / path.name
+        number = 1
+        while target.exists():
+            target = target_dir / f"{path.stem}_{number}{path.suffix}"
+            number += 1
+
+        try:
+            target_dir.mkdir(exist_ok=True)
+            os.replace(path, target)
+        except OSError:
+            return str(path)
+        return str(target)
+
+    # Снимок не разобрали не по своей вине (модель или сервер анализа): пусть watcher заберёт его снова.
+    # False, если попытки кончились.
+    def retry(self, path):
+        path = str(path)
+        with self.lock:
+            self.retries[path] = self.retries.get(path, 0) + 1
+            if self.retries[path] > INBOX_RETRIES:
+                return False
+            self.seen = {key for key in self.seen if key[0] != path}
+        self.wakeup.set()
+        return True
+
+    # Основной цикл: ждём события или таймаута, отбираем дописанные файлы и кладём в очередь.
+    # put блокируется, пока в очереди нет места - это и есть противодавление.
+    def run(self):
+        while not self.stopped.is_set():
+            self.wakeup.wait(self.poll_interval)
+            self.wakeup.clear()
+
+            found = self.scan()
+            ready = []
+            with self.lock:
+                for key, size in found.items():
+                    if self.candidates.get(key) == size:
+                        ready.append(key)
+                self.candidates = {key: size for key, size in found.items() if key not in ready}
+
+            for key in sorted(ready, key=lambda k: k[1]):
+                while not self.stopped.is_set():
+                    try:
+                        self.queue.put(key[0], timeout=self.poll_interval)
+                        break
+                    except queue.Full:
+                        continue
+                with self.lock:
+                    self.seen.add(key)
+
+            # Если что-то ещё докачивается, проверим его на следующем круге без ожидания события.
+            if self.candidates:
+                time.sleep(min(0.5, self.poll_interval))
+                self.wakeup.set()
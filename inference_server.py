@@ -0,0 +1,172 @@
+import json
+import os
+import secrets
+import sys
+import threading
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Client, Listener
+
+import numpy as np
+
+from analysis import BASE_DIR, MODEL_INPUT_SIZE, load_segmentation_model
+from metrics import span, start_exporters
+
+
+# Сюда сервер пишет порт и ключ, по ним окна программы находят уже прогретую модель.
+SERVER_INFO_FILE = BASE_DIR / ".inference_server.json"
+
+SERVER_HOST = "127.0.0.1"
+
+
+# Сервер анализа пропал (перезапустили из трея или он упал) и переподключиться не вышло.
+# Окно на это грузит модель у себя.
+class ServerUnavailable(RuntimeError):
+    pass
+
+
+# Модель на стороне окна, которая на самом деле живёт в процессе сервера.
+# Снаружи выглядит как обычная keras-модель: тот же predict(x, verbose=0).
+class RemoteModel:
+    def __init__(self, connection, model_path=None):
+        self.connection = connection
+        self.model_path = model_path
+        self.lock = threading.Lock()
+        self.lost = False
+
+    def request(self, x):
+        self.connection.send(('predict', x))
+        return self.connection.recv()
+
+    # Соединение оборвалось: переподключаемся к серверу (после перезапуска у него новый порт и ключ)
+    # и повторяем запрос один раз. Не вышло - ServerUnavailable, дальше окно обходится без сервера.
+    def predict(self, x, verbose=0, batch_size=None):
+        x = np.ascontiguousarray(x, dtype=np.float32)
+        with self.lock:
+            if self.lost:
+                raise ServerUnavailable("Нет связи с сервером анализа")
+            try:
+                status, payload = self.request(x)
+            except (EOFError, OSError):
+                status, payload = self.retry(x)
+
+        if status != 'ok':
+            raise RuntimeError(f"Сервер анализа вернул ошибку: {payload}")
+        return payload
+
+    def retry(self, x):
+        self.connection.close()
+        remote = connect_to_server()
+        if remote is not None:
+            self.connection = remote.connection
+            self.model_path = remote.model_path
+            try:
+                return self.request(x)
+            except (EOFError, OSError):
+                self.connection.close()
+
+        self.lost = True
+        raise ServerUnavailable("Сервер анализа недоступен, модель будет загружена в окне")
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+
+# Пробуем подключиться к запущенному серверу. Если его нет или он не отвечает, возвращаем None,
+# и тогда окно грузит модель само.
+def connect_to_server():
+    if not SERVER_INFO_FILE.exists():
+        return None
+
+    try:
+        info = json.loads(SERVER_INFO_FILE.read_text(encoding="utf-8"))
+        connection = Client((SERVER_HOST, info['port']), authkey=bytes.fromhex(info['authkey']))
+        connection.send(('ping', None))
+        status, _ = connection.recv()
+    except (OSError, EOFError, ValueError, KeyError, AuthenticationError):
+        return None
+
+    if status != 'ok':
+        connection.close()
+        return None
+
+    print(f"Подключился к серверу анализа на порту {info['port']}")
+    return RemoteModel(connection, info.get('model_path'))
+
+
+# Обслуживаем одно подключённое окно, пока оно не закроется.
+def serve_connection(connection, model, model_lock):
+    with connection:
+        while True:
+            try:
+                command, payload = connection.recv()
+            except (EOFError, OSError):
+                return
+
+            if command == 'ping':
+                connection.send(('ok', None))
+            elif command == 'predict':
+                try:
+                    with model_lock:
+                        with span("server_predict"):
+                            result = model.predict(payload, verbose=0, batch_size=len(payload))
+                    connection.send(('ok', result))
+                except Exception as e:
+                    connection.send(('error', str(e)))
+            else:
+                connection.send(('error', f"Неизвестная команда: {command}"))
+
+
+# Грузим модель, делаем один прогревочный predict и ждём подключений от окон.
+def run_server(port=0):
+    start_exporters()
+    model = load_segmentation_model()
+    warmup = np.zeros((1, *MODEL_INPUT_SIZE, 3), dtype=np.float32)
+    model.predict(warmup, verbose=0)
+
+    authkey = secrets.token_bytes(32)
+    listener = Listener((SERVER_HOST, port), authkey=authkey)
+    port = listener.address[1]
+
+    SERVER_INFO_FILE.write_text(
+        json.dumps({
+            'port': port,
+            'authkey': authkey.hex(),
+            'pid': os.getpid(),
+            'model_path': str(model.model_path),
+        }),
+        encoding="utf-8",
+    )
+    print(f"Сервер анализа готов, порт {port}")
+
+    model_lock = threading.Lock()
+
+    try:
+        while True:
+            try:
+                connection = listener.accept()
+            except (OSError, AuthenticationError):
+                # Сюда попадают и подключения с неверным ключом, сервер из-за них не падает.
+                continue
+
+            thread = threading.Thread(
+                target=serve_connection,
+                args=(connection, model, model_lock),
+                daemon=True,
+            )
+            thread.start()
+    finally:
+        listener.close()
+        SERVER_INFO_FILE.unlink(missing_ok=True)
+
+
+def main():
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else 0
+    try:
+        run_server(port)
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+import numpy as np
+from scipy import ndimage
+
+
+# Пятна меньше этой доли маски считаем шумом и выбрасываем до всех подсчётов.
+# На маске 256x256 это около 13 пикселей.
+MIN_BLOB_RATIO = 0.0002
+
+# Восьмисвязность: пиксели, касающиеся углами, относятся к одному очагу.
+CONNECTIVITY = np.ones((3, 3), dtype=bool)
+
+
+# Разбираем маску вероятностей на отдельные очаги одним проходом: разметка связных областей,
+# удаление мелких пятен, рамка, площадь и вероятности каждого очага. Всё считается
+# по массивам меток сразу для всех очагов, без цикла по пикселям.
+# Возвращаем (очаги от крупного к мелкому, бинарная маска без мелких пятен).
+# Рамка очага - (top, bottom, left, right) в пикселях маски, bbox_norm - то же в долях от её сторон.
+def find_lesions(pred_mask, mask_threshold, min_blob_ratio=MIN_BLOB_RATIO):
+    binary_mask = pred_mask >= mask_threshold
+    labels, count = ndimage.label(binary_mask, structure=CONNECTIVITY)
+    if count == 0:
+        return [], binary_mask
+
+    flat_labels = labels.ravel()
+    areas = np.bincount(flat_labels, minlength=count + 1)
+    sums = np.bincount(flat_labels, weights=pred_mask.ravel(), minlength=count + 1)
+
+    min_pixels = max(1, int(round(min_blob_ratio * binary_mask.size)))
+    keep = areas >= min_pixels
+    keep[0] = False
+
+    kept_ids = np.flatnonzero(keep)
+    if kept_ids.size == 0:
+        return [], np.zeros_like(binary_mask)
+
+    maxima = ndimage.maximum(pred_mask, labels, kept_ids)
+    slices = ndimage.find_objects(labels)
+    height, width = binary_mask.shape
+
+    lesions = []
+    for label, max_prob in zip(kept_ids, np.atleast_1d(maxima)):
+        rows, cols = slices[label - 1]
+        area = int(areas[label])
+        lesions.append({
+            'bbox': (rows.start, rows.stop, cols.start, cols.stop),
+            'bbox_norm': (rows.start / height, rows.stop / height, cols.start / width, cols.stop / width),
+            'area_px': area,
+            'area_ratio': area / binary_mask.size,
+            'max_prob': float(max_prob),
+            'mean_prob': float(sums[label] / area),
+        })
+
+    lesions.sort(key=lambda lesion: lesion['area_px'], reverse=True)
+    for number, lesion in enumerate(lesions, start=1):
+        lesion['id'] = number
+
+    # Очищенная маска через таблицу "метка -> оставить", без второго прохода по областям.
+    return lesions, keep[labels]
+
+
+# Очаг в координатах исходного снимка, для заключения: рамка в пикселях снимка и площадь в процентах.
+def lesion_in_image(lesion, original_size):
+    width, height = original_size
+    top, bottom, left, right = lesion['bbox_norm']
+    return {
+        'id': lesion['id'],
+        'x': int(round(left * width)),
+        'y': int(round(top * height)),
+        'width': int(round((right - left) * width)),
+        'height': int(round((bottom - top) * height)),
+        'area_percent': round(lesion['area_ratio'] * 100, 3),
+        'max_prob': round(lesion['max_prob'], 3),
+        'mean_prob': round(lesion['mean_prob'], 3),
+    }
@@ -1,91 +1,53 @@
 import sys
 import os
-import random
-from tensorflow import keras
-import numpy as np
+import json
+import queue
 from pathlib import Path
-from tensorflow import keras
-from PIL import Image
-from tensorflow.keras.applications.mobilenet_v2 import preprocess_input
 from PyQt6.QtWidgets import (
     QApplication, QMainWindow, QWidget, QVBoxLayout, QHBoxLayout,
     QLabel, QPushButton, QFrame, QProgressBar, QFileDialog,
     QMessageBox, QListWidget, QTextEdit, QSplitter, QTabWidget,
-    QScrollArea, QGridLayout, QLineEdit, QComboBox, QDateEdit,
-    QGroupBox, QTextBrowser
+    QLineEdit, QComboBox, QDateEdit,
+    QGroupBox, QTextBrowser, QCheckBox, QListView, QListWidgetItem, QSlider
 )
-from PyQt6.QtCore import Qt, QTimer, QDate
+from PyQt6.QtCore import Qt, QTimer, QDate, QThreadPool
 from PyQt6.QtGui import QPixmap, QFont, QIcon, QPainter, QColor
 from PyQt6.QtCore import QSize
 
+from analysis import ANALYSIS_STAGES, MASK_THRESHOLD, STAGE_TITLES, collect_images, evaluate_mask, overlay_array
+from artifact_store import ArtifactStore
+from patient_list import PatientCardDelegate, PatientListModel, PatientRole
+from patient_store import (
+    ALL_STATUSES, STATUS_DONE, STATUS_NEEDS_ANALYSIS, STATUS_NEW_IMAGES, PatientStore,
+)
+from result_cache import ResultCache
+from image_loader import load_image
+from image_view import ImageView
+from inbox_watcher import InboxWatcher, patient_id_for
+from inference_server import RemoteModel
+from lesions import lesion_in_image
+from reports import lesion_lines
+from metrics import registry, start_exporters
+from process_pool import WORKER_PROCESSES, AnalysisProcessPool
+from thumbnail_cache import THUMBNAIL_SIZE, ThumbnailCache
+from workers import AnalysisWorker, BatchAnalysisWorker, ModelLoadWorker, ReportWorker, ThumbnailWorker
 
-class PatientCard(QFrame):
-    # Создаём карточку одного пациента для списка на первой вкладке.
-    def __init__(self, patient_data, parent=None):
-        super().__init__(parent)
-        self.patient_data = patient_data
-        self.parent = parent
-        self.setup_ui()
-
-    # Тут просто собираем внешний вид карточки.
-    def setup_ui(self):
-        self.setStyleSheet("""
-            PatientCard {
-                background-color: white;
-                border: 2px solid #e2e8f0;
-                border-radius: 10px;
-                padding: 15px;
-            }
-            PatientCard:hover {
-                border-color: #2c5aa0;
-                background-color: #f8fafc;
-            }
-        """)
-        self.setCursor(Qt.CursorShape.PointingHandCursor)
-
-        layout = QVBoxLayout(self)
-
-        name_label = QLabel(f"👤 {self.patient_data['name']}")
-        name_label.setStyleSheet("font-weight: bold; font-size: 16px; color: #2c5aa0;")
-
-        info_layout = QHBoxLayout()
-        info_layout.addWidget(QLabel(f"🎂 {self.patient_data['age']} лет"))
-        info_layout.addWidget(QLabel(f"📋 №{self.patient_data['id']}"))
-
-        diagnosis_label = QLabel(f"📝 Диагноз: {self.patient_data['diagnosis']}")
-        diagnosis_label.setStyleSheet("color: #666666; font-size: 12px;")
 
-        status_label = QLabel(f"📍 {self.patient_data['status']}")
-        status_color = "#dc2626" if self.patient_data['status'] == "Требуется анализ" else "#16a34a"
-        status_label.setStyleSheet(f"color: {status_color}; font-weight: bold;")
+# Сколько снимков из папки входящих может одновременно стоять в очереди анализа.
+# Остальные ждут в очереди наблюдателя, чтобы ручные снимки врача не застревали за ними.
+MAX_INBOX_IN_FLIGHT = 2
 
-        layout.addWidget(name_label)
-        layout.addLayout(info_layout)
-        layout.addWidget(diagnosis_label)
-        layout.addWidget(status_label)
+# Сколько ждём после последнего нажатия клавиши, прежде чем искать в базе.
+SEARCH_DEBOUNCE_MS = 250
 
-        select_btn = QPushButton("Выбрать пациента")
-        select_btn.setStyleSheet("""
-            QPushButton {
-                background-color: #2c5aa0;
-                color: white;
-                border: none;
-                padding: 8px 16px;
-                border-radius: 5px;
-                font-size: 12px;
-            }
-            QPushButton:hover {
-                background-color: #1e3a8a;
-            }
-        """)
-        select_btn.clicked.connect(self.select_patient)
+# Порог маски на ползунке меняется в процентах, в этих пределах.
+THRESHOLD_RANGE = (5, 95)
 
-        layout.addWidget(select_btn)
+# Пересчёт результата по порогу ждёт, пока ползунок перестанут двигать хотя бы на столько.
+THRESHOLD_DEBOUNCE_MS = 40
 
-    # Когда нажимают кнопку, просто передаём выбранного пациента в главное окно.
-    def select_patient(self):
-        if self.parent:
-            self.parent.select_patient(self.patient_data)
+UPLOAD_PLACEHOLDER = "Снимок не загружен\n\nНажмите 'Загрузить снимок' или перетащите файл"
+RESULT_PLACEHOLDER = "Снимок не загружен"
 
 
 class MedicalApp(QMainWindow):
@@ -120,31 +82,95 @@ class MedicalApp(QMainWindow):
         """)
 
         self.current_patient = None
+        self.current_study_id = None
         self.current_image_path = None
-        self.analysis_timer = None
-        self.last_mask_img = None
-        self.last_overlay_path = None
+        self.last_lesions = []
+        # Карта вероятностей показанного результата: по ней ползунок порога пересчитывает вывод без модели.
+        self.last_analysis = None
+
+        # Анализ идёт в отдельном потоке. Поток один, остальные снимки ждут в очереди пула.
+        self.thread_pool = QThreadPool(self)
+        self.thread_pool.setMaxThreadCount(1)
+        self.job_counter = 0
+        self.active_workers = {}
+        self.stage_timings = []
+        # Сколько снимков пакета из папки не нашли своего пациента в базе, по номеру задачи.
+        self.batch_unmatched = {}
+        self.result_cache = ResultCache()
+        # Маски исследований: по ним наложение перерисовывается при открытии снимка из истории.
+        self.artifacts = ArtifactStore()
+
+        # Миниатюры истории снимков читаются в своём потоке, чтобы не ждать очередь анализа.
+        self.thumbnail_cache = ThumbnailCache()
+        self.thumbnail_pool = QThreadPool(self)
+        self.thumbnail_pool.setMaxThreadCount(1)
+        self.thumbnail_workers = set()
+        self.gallery_items = {}
+        self.gallery_counter = 0
+
+        # Модель грузится в фоне уже после показа окна, пока её нет - анализ недоступен.
+        self.model = None
+        self.model_error = None
+        self.model_loader = None
+
+        # Пакеты можно раздавать нескольким процессам анализа (VKLADKI_WORKERS больше 1).
+        # Пул поднимается при первом пакете: каждому процессу грузить свою модель долго.
+        self.process_pool = None
+
+        # Отчёты (PDF и JSON) пишутся в фоне, окно в это время работает.
+        self.report_workers = set()
 
-        self.model = self.load_segmentation_model()
         self.init_ui()
-        self.load_sample_patients()
-
-    # Пытаемся найти и загрузить модель рядом с файлом программы.
-    def load_segmentation_model(self):
-        base_dir = Path(__file__).resolve().parent
-        possible_paths = [
-            base_dir / "model.keras",
-        ]
-
-        for model_path in possible_paths:
-            if model_path.exists():
-                print(f"Загружаю модель: {model_path}")
-                return keras.models.load_model(
-                    str(model_path),
-                    compile=False,
-                )
+        self.load_patients()
+        QTimer.singleShot(0, self.load_segmentation_model)
+
+        # Папка входящих: новые снимки сами встают в очередь анализа и привязываются к пациенту.
+        self.inbox_in_flight = 0
+        self.inbox_watcher = InboxWatcher()
+        self.inbox_watcher.start()
+        self.inbox_timer = QTimer(self)
+        self.inbox_timer.timeout.connect(self.drain_inbox)
+        self.inbox_timer.start(500)
+
+    # Запускаем фоновую загрузку модели, окно в это время уже можно листать.
+    def load_segmentation_model(self, local=False):
+        self.model_loader = ModelLoadWorker(local)
+        self.model_loader.signals.loaded.connect(self.on_model_loaded)
+        self.model_loader.signals.failed.connect(self.on_model_failed)
+        QThreadPool.globalInstance().start(self.model_loader)
+        self.update_analyze_button()
+
+    # Модель готова, можно анализировать.
+    def on_model_loaded(self, model):
+        self.model = model
+        self.model_loader = None
+        self.update_analyze_button()
+
+    # Модель не загрузилась: окно работает, но без анализа.
+    def on_model_failed(self, error):
+        self.model_error = error
+        self.model_loader = None
+        self.update_analyze_button()
+        QMessageBox.critical(self, "Ошибка", f"Не удалось загрузить модель: {error}")
+
+    # Сервер анализа пропал и переподключиться не удалось: модель грузим в окне,
+    # следующие снимки пойдут уже через неё.
+    def reload_lost_model(self):
+        if isinstance(self.model, RemoteModel) and self.model.lost and self.model_loader is None:
+            self.model = None
+            self.load_segmentation_model(local=True)
+            self.status_label.setText("Сервер анализа недоступен, модель загружается в окне...")
+
+    # Кнопка анализа активна, только когда есть и модель, и снимок.
+    def update_analyze_button(self):
+        if self.model is not None:
+            self.analyze_btn.setText("🔍 Начать анализ снимка")
+        elif self.model_error:
+            self.analyze_btn.setText("⛔ Модель недоступна")
+        else:
+            self.analyze_btn.setText("⏳ Модель загружается...")
 
-        raise FileNotFoundError("Модель не найдена")
+        self.analyze_btn.setEnabled(self.model is not None and bool(self.current_image_path))
 
     # Здесь создаём вкладки и подключаем их к главному окну.
     def init_ui(self):
@@ -180,27 +206,60 @@ class MedicalApp(QMainWindow):
         self.search_input.setStyleSheet("padding: 8px; border: 1px solid #e2e8f0; border-radius: 5px;")
 
         self.status_filter = QComboBox()
-        self.status_filter.addItems(["Все статусы", "Требуется анализ", "Анализ завершен", "Новые снимки"])
+        self.status_filter.addItems([ALL_STATUSES, STATUS_NEEDS_ANALYSIS, STATUS_DONE, STATUS_NEW_IMAGES])
         self.status_filter.setStyleSheet("padding: 8px; border: 1px solid #e2e8f0; border-radius: 5px;")
 
-        self.search_input.textChanged.connect(self.display_patients)
-        self.status_filter.currentIndexChanged.connect(self.display_patients)
+        # Поиск запускаем не на каждую букву, а когда врач перестал печатать.
+        self.search_timer = QTimer(self)
+        self.search_timer.setSingleShot(True)
+        self.search_timer.setInterval(SEARCH_DEBOUNCE_MS)
+        self.search_timer.timeout.connect(self.apply_patient_filter)
+
+        self.search_input.textChanged.connect(self.search_timer.start)
+        self.status_filter.currentIndexChanged.connect(self.apply_patient_filter)
+
+        folder_batch_btn = QPushButton("🗂 Пакетный анализ папки")
+        folder_batch_btn.setStyleSheet("padding: 8px;")
+        folder_batch_btn.clicked.connect(self.start_folder_batch)
+
+        # Выгрузка заключений по всем исследованиям выбранного дня одним файлом.
+        self.report_date = QDateEdit()
+        self.report_date.setDate(QDate.currentDate())
+        self.report_date.setCalendarPopup(True)
+
+        day_reports_btn = QPushButton("📄 Отчёты за день")
+        day_reports_btn.setStyleSheet("padding: 8px;")
+        day_reports_btn.clicked.connect(self.export_day_reports)
 
         filter_layout.addWidget(self.search_input)
         filter_layout.addWidget(self.status_filter)
         filter_layout.addStretch()
-
-        scroll_area = QScrollArea()
-        self.patients_container = QWidget()
-        self.patients_grid = QGridLayout(self.patients_container)
-
-        scroll_area.setWidget(self.patients_container)
-        scroll_area.setWidgetResizable(True)
-        scroll_area.setStyleSheet("border: none;")
+        filter_layout.addWidget(folder_batch_btn)
+        filter_layout.addWidget(self.report_date)
+        filter_layout.addWidget(day_reports_btn)
+
+        self.patients_count_label = QLabel("")
+        self.patients_count_label.setStyleSheet("color: #666666;")
+
+        self.report_status_label = QLabel("")
+        self.report_status_label.setStyleSheet("color: #666666; font-style: italic;")
+
+        # Список рисует карточки сам и только для видимых строк, виджетов на каждого пациента нет.
+        self.patients_view = QListView()
+        self.patients_view.setUniformItemSizes(True)
+        self.patients_view.setItemDelegate(PatientCardDelegate(self.patients_view))
+        self.patients_view.setMouseTracking(True)
+        self.patients_view.setVerticalScrollMode(QListView.ScrollMode.ScrollPerPixel)
+        self.patients_view.setCursor(Qt.CursorShape.PointingHandCursor)
+        self.patients_view.setStyleSheet("QListView { border: none; background-color: transparent; }")
+        self.patients_view.clicked.connect(self.on_patient_clicked)
+        self.patients_view.activated.connect(self.on_patient_clicked)
 
         layout.addWidget(title)
         layout.addWidget(filter_frame)
-        layout.addWidget(scroll_area)
+        layout.addWidget(self.patients_count_label)
+        layout.addWidget(self.report_status_label)
+        layout.addWidget(self.patients_view)
 
         return tab
 
@@ -238,8 +297,7 @@ class MedicalApp(QMainWindow):
 
         upload_title = QLabel("Рентгеновские снимки пациента")
 
-        self.upload_area = QLabel()
-        self.upload_area.setAlignment(Qt.AlignmentFlag.AlignCenter)
+        self.upload_area = ImageView(UPLOAD_PLACEHOLDER)
         self.upload_area.setMinimumHeight(300)
         self.upload_area.setStyleSheet("""
             QLabel {
@@ -250,21 +308,28 @@ class MedicalApp(QMainWindow):
                 font-size: 14px;
             }
         """)
-        self.upload_area.setText("Снимок не загружен\n\nНажмите 'Загрузить снимок' или перетащите файл")
 
         upload_btn = QPushButton("📁 Загрузить снимок")
         upload_btn.clicked.connect(self.upload_image)
         upload_btn.setStyleSheet("padding: 12px; font-size: 14px;")
 
+        batch_btn = QPushButton("🗂 Пакетный анализ снимков")
+        batch_btn.clicked.connect(self.start_patient_batch)
+        batch_btn.setStyleSheet("padding: 12px; font-size: 14px;")
+
         gallery_label = QLabel("История снимков:")
         gallery_label.setStyleSheet("font-weight: bold; color: #2c5aa0; margin-top: 10px;")
 
         self.gallery_list = QListWidget()
         self.gallery_list.setStyleSheet("border: 1px solid #e2e8f0; border-radius: 5px;")
+        self.gallery_list.setIconSize(QSize(*THUMBNAIL_SIZE))
+        self.gallery_list.setUniformItemSizes(True)
+        self.gallery_list.itemActivated.connect(self.open_study)
 
         left_layout.addWidget(upload_title)
         left_layout.addWidget(self.upload_area)
         left_layout.addWidget(upload_btn)
+        left_layout.addWidget(batch_btn)
         left_layout.addWidget(gallery_label)
         left_layout.addWidget(self.gallery_list)
 
@@ -292,6 +357,20 @@ class MedicalApp(QMainWindow):
         group_layout.addWidget(QLabel("Комментарии:"))
         group_layout.addWidget(self.comments_input)
 
+        # Для больших снимков: модель смотрит снимок целиком по плиткам, а не уменьшенную копию.
+        self.tiled_checkbox = QCheckBox("Анализ в полном разрешении (медленнее, видно мелкие трещины)")
+        group_layout.addWidget(self.tiled_checkbox)
+
+        # Несколько вариантов снимка (отражения, масштабы) одной пачкой, вероятности усредняются.
+        self.tta_checkbox = QCheckBox("Повышенная чувствительность (несколько вариантов снимка, медленнее)")
+        group_layout.addWidget(self.tta_checkbox)
+
+        self.overlay_mode = QComboBox()
+        self.overlay_mode.addItem("Подсветка найденной области", 'mask')
+        self.overlay_mode.addItem("Тепловая карта вероятностей", 'heatmap')
+        group_layout.addWidget(QLabel("Отображение результата:"))
+        group_layout.addWidget(self.overlay_mode)
+
         self.progress_bar = QProgressBar()
         self.progress_bar.setVisible(False)
 
@@ -346,14 +425,30 @@ class MedicalApp(QMainWindow):
         image_label = QLabel("Проанализированный снимок")
         image_label.setStyleSheet("font-weight: bold; color: #2c5aa0;")
 
-        self.result_image = QLabel()
-        self.result_image.setAlignment(Qt.AlignmentFlag.AlignCenter)
+        self.result_image = ImageView(RESULT_PLACEHOLDER)
         self.result_image.setMinimumSize(400, 400)
         self.result_image.setStyleSheet("QLabel { background-color: white; border: 1px solid #e2e8f0; border-radius: 5px; }")
-        self.result_image.setText("Снимок не загружен")
+
+        threshold_layout = QHBoxLayout()
+        self.threshold_label = QLabel()
+        self.threshold_slider = QSlider(Qt.Orientation.Horizontal)
+        self.threshold_slider.setRange(*THRESHOLD_RANGE)
+        self.threshold_slider.setValue(int(round(MASK_THRESHOLD * 100)))
+        self.threshold_slider.setEnabled(False)
+        self.threshold_slider.valueChanged.connect(self.on_threshold_changed)
+        self.threshold_slider.sliderReleased.connect(self.apply_threshold)
+        threshold_layout.addWidget(self.threshold_label)
+        threshold_layout.addWidget(self.threshold_slider)
+        self.update_threshold_label()
+
+        self.threshold_timer = QTimer(self)
+        self.threshold_timer.setSingleShot(True)
+        self.threshold_timer.setInterval(THRESHOLD_DEBOUNCE_MS)
+        self.threshold_timer.timeout.connect(self.apply_threshold)
 
         left_layout.addWidget(image_label)
         left_layout.addWidget(self.result_image)
+        left_layout.addLayout(threshold_layout)
 
         right_frame = QFrame()
         right_layout = QVBoxLayout(right_frame)
@@ -432,81 +527,38 @@ class MedicalApp(QMainWindow):
 
         return tab
 
-    # Показываем итоговую картинку на третьей вкладке.
-    def display_result_image(self, image_path):
-        pixmap = QPixmap(str(image_path))
-
-        if pixmap.isNull():
-            QMessageBox.warning(self, "Ошибка", f"Не удалось открыть изображение: {image_path}")
-            return
-
-        self.result_image.setPixmap(
-            pixmap.scaled(
-                self.result_image.size(),
-                Qt.AspectRatioMode.KeepAspectRatio,
-                Qt.TransformationMode.SmoothTransformation,
-            )
-        )
-        self.result_image.setAlignment(Qt.AlignmentFlag.AlignCenter)
-
-    # Подкидываем тестовых пациентов, чтобы интерфейс не был пустым.
-    def load_sample_patients(self):
-        self.patients = [
-            {
-                'id': '001', 'name': 'Иванов Алексей Петрович', 'age': 45,
-                'diagnosis': 'Подозрение на перелом лучевой кости', 'status': 'Требуется анализ'
-            },
-            {
-                'id': '002', 'name': 'Петрова Мария Сергеевна', 'age': 62,
-                'diagnosis': 'Контроль после эндопротезирования тазобедренного сустава', 'status': 'Анализ завершен'
-            },
-            {
-                'id': '003', 'name': 'Сидоров Дмитрий Иванович', 'age': 28,
-                'diagnosis': 'Спортивная травма коленного сустава', 'status': 'Требуется анализ'
-            },
-            {
-                'id': '004', 'name': 'Козлова Анна Викторовна', 'age': 35,
-                'diagnosis': 'Артроз голеностопного сустава', 'status': 'Новые снимки'
-            },
-            {
-                'id': '005', 'name': 'Николаев Владимир Александрович', 'age': 71,
-                'diagnosis': 'Остеопороз, компрессионный перелом', 'status': 'Анализ завершен'
-            },
-            {
-                'id': '006', 'name': 'Федорова Екатерина Олеговна', 'age': 52,
-                'diagnosis': 'Посттравматическая деформация плечевой кости', 'status': 'Требуется анализ'
-            }
-        ]
-        self.display_patients()
-
-    # Обновляем список пациентов с учётом поиска и фильтра.
-    def display_patients(self):
-        for i in reversed(range(self.patients_grid.count())):
-            item = self.patients_grid.itemAt(i)
-            w = item.widget()
-            if w:
-                w.setParent(None)
-
-        search_text = self.search_input.text().strip().lower() if hasattr(self, "search_input") else ""
-        status_selected = self.status_filter.currentText() if hasattr(self, "status_filter") else "Все статусы"
-
-        filtered = []
-        for p in self.patients:
-            match_search = (search_text in p['name'].lower()) or (search_text in p['id'].lower())
-            if search_text and not match_search:
-                continue
-            if status_selected != "Все статусы" and p['status'] != status_selected:
-                continue
-            filtered.append(p)
-
-        row, col = 0, 0
-        for patient in filtered:
-            card = PatientCard(patient, self)
-            self.patients_grid.addWidget(card, row, col)
-            col += 1
-            if col > 1:
-                col = 0
-                row += 1
+    # Показываем итоговую картинку на третьей вкладке: массив наложения, PIL-картинку или QImage.
+    # С диска ничего не читаем, под размер виджета масштабирует ImageView.
+    def display_result_image(self, image):
+        self.result_image.set_image(image)
+
+    # Открываем базу пациентов. При первом запуске она сама заполнится тестовыми пациентами.
+    def load_patients(self):
+        self.store = PatientStore()
+        self.patient_model = PatientListModel(self.store, self)
+        self.patients_view.setModel(self.patient_model)
+        self.apply_patient_filter()
+
+    # Новый поиск или фильтр: модель берёт из базы первую страницу, остальное догружает при прокрутке.
+    def apply_patient_filter(self):
+        self.search_timer.stop()
+        self.patient_model.set_filter(self.search_input.text().strip(), self.status_filter.currentText())
+        self.update_patients_count()
+
+    # У пациента появилось исследование и сменился статус: обновляем только его карточку в списке,
+    # чтобы фоновые результаты не сбрасывали врачу прокрутку.
+    def update_patient_row(self, patient_id):
+        self.patient_model.update_patient(patient_id)
+        self.update_patients_count()
+
+    def update_patients_count(self):
+        self.patients_count_label.setText(f"Найдено пациентов: {self.patient_model.total}")
+
+    # Клик или Enter по строке списка открывает карточку пациента.
+    def on_patient_clicked(self, index):
+        patient = index.data(PatientRole)
+        if patient is not None:
+            self.select_patient(patient)
 
     # Когда выбрали пациента, открываем его карточку и сбрасываем старый снимок.
     def select_patient(self, patient_data):
@@ -520,10 +572,7 @@ class MedicalApp(QMainWindow):
         )
 
         self.current_image_path = None
-        self.upload_area.clear()
-        self.upload_area.setText(
-            "Снимок не загружен\n\nНажмите 'Загрузить снимок' или перетащите файл"
-        )
+        self.upload_area.clear_image()
         self.analyze_btn.setEnabled(False)
 
         self.tab_widget.setTabEnabled(1, True)
@@ -531,12 +580,64 @@ class MedicalApp(QMainWindow):
 
         self.update_patient_gallery()
 
-    # Обновляем список прошлых снимков пациента.
+    # Обновляем список прошлых снимков пациента. Строки берём из базы сразу,
+    # а миниатюры подгружаются в фоне и появляются по мере готовности.
     def update_patient_gallery(self):
+        for worker in self.thumbnail_workers:
+            worker.cancel()
         self.gallery_list.clear()
-        sample_images = ["Рентген правой руки (12.01.2024)", "КТ левого колена (05.01.2024)"]
-        for image in sample_images:
-            self.gallery_list.addItem(image)
+        self.gallery_items = {}
+
+        if not self.current_patient:
+            return
+
+        items = []
+        for study in self.store.list_studies(self.current_patient['id']):
+            text = self.gallery_text(study['image_path'], study['study_date'], study['has_fracture'], study['confidence'])
+            items.append((self.add_gallery_row(text, at_top=False, study_id=study['id']), study['image_path']))
+
+        self.load_thumbnails(items)
+
+    # Подпись строки истории: файл, дата и вывод модели, если анализ уже был.
+    def gallery_text(self, image_path, study_date, has_fracture=None, confidence=None):
+        filename = os.path.basename(image_path)
+        if has_fracture is None:
+            return f"{filename} ({study_date})"
+        verdict = "обнаружен перелом" if has_fracture else "переломов не обнаружено"
+        return f"{filename} ({study_date}): {verdict} ({confidence}%)"
+
+    # Добавляем строку в историю и возвращаем её метку, по которой потом придёт миниатюра.
+    # В строке запоминаем ID исследования, чтобы открыть его результат двойным щелчком.
+    def add_gallery_row(self, text, at_top=True, study_id=None):
+        self.gallery_counter += 1
+        item = QListWidgetItem(text)
+        item.setData(Qt.ItemDataRole.UserRole, study_id)
+        if at_top:
+            self.gallery_list.insertItem(0, item)
+        else:
+            self.gallery_list.addItem(item)
+        self.gallery_items[self.gallery_counter] = item
+        return self.gallery_counter
+
+    # Новый снимок в истории: строка сверху, миниатюра в фоне.
+    def add_gallery_item(self, image_path, text, study_id=None):
+        self.load_thumbnails([(self.add_gallery_row(text, study_id=study_id), image_path)])
+
+    def load_thumbnails(self, items):
+        if not items:
+            return
+
+        worker = ThumbnailWorker(self.thumbnail_cache, items)
+        worker.signals.loaded.connect(self.on_thumbnail_loaded)
+        worker.signals.finished.connect(lambda: self.thumbnail_workers.discard(worker))
+        self.thumbnail_workers.add(worker)
+        self.thumbnail_pool.start(worker)
+
+    # Миниатюра готова. Если историю уже перерисовали под другого пациента, строки нет - пропускаем.
+    def on_thumbnail_loaded(self, token, image):
+        item = self.gallery_items.get(token)
+        if item is not None:
+            item.setIcon(QIcon(QPixmap.fromImage(image)))
 
     # Открываем окно выбора файла и подгружаем снимок в интерфейс.
     def upload_image(self):
@@ -544,149 +645,456 @@ class MedicalApp(QMainWindow):
             self,
             "Выберите рентгеновский снимок",
             "",
-            "Image Files (*.png *.jpg *.jpeg *.bmp);;All Files (*)"
+            "Image Files (*.png *.jpg *.jpeg *.bmp *.dcm *.dicom);;DICOM (*.dcm *.dicom);;All Files (*)"
         )
 
         if file_path:
+            # Снимок читается один раз в уменьшенном виде и остаётся в кэше,
+            # анализ потом возьмёт оттуда же, без повторного чтения с диска.
+            try:
+                decoded = load_image(file_path)
+            except Exception as e:
+                QMessageBox.warning(self, "Ошибка", f"Не удалось загрузить изображение: {e}")
+                return
+
             self.current_image_path = file_path
-            pixmap = QPixmap(file_path)
-
-            if not pixmap.isNull():
-                scaled_pixmap = pixmap.scaled(
-                    400, 300,
-                    Qt.AspectRatioMode.KeepAspectRatio,
-                    Qt.TransformationMode.SmoothTransformation
-                )
-                self.upload_area.setPixmap(scaled_pixmap)
-                self.analyze_btn.setEnabled(True)
-
-                filename = os.path.basename(file_path)
-                self.gallery_list.addItem(f"Новый снимок: {filename}")
-            else:
-                QMessageBox.warning(self, "Ошибка", "Не удалось загрузить изображение")
+            self.upload_area.set_image(decoded.preview)
+            self.update_analyze_button()
 
-    # Стартуем фейковый прогресс анализа перед показом результата.
+            filename = os.path.basename(file_path)
+            self.add_gallery_item(file_path, f"Новый снимок: {filename}")
+
+    # Ставим снимок в очередь на анализ. Сам анализ идёт в фоне, окно не подвисает,
+    # а пока он считается, можно загрузить следующий снимок и тоже поставить в очередь.
     def start_analysis(self):
-        if not self.current_image_path or not self.current_patient:
+        if not self.current_image_path or not self.current_patient or self.model is None:
             return
 
-        self.progress_bar.setVisible(True)
+        self.job_counter += 1
+        job = {
+            'id': self.job_counter,
+            'patient': self.current_patient,
+            'image_path': self.current_image_path,
+            'study_date': self.study_date.date().toString("dd.MM.yyyy"),
+            'tiled': self.tiled_checkbox.isChecked(),
+            'tta': self.tta_checkbox.isChecked(),
+            'overlay_mode': self.overlay_mode.currentData(),
+        }
+
+        self.submit_job(job)
         self.analyze_btn.setEnabled(False)
-        self.status_label.setText("Подготовка к анализу...")
-        self.progress_bar.setValue(0)
 
-        if self.analysis_timer and self.analysis_timer.isActive():
-            self.analysis_timer.stop()
-
-        self.analysis_timer = QTimer()
-        self.analysis_timer.timeout.connect(self.update_progress)
-        self.analysis_timer.start(150)
-
-    # Плавно двигаем прогрессбар и меняем подписи статуса.
-    def update_progress(self):
-        current_value = self.progress_bar.value()
-
-        if current_value < 25:
-            self.status_label.setText("Загрузка изображения...")
-            increment = random.randint(5, 10)
-        elif current_value < 50:
-            self.status_label.setText("Предварительная обработка...")
-            increment = random.randint(3, 8)
-        elif current_value < 75:
-            self.status_label.setText("Анализ костной структуры...")
-            increment = random.randint(2, 6)
-        else:
-            self.status_label.setText("Формирование заключения...")
-            increment = random.randint(1, 4)
+    # Отправляем задачу анализа одного снимка в пул.
+    def submit_job(self, job):
+        worker = AnalysisWorker(self.model, job, self.result_cache, self.artifacts)
+        worker.signals.started.connect(self.on_analysis_started)
+        worker.signals.stage_finished.connect(self.on_stage_finished)
+        worker.signals.finished.connect(self.on_analysis_finished)
+        worker.signals.failed.connect(self.on_analysis_failed)
+        self.active_workers[job['id']] = worker
+        self.thread_pool.start(worker)
 
-        new_value = current_value + increment
+        self.progress_bar.setVisible(True)
+        self.update_queue_status()
 
-        if new_value >= 100:
-            self.progress_bar.setValue(100)
-            self.analysis_timer.stop()
-            self.status_label.setText("Анализ завершен!")
-            QTimer.singleShot(500, self.show_results)
-        else:
-            self.progress_bar.setValue(new_value)
+    # Забираем снимки из очереди папки входящих, но не больше MAX_INBOX_IN_FLIGHT за раз.
+    def drain_inbox(self):
+        if self.model is None:
+            return
 
-    # После анализа переключаемся на вкладку с результатом.
-    def show_results(self):
-        self.tab_widget.setTabEnabled(2, True)
-        self.tab_widget.setCurrentIndex(2)
+        while self.inbox_in_flight < MAX_INBOX_IN_FLIGHT:
+            try:
+                image_path = self.inbox_watcher.queue.get_nowait()
+            except queue.Empty:
+                return
+
+            patient_id = patient_id_for(image_path)
+            patient = self.store.get_patient(patient_id) if patient_id else None
+
+            self.job_counter += 1
+            job = {
+                'id': self.job_counter,
+                'patient': patient,
+                'patient_id': patient_id,
+                'image_path': image_path,
+                'study_date': QDate.currentDate().toString("dd.MM.yyyy"),
+                'source': 'inbox',
+            }
+            self.inbox_in_flight += 1
+            self.submit_job(job)
 
-        study_date = self.study_date.date().toString("dd.MM.yyyy")
+    # Результат снимка из папки входящих: не перехватываем экран врача, а дописываем в карточку пациента.
+    def attach_inbox_result(self, job, result):
+        filename = os.path.basename(job['image_path'])
+        patient = job['patient']
+        verdict = "обнаружен перелом" if result['has_fracture'] else "переломов не обнаружено"
 
-        self.study_info_label.setText(
-            f"<b>Пациент:</b> {self.current_patient['name']}<br>"
-            f"<b>Дата:</b> {study_date}"
+        # Снимок уходит из входящих сразу, в базу пишем уже его новый путь.
+        image_path = self.inbox_watcher.archive(job['image_path'], failed=patient is None)
+
+        if patient is None:
+            self.status_label.setText(
+                f"Входящие: {filename} - пациент с ID {job['patient_id'] or '?'} не найден, {verdict}"
+            )
+            return
+
+        study_id = self.store.add_study(
+            patient['id'], image_path, job['study_date'], result,
+            mask_path=result.get('artifact_path'), mask_threshold=MASK_THRESHOLD,
         )
+        self.update_patient_row(patient['id'])
 
-        if self.current_image_path:
-            pixmap = QPixmap(self.current_image_path)
-            scaled_pixmap = pixmap.scaled(
-                400, 400,
-                Qt.AspectRatioMode.KeepAspectRatio,
-                Qt.TransformationMode.SmoothTransformation
+        if self.is_current_patient(patient):
+            self.add_gallery_item(
+                image_path,
+                self.gallery_text(image_path, job['study_date'], result['has_fracture'], result['confidence']),
+                study_id,
             )
-            self.result_image.setPixmap(scaled_pixmap)
 
-        self.generate_analysis_results()
+        self.status_label.setText(f"Входящие: {filename} - {patient['name']}, {verdict}")
 
-    # Здесь идёт сам анализ: прогон через модель, маска и итоговый вывод.
-    def generate_analysis_results(self):
-        if not self.current_image_path:
+    # Пишем в статус, сколько снимков ещё в работе.
+    def update_queue_status(self):
+        queued = len(self.active_workers)
+        if queued > 1:
+            self.status_label.setText(f"Идёт анализ... В очереди снимков: {queued}")
+        elif queued == 1:
+            self.status_label.setText("Идёт анализ...")
+
+    # Снимок дошёл до обработки в пуле: обнуляем прогресс под него.
+    # Снимки из папки входящих идут в фоне и прогресс врача не трогают.
+    def on_analysis_started(self, job):
+        if job.get('source') == 'inbox':
             return
+        self.stage_timings = []
+        self.progress_bar.setValue(0)
+        self.status_label.setText(f"{ANALYSIS_STAGES[0][1]}...")
 
-        try:
-            original_img = Image.open(self.current_image_path).convert("RGB")
-            original_size = original_img.size
+    # Этап закончился: двигаем прогресс и пишем, сколько занял каждый этап.
+    def on_stage_finished(self, job, stage, seconds):
+        if job.get('source') == 'inbox':
+            return
+        stage_names = [name for name, _ in ANALYSIS_STAGES]
+        done = stage_names.index(stage) + 1
+        self.progress_bar.setValue(int(done * 100 / len(stage_names)))
+
+        self.stage_timings.append((stage, seconds))
+        lines = self.format_stage_timings()
+        if done < len(stage_names):
+            lines.append(f"{ANALYSIS_STAGES[done][1]}...")
+        self.status_label.setText("\n".join(lines))
+
+    # Задача из очереди закончилась. Возвращаем True, если очередь после неё опустела.
+    def finish_job(self, job):
+        self.active_workers.pop(job['id'], None)
+
+        if self.active_workers:
+            self.update_queue_status()
+            return False
+
+        return True
+
+    # Собираем строки вида "Этап: 0.12 с" для подписи под прогрессом.
+    def format_stage_timings(self):
+        return [f"{STAGE_TITLES[stage]}: {seconds:.2f} с" for stage, seconds in self.stage_timings]
+
+    # Фоновый анализ закончился успешно.
+    def on_analysis_finished(self, job, result):
+        if self.finish_job(job) and job.get('source') != 'inbox':
+            total = sum(seconds for _, seconds in self.stage_timings)
+            lines = self.format_stage_timings()
+            if result.get('from_cache'):
+                lines.append("Результат взят из кэша")
+            lines.append(f"Анализ завершен за {total:.2f} с")
+            self.progress_bar.setValue(100)
+            self.status_label.setText("\n".join(lines))
 
-            img_resized = original_img.resize((256, 256))
-            img_array = np.array(img_resized, dtype=np.float32)
-            img_array = preprocess_input(img_array)
-            img_array = np.expand_dims(img_array, axis=0)
+        if job.get('source') == 'inbox':
+            self.inbox_in_flight -= 1
+            self.attach_inbox_result(job, result)
+            return
 
-            pred_mask = self.model.predict(img_array, verbose=0)[0]
-            pred_mask = np.squeeze(pred_mask)
+        self.show_results(job, result)
 
-            mask_threshold = 0.5
-            binary_mask = pred_mask >= mask_threshold
+    # Фоновый анализ упал, показываем ошибку по конкретному снимку.
+    # Снимок из входящих уходит в failed/, только если его не удалось прочитать. Если отказала
+    # модель или сервер анализа, снимок остаётся во входящих и встаёт в очередь ещё раз.
+    def on_analysis_failed(self, job, error, decode_failed):
+        self.finish_job(job)
+        self.reload_lost_model()
+        filename = os.path.basename(job['image_path'])
 
-            fracture_pixels = np.sum(binary_mask)
-            total_pixels = binary_mask.shape[0] * binary_mask.shape[1]
-            area_ratio = fracture_pixels / total_pixels
+        if job.get('source') == 'inbox':
+            self.inbox_in_flight -= 1
+            if decode_failed:
+                self.inbox_watcher.archive(job['image_path'], failed=True)
+            else:
+                self.inbox_watcher.retry(job['image_path'])
+            self.status_label.setText(f"Входящие: не удалось проанализировать {filename}: {error}")
+            return
 
-            min_area_ratio = 0.001
-            has_fracture = area_ratio >= min_area_ratio
+        QMessageBox.critical(self, "Ошибка анализа", f"Не удалось выполнить анализ {filename}: {error}")
+        self.result_main_text.setText("Ошибка анализа")
+        self.result_description.setText("Результат недоступен")
+        self.comments_text.setPlainText("")
 
-            if has_fracture and np.any(binary_mask):
-                confidence = int(np.mean(pred_mask[binary_mask]) * 100)
-            else:
-                confidence = int((1.0 - np.max(pred_mask)) * 100)
+    # Пакетный анализ снимков выбранного пациента.
+    def start_patient_batch(self):
+        if not self.current_patient:
+            return
+
+        file_paths, _ = QFileDialog.getOpenFileNames(
+            self,
+            "Выберите снимки для пакетного анализа",
+            "",
+            "Image Files (*.png *.jpg *.jpeg *.bmp *.dcm *.dicom);;DICOM (*.dcm *.dicom);;All Files (*)"
+        )
+
+        if file_paths:
+            self.start_batch(self.current_patient, file_paths)
+
+    # Пакетный анализ целой папки, например всего рабочего списка за день.
+    def start_folder_batch(self):
+        folder = QFileDialog.getExistingDirectory(self, "Выберите папку со снимками")
+        if not folder:
+            return
+
+        file_paths = collect_images(folder)
+        if not file_paths:
+            QMessageBox.information(self, "Пакетный анализ", "В папке нет снимков")
+            return
+
+        self.start_batch(None, file_paths)
+
+    # Ставим пакетную задачу в ту же очередь, что и одиночные снимки.
+    def start_batch(self, patient, file_paths):
+        if self.model is None:
+            QMessageBox.information(self, "Пакетный анализ", "Модель ещё загружается, попробуйте чуть позже")
+            return
+
+        self.job_counter += 1
+        job = {
+            'id': self.job_counter,
+            'patient': patient,
+            'image_paths': list(file_paths),
+            'tta': self.tta_checkbox.isChecked(),
+        }
+
+        if WORKER_PROCESSES > 1 and self.process_pool is None:
+            self.process_pool = AnalysisProcessPool(WORKER_PROCESSES, getattr(self.model, 'model_path', None))
+
+        self.batch_unmatched[job['id']] = 0
+        worker = BatchAnalysisWorker(self.model, job, process_pool=self.process_pool, artifacts=self.artifacts)
+        worker.signals.item_finished.connect(self.on_batch_item_finished)
+        worker.signals.progress.connect(self.on_batch_progress)
+        worker.signals.finished.connect(self.on_batch_finished)
+        worker.signals.failed.connect(self.on_batch_failed)
+        self.active_workers[job['id']] = worker
+        self.thread_pool.start(worker)
+
+        self.progress_bar.setVisible(True)
+        self.update_queue_status()
+
+    # Каждый готовый снимок из пачки сразу видно в истории снимков пациента.
+    # Снимки из папки привязываем к пациенту по ID из DICOM или имени файла, как входящие.
+    def on_batch_item_finished(self, job, result):
+        study_date = QDate.currentDate().toString("dd.MM.yyyy")
+        study_id = None
+        patient = job['patient']
+        if patient is None and result.get('patient_id'):
+            patient = self.store.get_patient(result['patient_id'])
+
+        if patient is not None and 'error' not in result:
+            study_id = self.store.add_study(
+                patient['id'], result['image_path'], study_date, result,
+                mask_path=result.get('artifact_path'), mask_threshold=MASK_THRESHOLD,
+            )
+            self.update_patient_row(patient['id'])
+        elif 'error' not in result:
+            self.batch_unmatched[job['id']] += 1
+            # ID из снимка есть, а пациента с ним нет: исследование не записано, маска не нужна.
+            if result.get('artifact_path'):
+                ArtifactStore.discard(result['artifact_path'])
+
+        if not self.is_current_patient(patient):
+            return
 
-            confidence = max(0, min(confidence, 100))
+        if 'error' in result:
+            filename = os.path.basename(result['image_path'])
+            self.add_gallery_item(result['image_path'], f"{filename}: ошибка анализа")
+        else:
+            self.add_gallery_item(
+                result['image_path'],
+                self.gallery_text(result['image_path'], study_date, result['has_fracture'], result['confidence']),
+                study_id,
+            )
 
-            mask_img = Image.fromarray((binary_mask.astype(np.uint8) * 255))
-            mask_img = mask_img.resize(original_size)
+    # Тот ли это пациент, чья карточка сейчас открыта. Сравниваем по ID: записи из базы - новые словари.
+    def is_current_patient(self, patient):
+        return patient is not None and self.current_patient is not None and patient['id'] == self.current_patient['id']
 
-            overlay_img = self.create_overlay(original_img, mask_img)
+    # Прогресс пакета считаем по готовым снимкам.
+    def on_batch_progress(self, job, done, total):
+        self.progress_bar.setValue(int(done * 100 / total))
+        self.status_label.setText(f"Пакетный анализ: {done} из {total}")
 
-            overlay_path = Path(__file__).resolve().parent / "result_overlay.png"
-            overlay_img.save(overlay_path)
+    # Пакет готов: исследования уже записаны по мере готовности, показываем сводку.
+    def on_batch_finished(self, job, counts):
+        self.finish_job(job)
+        unmatched = self.batch_unmatched.pop(job['id'], 0)
 
-            self.last_mask_img = mask_img
-            self.last_overlay_path = str(overlay_path)
+        summary = (
+            f"Проанализировано снимков: {counts['done'] - counts['failed']}\n"
+            f"С признаками перелома: {counts['fractures']}\n"
+            f"Не удалось открыть: {counts['failed']}"
+        )
+        if unmatched:
+            summary += f"\nНе найден пациент в базе (не сохранены): {unmatched}"
+        self.status_label.setText(summary)
+        QMessageBox.information(self, "Пакетный анализ завершен", summary)
+
+    # Пакет упал целиком, например модель не смогла отработать.
+    def on_batch_failed(self, job, error):
+        self.finish_job(job)
+        self.batch_unmatched.pop(job['id'], None)
+        self.reload_lost_model()
+        QMessageBox.critical(self, "Ошибка анализа", f"Пакетный анализ не выполнен: {error}")
+
+    # Есть ли в очереди снимки, поставленные врачом вручную (а не из папки входящих).
+    def has_manual_jobs(self):
+        return any(worker.job.get('source') != 'inbox' for worker in self.active_workers.values())
+
+    # Показываем результат анализа на третьей вкладке.
+    # Переключаемся на неё только если очередь пуста, чтобы не мешать загружать следующие снимки.
+    def show_results(self, job, result):
+        self.tab_widget.setTabEnabled(2, True)
+        if not self.has_manual_jobs():
+            self.tab_widget.setCurrentIndex(2)
 
-            self.display_result_image(self.last_overlay_path)
+        self.study_info_label.setText(
+            f"<b>Пациент:</b> {job['patient']['name']}<br>"
+            f"<b>Дата:</b> {job['study_date']}"
+        )
 
+        self.last_lesions = [lesion_in_image(lesion, result['original_size']) for lesion in result['lesions']]
+        self.current_study_id = self.store.add_study(
+            job['patient']['id'], job['image_path'], job['study_date'], result,
+            mask_path=result.get('artifact_path'), mask_threshold=MASK_THRESHOLD,
+        )
+        self.update_patient_row(job['patient']['id'])
+        self.display_result_image(result['overlay_array'])
+
+        self.last_analysis = {
+            'image_path': job['image_path'],
+            'pred_mask': result['pred_mask'],
+            'original_size': result['original_size'],
+            'overlay_mode': job.get('overlay_mode', 'mask'),
+        }
+        self.reset_threshold_slider(MASK_THRESHOLD, result)
+        self.generate_analysis_results(result)
+
+    # Открываем результат исследования из истории: наложение рисуем заново по сохранённой маске.
+    def open_study(self, item):
+        study = self.store.get_study(item.data(Qt.ItemDataRole.UserRole))
+        if study is None or study['has_fracture'] is None:
+            return
+        if not study['mask_path']:
+            QMessageBox.information(self, "История снимков", "Для этого исследования маска не сохранялась.")
+            return
+
+        try:
+            artifact = ArtifactStore.load(study['mask_path'])
+            overlay = ArtifactStore.render(
+                artifact, mask_threshold=study['mask_threshold'], image_path=study['image_path'],
+            )
         except Exception as e:
-            QMessageBox.critical(self, "Ошибка анализа", f"Не удалось выполнить анализ: {e}")
-            self.result_main_text.setText("Ошибка анализа")
-            self.result_description.setText("Результат недоступен")
-            self.comments_text.setPlainText("")
+            QMessageBox.warning(self, "Ошибка", f"Не удалось открыть результат исследования: {e}")
+            return
+
+        self.tab_widget.setTabEnabled(2, True)
+        self.tab_widget.setCurrentIndex(2)
+        self.study_info_label.setText(
+            f"<b>Пациент:</b> {self.current_patient['name']}<br>"
+            f"<b>Дата:</b> {study['study_date']}"
+        )
+
+        self.current_study_id = study['id']
+        self.last_lesions = [
+            lesion_in_image(lesion, artifact['original_size']) for lesion in json.loads(study['lesions'] or "[]")
+        ]
+        self.display_result_image(overlay)
+
+        self.last_analysis = {
+            'image_path': study['image_path'],
+            'pred_mask': artifact['pred_mask'],
+            'original_size': artifact['original_size'],
+            'overlay_mode': artifact['overlay_mode'],
+        }
+        self.reset_threshold_slider(study['mask_threshold'] or artifact['mask_threshold'], study)
+        self.generate_analysis_results({'has_fracture': bool(study['has_fracture'])})
+
+    # Ставим ползунок на порог показанного результата, не запуская пересчёт.
+    def reset_threshold_slider(self, threshold, result):
+        self.threshold_timer.stop()
+        self.threshold_slider.blockSignals(True)
+        self.threshold_slider.setValue(int(round(threshold * 100)))
+        self.threshold_slider.blockSignals(False)
+        self.threshold_slider.setEnabled(True)
+        self.update_threshold_label(result)
+
+    def update_threshold_label(self, result=None):
+        text = f"Порог маски: {self.threshold_slider.value()}%"
+        if result is not None:
+            text += f" · площадь {result['area_ratio'] * 100:.2f}% · уверенность {result['confidence']}%"
+        self.threshold_label.setText(text)
+
+    def on_threshold_changed(self):
+        self.update_threshold_label()
+        self.threshold_timer.start()
+
+    # Новый порог: маска, очаги, площадь и уверенность заново по сохранённой карте вероятностей,
+    # модель не запускается. В базу пишем, когда ползунок отпустили.
+    def apply_threshold(self):
+        self.threshold_timer.stop()
+        analysis = self.last_analysis
+        if analysis is None:
             return
 
-        if has_fracture:
+        threshold = self.threshold_slider.value() / 100
+        result = evaluate_mask(analysis['pred_mask'], threshold)
+        self.last_lesions = [lesion_in_image(lesion, analysis['original_size']) for lesion in result['lesions']]
+
+        try:
+            preview = load_image(analysis['image_path']).preview
+        except Exception:
+            preview = None
+        if preview is not None:
+            self.display_result_image(overlay_array(
+                preview, analysis['pred_mask'], result['binary_mask'], analysis['overlay_mode'],
+            ))
+
+        self.show_verdict(result)
+        self.update_threshold_label(result)
+
+        if self.current_study_id is not None and not self.threshold_slider.isSliderDown():
+            self.store.update_study(
+                self.current_study_id,
+                has_fracture=int(result['has_fracture']),
+                confidence=result['confidence'],
+                area_ratio=result['area_ratio'],
+                mask_threshold=threshold,
+                lesions=json.dumps(result['lesions']),
+            )
+
+    # Заполняем карточку заключения по готовому результату модели.
+    def generate_analysis_results(self, result):
+        self.show_verdict(result)
+        self.comments_text.clear()
+        self.comments_text.setPlaceholderText("Введите комментарий врача...")
+
+    # Итог в карточке результата: перелом или нет и строки по очагам.
+    def show_verdict(self, result):
+        if result['has_fracture']:
             self.result_card.setStyleSheet("""
                 QFrame {
                     background-color: #fef2f2;
@@ -698,7 +1106,9 @@ class MedicalApp(QMainWindow):
             self.result_icon.setText("⚠️")
             self.result_main_text.setText("Обнаружен перелом")
             self.result_main_text.setStyleSheet("font-weight: bold; font-size: 18px; color: #dc2626;")
-            self.result_description.setText("На снимке обнаружены признаки перелома")
+            self.result_description.setText(
+                "\n".join(["На снимке обнаружены признаки перелома"] + self.format_lesions())
+            )
         else:
             self.result_card.setStyleSheet("""
                 QFrame {
@@ -713,70 +1123,158 @@ class MedicalApp(QMainWindow):
             self.result_main_text.setStyleSheet("font-weight: bold; font-size: 18px; color: #16a34a;")
             self.result_description.setText("Явных признаков перелома не выявлено")
 
-        self.comments_text.clear()
-        self.comments_text.setPlaceholderText("Введите комментарий врача...")
+    # Строки про каждый очаг для карточки и заключения: где он на снимке, площадь и вероятность.
+    def format_lesions(self):
+        return lesion_lines(self.last_lesions)
 
-    # Накладываем красную подсветку на места, где модель нашла подозрительную область.
-    def create_overlay(self, original_img, mask_img, alpha=0.45):
-        original = original_img.convert("RGB")
-        mask = mask_img.convert("L")
+    # Сохраняем заключение: PDF со снимком, очагами и метриками и рядом JSON (FHIR DiagnosticReport).
+    # Файлы пишутся в фоне, запись в базу - когда они готовы.
+    def save_report(self):
+        if self.current_study_id is None:
+            QMessageBox.information(self, "Заключение", "Сначала проведите анализ снимка")
+            return
+
+        # Пациента берём из исследования, а не из открытой карточки: результат из очереди мог прийти,
+        # когда врач уже перешёл к другому пациенту.
+        study = self.store.get_study(self.current_study_id)
+        patient = self.store.get_patient(study['patient_id']) if study else None
+        if patient is None:
+            QMessageBox.warning(self, "Ошибка", "Исследование не найдено в базе")
+            return
 
-        red_overlay = Image.new("RGB", original.size, (255, 0, 0))
-        highlighted = Image.blend(original, red_overlay, alpha)
+        file_path, _ = QFileDialog.getSaveFileName(
+            self,
+            "Сохранить заключение",
+            f"заключение_{patient['name']}.pdf",
+            "PDF (*.pdf);;All Files (*)"
+        )
+        if not file_path:
+            return
 
-        result = Image.composite(
-            highlighted,
-            original,
-            mask,
+        pdf_path = Path(file_path)
+        if pdf_path.suffix.lower() != ".pdf":
+            pdf_path = pdf_path.with_name(pdf_path.name + ".pdf")
+
+        # Порог с ползунка, который ещё не успел примениться, должен попасть в отчёт.
+        if self.threshold_timer.isActive():
+            self.apply_threshold()
+            study = self.store.get_study(study['id'])
+
+        # Карточка результата и комментарий на третьей вкладке относятся к показанному исследованию:
+        # show_results и open_study меняют их вместе с current_study_id. Берём их сейчас,
+        # пока пишется PDF, на экране может появиться другой результат.
+        comments = self.comments_text.toPlainText()
+        record = (
+            patient['id'], study['id'],
+            self.result_main_text.text(), self.result_description.text(), comments, pdf_path,
         )
 
-        return result
+        worker = ReportWorker([(patient, study, comments)], pdf_path, pdf_path.with_suffix(".json"))
+        worker.signals.finished.connect(lambda summary: self.on_report_saved(summary, record))
+        worker.signals.failed.connect(self.on_report_failed)
+        self.start_report_worker(worker)
 
-    # Сохраняем текстовое заключение вместе с комментарием врача.
-    def save_report(self):
-        if self.current_patient:
-            file_path, _ = QFileDialog.getSaveFileName(
-                self,
-                "Сохранить заключение",
-                f"заключение_{self.current_patient['name']}.txt",
-                "Text Files (*.txt);;All Files (*)"
+    def start_report_worker(self, worker):
+        worker.signals.finished.connect(lambda _: self.report_workers.discard(worker))
+        worker.signals.failed.connect(lambda _: self.report_workers.discard(worker))
+        self.report_workers.add(worker)
+        QThreadPool.globalInstance().start(worker)
+
+    def on_report_saved(self, summary, record):
+        if not summary['written']:
+            QMessageBox.warning(self, "Ошибка", f"Не удалось сохранить заключение: {summary['skipped'][0]}")
+            return
+
+        self.store.add_report(*record)
+        QMessageBox.information(self, "Успех", f"Заключение сохранено: {summary['pdf_path']}")
+
+    def on_report_failed(self, error):
+        self.report_status_label.setText("")
+        QMessageBox.warning(self, "Ошибка", f"Не удалось сохранить отчёт: {error}")
+
+    # Отчёты за день: все проанализированные исследования выбранной даты - один PDF и один JSON-пакет.
+    # Одна фоновая задача вместо диалога сохранения на каждого пациента.
+    def export_day_reports(self):
+        day = self.report_date.date()
+        studies = self.store.list_day_studies(day.toString("dd.MM.yyyy"))
+        if not studies:
+            QMessageBox.information(self, "Отчёты за день", f"За {day.toString('dd.MM.yyyy')} исследований нет")
+            return
+
+        folder = QFileDialog.getExistingDirectory(self, "Папка для отчётов")
+        if not folder:
+            return
+
+        items = [
+            (
+                {
+                    'id': study['patient_id'],
+                    'name': study['patient_name'],
+                    'age': study['patient_age'],
+                    'diagnosis': study['patient_diagnosis'],
+                },
+                study,
+                study['comments'],
             )
-            if file_path:
-                try:
-                    with open(file_path, 'w', encoding='utf-8') as f:
-                        f.write("МЕДИЦИНСКОЕ ЗАКЛЮЧЕНИЕ\n")
-                        f.write("=" * 50 + "\n\n")
-                        f.write(f"Пациент: {self.current_patient['name']}\n")
-                        f.write(f"Результат: {self.result_main_text.text()}\n")
-                        f.write(f"Описание: {self.result_description.text()}\n\n")
-                        f.write("КОММЕНТАРИИ МЕДИЦИНСКОГО РАБОТНИКА:\n")
-                        f.write(self.comments_text.toPlainText())
-                    QMessageBox.information(self, "Успех", "Заключение успешно сохранено!")
-                except Exception as e:
-                    QMessageBox.warning(self, "Ошибка", f"Не удалось сохранить заключение: {str(e)}")
+            for study in studies
+        ]
+        stem = Path(folder) / f"отчёты_{day.toString('yyyy-MM-dd')}"
+
+        worker = ReportWorker(items, stem.with_suffix(".pdf"), stem.with_suffix(".json"))
+        worker.signals.progress.connect(self.on_day_reports_progress)
+        worker.signals.finished.connect(self.on_day_reports_finished)
+        worker.signals.failed.connect(self.on_report_failed)
+        self.report_status_label.setText(f"Отчёты за день: 0 из {len(items)}")
+        self.start_report_worker(worker)
+
+    def on_day_reports_progress(self, done, total):
+        self.report_status_label.setText(f"Отчёты за день: {done} из {total}")
+
+    def on_day_reports_finished(self, summary):
+        text = f"Отчётов: {summary['written']}\n{summary['pdf_path']}\n{summary['json_path']}"
+        if summary['skipped']:
+            text += f"\n\nПропущено ({len(summary['skipped'])}):\n" + "\n".join(summary['skipped'][:10])
+        self.report_status_label.setText("")
+        QMessageBox.information(self, "Отчёты за день", text)
 
     # Сбрасываем состояние, чтобы можно было начать новый анализ заново.
     def new_analysis(self):
         self.tab_widget.setCurrentIndex(1)
-        self.progress_bar.setValue(0)
-        self.progress_bar.setVisible(False)
-        self.status_label.setText("")
+        if not self.active_workers:
+            self.progress_bar.setValue(0)
+            self.progress_bar.setVisible(False)
+            self.status_label.setText("")
         self.analyze_btn.setEnabled(False)
         self.comments_input.clear()
         self.comments_text.clear()
         self.current_image_path = None
-        self.last_mask_img = None
-        self.last_overlay_path = None
-        self.upload_area.clear()
-        self.upload_area.setText(
-            "Снимок не загружен\n\nНажмите 'Загрузить снимок' или перетащите файл"
-        )
-        self.result_image.clear()
-        self.result_image.setText("Снимок не загружен")
+        self.current_study_id = None
+        self.last_lesions = []
+        self.last_analysis = None
+        self.threshold_timer.stop()
+        self.threshold_slider.setEnabled(False)
+        self.upload_area.clear_image()
+        self.result_image.clear_image()
+
+
+    # При закрытии окна останавливаем наблюдение за папкой входящих.
+    def closeEvent(self, event):
+        self.inbox_timer.stop()
+        self.inbox_watcher.stop()
+        for worker in self.thumbnail_workers:
+            worker.cancel()
+        for worker in self.report_workers:
+            worker.cancel()
+        if self.process_pool is not None:
+            self.process_pool.shutdown(wait=False)
+        self.store.close()
+        registry.flush()
+        super().closeEvent(event)
 
 
 # Точка входа: отсюда приложение запускается.
 def main():
+    start_exporters()
     app = QApplication(sys.argv)
     app.setStyle('Fusion')
     window = MedicalApp()
@@ -0,0 +1,194 @@
+import atexit
+import cProfile
+import json
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+import numpy as np
+
+
+BASE_DIR = Path(__file__).resolve().parent
+
+# Сколько последних замеров каждого этапа держим для перцентилей.
+HISTOGRAM_WINDOW = 1000
+
+PERCENTILES = (50, 95, 99)
+
+# Куда писать метрики JSON-файлом и на каком порту отдавать их в формате Prometheus.
+# Ничего не задано - метрики только копятся в памяти.
+METRICS_FILE = os.environ.get("VKLADKI_METRICS_FILE")
+METRICS_PORT = os.environ.get("VKLADKI_METRICS_PORT")
+
+# Файл метрик переписываем не чаще, чем раз в столько секунд.
+METRICS_FLUSH_INTERVAL = 10.0
+
+# Профилирование: "cprofile" - профиль Python по каждому анализу, "tf" - трасса TensorFlow для TensorBoard.
+PROFILE_MODE = os.environ.get("VKLADKI_PROFILE", "").lower()
+PROFILE_DIR = Path(os.environ.get("VKLADKI_PROFILE_DIR", BASE_DIR / "profiles"))
+
+METRIC_PREFIX = "vkladki"
+
+
+# Скользящее окно замеров одного этапа. Перцентили считаем по последним window значениям,
+# а счётчик и сумму - за всё время, как принято у Prometheus.
+class RollingHistogram:
+    def __init__(self, window=HISTOGRAM_WINDOW):
+        self.samples = deque(maxlen=window)
+        self.count = 0
+        self.total = 0.0
+
+    def observe(self, seconds):
+        self.samples.append(seconds)
+        self.count += 1
+        self.total += seconds
+
+    def summary(self):
+        values = np.percentile(self.samples, PERCENTILES) if self.samples else [0.0] * len(PERCENTILES)
+        summary = {f"p{p}": float(v) for p, v in zip(PERCENTILES, values)}
+        summary.update({'count': self.count, 'sum': self.total})
+        return summary
+
+
+# Все замеры процесса. Один общий экземпляр - registry ниже.
+class MetricsRegistry:
+    def __init__(self, metrics_file=METRICS_FILE):
+        self.histograms = {}
+        self.lock = threading.Lock()
+        self.metrics_file = Path(metrics_file) if metrics_file else None
+        self.last_flush = 0.0
+        self.server = None
+
+    def observe(self, name, seconds):
+        with self.lock:
+            if name not in self.histograms:
+                self.histograms[name] = RollingHistogram()
+            self.histograms[name].observe(seconds)
+
+        if self.metrics_file and time.monotonic() - self.last_flush >= METRICS_FLUSH_INTERVAL:
+            self.flush()
+
+    def snapshot(self):
+        with self.lock:
+            return {name: histogram.summary() for name, histogram in sorted(self.histograms.items())}
+
+    # Пишем метрики в файл целиком, через временный файл, чтобы читатель не увидел половину.
+    def flush(self):
+        if not self.metrics_file:
+            return
+        self.last_flush = time.monotonic()
+
+        data = {
+            'updated': datetime.now().isoformat(timespec="seconds"),
+            'pid': os.getpid(),
+            'spans': self.snapshot(),
+        }
+        try:
+            self.metrics_file.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = self.metrics_file.with_suffix(self.metrics_file.suffix + ".tmp")
+            tmp_path.write_text(json.dumps(data, indent=2), encoding="utf-8")
+            os.replace(tmp_path, self.metrics_file)
+        except OSError as e:
+            print(f"Не удалось записать метрики в {self.metrics_file}: {e}")
+
+    # Метрики в текстовом формате Prometheus: summary с квантилями на каждый этап.
+    def prometheus_text(self):
+        name = f"{METRIC_PREFIX}_span_seconds"
+        lines = [
+            f"# HELP {name} Длительность этапов анализа снимка.",
+            f"# TYPE {name} summary",
+        ]
+        for span_name, summary in self.snapshot().items():
+            for p in PERCENTILES:
+                lines.append(f'{name}{{span="{span_name}",quantile="{p / 100}"}} {summary[f"p{p}"]:.6f}')
+            lines.append(f'{name}_sum{{span="{span_name}"}} {summary["sum"]:.6f}')
+            lines.append(f'{name}_count{{span="{span_name}"}} {summary["count"]}')
+        return "\n".join(lines) + "\n"
+
+    # Отдаём /metrics по HTTP в фоновом потоке. Слушаем только localhost: наружу метрики
+    # выставляет тот, кто их собирает, например через node exporter или обратный прокси.
+    def serve(self, port, host="127.0.0.1"):
+        registry = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                body = registry.prometheus_text().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        thread = threading.Thread(target=self.server.serve_forever, name="metrics-server", daemon=True)
+        thread.start()
+        return self.server.server_address[1]
+
+
+registry = MetricsRegistry()
+
+
+# Именованный отрезок времени: with span("predict"): ...
+@contextmanager
+def span(name):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        registry.observe(name, time.perf_counter() - started)
+
+
+# Включаем выгрузку метрик, если она настроена переменными окружения. Зовут точки входа программы.
+def start_exporters():
+    if METRICS_PORT and registry.server is None:
+        try:
+            port = registry.serve(int(METRICS_PORT))
+            print(f"Метрики Prometheus: http://127.0.0.1:{port}/metrics")
+        except (OSError, ValueError) as e:
+            print(f"Не удалось поднять сервер метрик на порту {METRICS_PORT}: {e}")
+
+    if registry.metrics_file:
+        atexit.register(registry.flush)
+
+
+# Снимаем профиль с куска работы, если он включён (VKLADKI_PROFILE или mode).
+# cProfile пишет <name>-<время>.prof (смотреть через snakeviz или pstats),
+# tf - трассу в PROFILE_DIR/tf для вкладки Profile в TensorBoard.
+@contextmanager
+def profile(name, mode=None):
+    mode = (mode or PROFILE_MODE).lower()
+    if mode not in ("cprofile", "tf"):
+        yield
+        return
+
+    PROFILE_DIR.mkdir(parents=True, exist_ok=True)
+    stamp = datetime.now().strftime("%Y%m%d-%H%M%S-%f")
+
+    if mode == "cprofile":
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            yield
+        finally:
+            profiler.disable()
+            profiler.dump_stats(str(PROFILE_DIR / f"{name}-{stamp}.prof"))
+        return
+
+    import tensorflow as tf
+
+    tf.profiler.experimental.start(str(PROFILE_DIR / "tf"))
+    try:
+        yield
+    finally:
+        tf.profiler.experimental.stop()
@@ -0,0 +1,116 @@
+import numpy as np
+
+
+OVERLAY_ALPHA = 0.45
+
+OVERLAY_COLOR = (255, 0, 0)
+
+# Вероятности ниже этого порога на тепловой карте не рисуем, чтобы не заливать весь снимок.
+HEATMAP_MIN_PROB = 0.1
+
+
+# Таблицы цветов на 256 значений. Строятся один раз при импорте.
+def _build_colormaps():
+    x = np.linspace(0.0, 1.0, 256)
+
+    jet = np.stack([
+        np.clip(1.5 - np.abs(4 * x - 3), 0, 1),
+        np.clip(1.5 - np.abs(4 * x - 2), 0, 1),
+        np.clip(1.5 - np.abs(4 * x - 1), 0, 1),
+    ], axis=1)
+    hot = np.stack([
+        np.clip(3 * x, 0, 1),
+        np.clip(3 * x - 1, 0, 1),
+        np.clip(3 * x - 2, 0, 1),
+    ], axis=1)
+    red = np.stack([np.ones_like(x), np.zeros_like(x), np.zeros_like(x)], axis=1)
+
+    return {
+        name: np.round(table * 255).astype(np.uint8)
+        for name, table in (('jet', jet), ('hot', hot), ('red', red))
+    }
+
+
+COLORMAPS = _build_colormaps()
+
+OVERLAY_MODES = ('mask', 'heatmap')
+
+
+# Рамка вокруг ненулевых пикселей маски: (top, bottom, left, right), или None, если маска пустая.
+def mask_bbox(mask):
+    rows = np.flatnonzero(np.any(mask, axis=1))
+    if rows.size == 0:
+        return None
+    cols = np.flatnonzero(np.any(mask, axis=0))
+    return rows[0], rows[-1] + 1, cols[0], cols[-1] + 1
+
+
+# Маска модели обычно 256x256, а снимок большой. Растягиваем до размера снимка
+# не всю маску, а только кусок внутри рамки, методом ближайшего соседа.
+# Возвращаем (кусок маски в координатах снимка, рамка в координатах снимка).
+def upsample_region(mask, image_shape):
+    bbox = mask_bbox(mask)
+    if bbox is None:
+        return None, None
+
+    image_height, image_width = image_shape[:2]
+    mask_height, mask_width = mask.shape[:2]
+    if (mask_height, mask_width) == (image_height, image_width):
+        top, bottom, left, right = bbox
+        return mask[top:bottom, left:right], bbox
+
+    scale_y = image_height / mask_height
+    scale_x = image_width / mask_width
+    top = int(np.floor(bbox[0] * scale_y))
+    bottom = min(image_height, int(np.ceil(bbox[1] * scale_y)))
+    left = int(np.floor(bbox[2] * scale_x))
+    right = min(image_width, int(np.ceil(bbox[3] * scale_x)))
+
+    source_rows = np.minimum((np.arange(top, bottom) / scale_y).astype(np.intp), mask_height - 1)
+    source_cols = np.minimum((np.arange(left, right) / scale_x).astype(np.intp), mask_width - 1)
+    return mask[np.ix_(source_rows, source_cols)], (top, bottom, left, right)
+
+
+# Красная подсветка по бинарной маске. Трогаем только пиксели внутри рамки маски,
+# картинку меняем на месте (uint8, HxWx3), лишних полноразмерных буферов не создаём.
+def render_mask_overlay(image, mask, alpha=OVERLAY_ALPHA, color=OVERLAY_COLOR):
+    region_mask, bbox = upsample_region(mask, image.shape)
+    if bbox is None:
+        return image
+
+    top, bottom, left, right = bbox
+    region = image[top:bottom, left:right]
+    pixels = region[region_mask].astype(np.float32)
+    pixels *= 1.0 - alpha
+    pixels += np.asarray(color, dtype=np.float32) * alpha
+    region[region_mask] = pixels.astype(np.uint8)
+    return image
+
+
+# Тепловая карта по сырым вероятностям: цвет из таблицы, прозрачность растёт с вероятностью.
+def render_heatmap_overlay(image, pred_mask, alpha=OVERLAY_ALPHA, colormap='jet', min_prob=HEATMAP_MIN_PROB):
+    table = COLORMAPS[colormap]
+    region_prob, bbox = upsample_region(np.where(pred_mask >= min_prob, pred_mask, 0), image.shape)
+    if bbox is None:
+        return image
+
+    top, bottom, left, right = bbox
+    region = image[top:bottom, left:right]
+    visible = region_prob > 0
+
+    probs = region_prob[visible]
+    colors = table[np.clip(probs * 255, 0, 255).astype(np.uint8)].astype(np.float32)
+    weights = (probs * alpha)[:, np.newaxis]
+
+    pixels = region[visible].astype(np.float32)
+    pixels *= 1.0 - weights
+    pixels += colors * weights
+    region[visible] = pixels.astype(np.uint8)
+    return image
+
+
+# Общая точка входа: mode 'mask' рисует бинарную маску, 'heatmap' - вероятности через colormap.
+def render_overlay(image, pred_mask, binary_mask, mode='mask', alpha=OVERLAY_ALPHA, colormap='jet'):
+    if mode == 'heatmap':
+        return render_heatmap_overlay(image, pred_mask, alpha, colormap)
+    return render_mask_overlay(image, binary_mask, alpha)
@@ -0,0 +1,157 @@
+from PyQt6.QtCore import QAbstractListModel, QModelIndex, QRectF, QSize, Qt
+from PyQt6.QtGui import QColor, QFont, QPainter, QPen
+from PyQt6.QtWidgets import QStyle, QStyledItemDelegate
+
+from patient_store import ALL_STATUSES, STATUS_NEEDS_ANALYSIS
+
+
+# Сколько пациентов подгружаем из базы за раз при прокрутке.
+PAGE_SIZE = 100
+
+CARD_HEIGHT = 112
+
+PatientRole = Qt.ItemDataRole.UserRole
+
+
+# Модель списка пациентов поверх базы. В памяти только уже прокрученные страницы,
+# следующая подтягивается через fetchMore, когда список докрутили до конца.
+class PatientListModel(QAbstractListModel):
+    def __init__(self, store, parent=None):
+        super().__init__(parent)
+        self.store = store
+        self.search_text = ""
+        self.status = ALL_STATUSES
+        self.patients = []
+        self.total = 0
+
+    def rowCount(self, parent=QModelIndex()):
+        if parent.isValid():
+            return 0
+        return len(self.patients)
+
+    def data(self, index, role=Qt.ItemDataRole.DisplayRole):
+        if not index.isValid():
+            return None
+
+        patient = self.patients[index.row()]
+        if role == PatientRole:
+            return patient
+        if role == Qt.ItemDataRole.DisplayRole:
+            return patient['name']
+        if role == Qt.ItemDataRole.ToolTipRole:
+            return patient['diagnosis']
+        return None
+
+    def canFetchMore(self, parent=QModelIndex()):
+        return not parent.isValid() and len(self.patients) < self.total
+
+    def fetchMore(self, parent=QModelIndex()):
+        if parent.isValid():
+            return
+
+        page = self.store.search_patients(
+            self.search_text, self.status, limit=PAGE_SIZE, offset=len(self.patients),
+        )
+        if not page:
+            self.total = len(self.patients)
+            return
+
+        self.beginInsertRows(QModelIndex(), len(self.patients), len(self.patients) + len(page) - 1)
+        self.patients.extend(page)
+        self.endInsertRows()
+
+    # Новый поиск или фильтр: сбрасываем список и берём из базы только первую страницу.
+    def set_filter(self, search_text, status):
+        self.search_text = search_text
+        self.status = status
+        self.refresh()
+
+    # У одного пациента сменился статус: перечитываем только его строку, прокрутка и подгруженные
+    # страницы остаются как были. Если под фильтр по статусу он больше не подходит, строку убираем.
+    def update_patient(self, patient_id):
+        row = next((i for i, patient in enumerate(self.patients) if patient['id'] == patient_id), None)
+        if row is None:
+            return
+
+        patient = self.store.get_patient(patient_id)
+        if patient is None or (self.status != ALL_STATUSES and patient['status'] != self.status):
+            self.beginRemoveRows(QModelIndex(), row, row)
+            del self.patients[row]
+            self.total -= 1
+            self.endRemoveRows()
+            return
+
+        self.patients[row] = patient
+        index = self.index(row)
+        self.dataChanged.emit(index, index)
+
+    # Перечитываем первую страницу с текущим фильтром.
+    def refresh(self):
+        self.beginResetModel()
+        self.total = self.store.count_patients(self.search_text, self.status)
+        self.patients = self.store.search_patients(self.search_text, self.status, limit=PAGE_SIZE)
+        self.endResetModel()
+
+
+# Рисуем карточку пациента прямо в списке, без отдельного виджета на каждую строку.
+# Рисуются только видимые строки, поэтому длина списка на скорость не влияет.
+class PatientCardDelegate(QStyledItemDelegate):
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.name_font = QFont()
+        self.name_font.setBold(True)
+        self.name_font.setPixelSize(16)
+        self.text_font = QFont()
+        self.text_font.setPixelSize(12)
+        self.status_font = QFont(self.text_font)
+        self.status_font.setBold(True)
+
+    def sizeHint(self, option, index):
+        return QSize(option.rect.width(), CARD_HEIGHT)
+
+    def paint(self, painter, option, index):
+        patient = index.data(PatientRole)
+        if patient is None:
+            return
+
+        painter.save()
+        painter.setRenderHint(QPainter.RenderHint.Antialiasing)
+
+        hovered = bool(option.state & QStyle.StateFlag.State_MouseOver)
+        rect = QRectF(option.rect).adjusted(6, 4, -6, -4)
+
+        painter.setPen(QPen(QColor("#2c5aa0" if hovered else "#e2e8f0"), 2))
+        painter.setBrush(QColor("#f8fafc" if hovered else "white"))
+        painter.drawRoundedRect(rect, 10, 10)
+
+        text_rect = rect.adjusted(16, 10, -16, -10)
+        line_height = text_rect.height() / 4
+
+        def line(number):
+            return QRectF(text_rect.left(), text_rect.top() + line_height * number, text_rect.width(), line_height)
+
+        align = Qt.AlignmentFlag.AlignLeft | Qt.AlignmentFlag.AlignVCenter
+
+        painter.setFont(self.name_font)
+        painter.setPen(QColor("#2c5aa0"))
+        painter.drawText(line(0), align, f"👤 {patient['name']}")
+
+        painter.setFont(self.text_font)
+        painter.setPen(QColor("#333333"))
+        painter.drawText(line(1), align, f"🎂 {patient['age']} лет      📋 №{patient['id']}")
+
+        painter.setPen(QColor("#666666"))
+        diagnosis = painter.fontMetrics().elidedText(
+            f"📝 Диагноз: {patient['diagnosis']}", Qt.TextElideMode.ElideRight, int(text_rect.width()),
+        )
+        painter.drawText(line(2), align, diagnosis)
+
+        painter.setFont(self.status_font)
+        status_color = "#dc2626" if patient['status'] == STATUS_NEEDS_ANALYSIS else "#16a34a"
+        painter.setPen(QColor(status_color))
+        painter.drawText(line(3), align, f"📍 {patient['status']}")
+
+        painter.setPen(QColor("#2c5aa0"))
+        painter.drawText(line(3), Qt.AlignmentFlag.AlignRight | Qt.AlignmentFlag.AlignVCenter, "Выбрать пациента ›")
+
+        painter.restore()
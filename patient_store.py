@@ -0,0 +1,282 @@
+import json
+import os
+import sqlite3
+import sys
+import threading
+from datetime import datetime
+from pathlib import Path
+
+
+BASE_DIR = Path(__file__).resolve().parent
+
+DB_PATH = Path(os.environ.get("VKLADKI_DB", BASE_DIR / "patients.db"))
+
+ALL_STATUSES = "Все статусы"
+
+STATUS_NEEDS_ANALYSIS = "Требуется анализ"
+
+STATUS_DONE = "Анализ завершен"
+
+STATUS_NEW_IMAGES = "Новые снимки"
+
+# Тестовые пациенты, которыми заполняется пустая база при первом запуске.
+SAMPLE_PATIENTS = [
+    {
+        'id': '001', 'name': 'Иванов Алексей Петрович', 'age': 45,
+        'diagnosis': 'Подозрение на перелом лучевой кости', 'status': 'Требуется анализ'
+    },
+    {
+        'id': '002', 'name': 'Петрова Мария Сергеевна', 'age': 62,
+        'diagnosis': 'Контроль после эндопротезирования тазобедренного сустава', 'status': 'Анализ завершен'
+    },
+    {
+        'id': '003', 'name': 'Сидоров Дмитрий Иванович', 'age': 28,
+        'diagnosis': 'Спортивная травма коленного сустава', 'status': 'Требуется анализ'
+    },
+    {
+        'id': '004', 'name': 'Козлова Анна Викторовна', 'age': 35,
+        'diagnosis': 'Артроз голеностопного сустава', 'status': 'Новые снимки'
+    },
+    {
+        'id': '005', 'name': 'Николаев Владимир Александрович', 'age': 71,
+        'diagnosis': 'Остеопороз, компрессионный перелом', 'status': 'Анализ завершен'
+    },
+    {
+        'id': '006', 'name': 'Федорова Екатерина Олеговна', 'age': 52,
+        'diagnosis': 'Посттравматическая деформация плечевой кости', 'status': 'Требуется анализ'
+    }
+]
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS patients (
+    id TEXT PRIMARY KEY,
+    name TEXT NOT NULL,
+    age INTEGER,
+    diagnosis TEXT NOT NULL DEFAULT '',
+    status TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_patients_status_name ON patients(status, name);
+CREATE INDEX IF NOT EXISTS idx_patients_name ON patients(name);
+
+CREATE VIRTUAL TABLE IF NOT EXISTS patients_fts USING fts5(
+    name, id, content='patients', content_rowid='rowid', tokenize='unicode61'
+);
+CREATE TRIGGER IF NOT EXISTS patients_ai AFTER INSERT ON patients BEGIN
+    INSERT INTO patients_fts(rowid, name, id) VALUES (new.rowid, new.name, new.id);
+END;
+CREATE TRIGGER IF NOT EXISTS patients_ad AFTER DELETE ON patients BEGIN
+    INSERT INTO patients_fts(patients_fts, rowid, name, id) VALUES ('delete', old.rowid, old.name, old.id);
+END;
+CREATE TRIGGER IF NOT EXISTS patients_au AFTER UPDATE OF name, id ON patients BEGIN
+    INSERT INTO patients_fts(patients_fts, rowid, name, id) VALUES ('delete', old.rowid, old.name, old.id);
+    INSERT INTO patients_fts(rowid, name, id) VALUES (new.rowid, new.name, new.id);
+END;
+
+CREATE TABLE IF NOT EXISTS studies (
+    id INTEGER PRIMARY KEY,
+    patient_id TEXT NOT NULL REFERENCES patients(id),
+    image_path TEXT NOT NULL,
+    study_date TEXT NOT NULL,
+    created_at TEXT NOT NULL,
+    has_fracture INTEGER,
+    confidence INTEGER,
+    area_ratio REAL,
+    mask_path TEXT,
+    mask_threshold REAL,
+    mask_shape TEXT,
+    lesions TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_studies_patient ON studies(patient_id, created_at);
+
+CREATE TABLE IF NOT EXISTS reports (
+    id INTEGER PRIMARY KEY,
+    patient_id TEXT NOT NULL REFERENCES patients(id),
+    study_id INTEGER REFERENCES studies(id),
+    created_at TEXT NOT NULL,
+    result_text TEXT,
+    description TEXT,
+    comments TEXT,
+    file_path TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_reports_patient ON reports(patient_id, created_at);
+"""
+
+PATIENT_COLUMNS = "p.id, p.name, p.age, p.diagnosis, p.status"
+
+
+# Строку поиска превращаем в запрос FTS: каждое слово ищется как префикс,
+# так "иван пет" найдёт "Иванов Алексей Петрович".
+def fts_query(text):
+    words = [word.replace('"', '') for word in text.split()]
+    return " ".join(f'"{word}"*' for word in words if word)
+
+
+# Первая строка после всех строк с префиксом prefix: последний символ на единицу больше.
+# Строки в SQLite сравниваются побайтно в UTF-8, это тот же порядок, что и по кодам символов.
+def prefix_end(prefix):
+    return prefix[:-1] + chr(min(ord(prefix[-1]) + 1, sys.maxunicode))
+
+
+# Хранилище пациентов, исследований и заключений в SQLite.
+# Поиск и фильтр по статусу делает база по индексам, а не цикл по списку в Python.
+class PatientStore:
+    def __init__(self, db_path=DB_PATH):
+        self.db_path = Path(db_path)
+        self.connection = sqlite3.connect(str(self.db_path), check_same_thread=False)
+        self.connection.row_factory = sqlite3.Row
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA foreign_keys=ON")
+        self.lock = threading.Lock()
+
+        with self.lock, self.connection:
+            self.connection.executescript(SCHEMA)
+
+        if self.count_patients() == 0:
+            self.add_patients(SAMPLE_PATIENTS)
+
+    def close(self):
+        self.connection.close()
+
+    # Добавляем пациентов или обновляем уже существующих с тем же ID.
+    def add_patients(self, patients):
+        with self.lock, self.connection:
+            self.connection.executemany(
+                "INSERT INTO patients (id, name, age, diagnosis, status) "
+                "VALUES (:id, :name, :age, :diagnosis, :status) "
+                "ON CONFLICT(id) DO UPDATE SET name = excluded.name, age = excluded.age, "
+                "diagnosis = excluded.diagnosis, status = excluded.status",
+                patients,
+            )
+
+    # Условие WHERE для поиска и фильтра. Имя ищем через FTS, ID - по префиксу как диапазон
+    # [text, следующая строка) по первичному ключу. LIKE тут не годится: он без учёта регистра,
+    # индекс по id с ним не работает, и SQLite перебирает всю таблицу.
+    def search_condition(self, text, status):
+        conditions = []
+        params = []
+
+        text = (text or "").strip()
+        if text:
+            query = fts_query(text)
+            if query:
+                conditions.append(
+                    "p.rowid IN (SELECT rowid FROM patients_fts WHERE patients_fts MATCH ? "
+                    "UNION SELECT rowid FROM patients WHERE id >= ? AND id < ?)"
+                )
+                params.extend([query, text, prefix_end(text)])
+
+        if status and status != ALL_STATUSES:
+            # При поиске по тексту отбор уже короткий, статус проверяем по найденным строкам.
+            # Иначе SQLite предпочтёт индекс по статусу и переберёт всех пациентов с этим статусом.
+            conditions.append("+p.status = ?" if conditions else "p.status = ?")
+            params.append(status)
+
+        where = ("WHERE " + " AND ".join(conditions)) if conditions else ""
+        return where, params
+
+    def search_patients(self, text="", status=None, limit=None, offset=0):
+        where, params = self.search_condition(text, status)
+        sql = f"SELECT {PATIENT_COLUMNS} FROM patients p {where} ORDER BY p.name"
+        if limit is not None:
+            sql += " LIMIT ? OFFSET ?"
+            params.extend([limit, offset])
+
+        with self.lock:
+            rows = self.connection.execute(sql, params).fetchall()
+        return [dict(row) for row in rows]
+
+    def count_patients(self, text="", status=None):
+        where, params = self.search_condition(text, status)
+        with self.lock:
+            return self.connection.execute(f"SELECT COUNT(*) FROM patients p {where}", params).fetchone()[0]
+
+    def get_patient(self, patient_id):
+        with self.lock:
+            row = self.connection.execute(
+                f"SELECT {PATIENT_COLUMNS} FROM patients p WHERE p.id = ?", (patient_id,)
+            ).fetchone()
+        return dict(row) if row else None
+
+    # Записываем исследование с результатом анализа. Пациенту ставим статус "Анализ завершен".
+    # Очаги (см. lesions.py) храним JSON-списком, рамки в них - в долях от сторон снимка.
+    def add_study(self, patient_id, image_path, study_date, result=None, mask_path=None, mask_threshold=None):
+        result = result or {}
+        mask_shape = result.get('pred_mask').shape if result.get('pred_mask') is not None else None
+        lesions = json.dumps(result['lesions']) if 'lesions' in result else None
+
+        with self.lock, self.connection:
+            cursor = self.connection.execute(
+                "INSERT INTO studies (patient_id, image_path, study_date, created_at, has_fracture, "
+                "confidence, area_ratio, mask_path, mask_threshold, mask_shape, lesions) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    patient_id,
+                    str(image_path),
+                    study_date,
+                    datetime.now().isoformat(timespec="seconds"),
+                    int(result['has_fracture']) if 'has_fracture' in result else None,
+                    result.get('confidence'),
+                    result.get('area_ratio'),
+                    str(mask_path) if mask_path else None,
+                    mask_threshold,
+                    "x".join(map(str, mask_shape)) if mask_shape else None,
+                    lesions,
+                ),
+            )
+            if result:
+                self.connection.execute(
+                    "UPDATE patients SET status = ? WHERE id = ?", (STATUS_DONE, patient_id)
+                )
+        return cursor.lastrowid
+
+    def update_study(self, study_id, **fields):
+        if not fields:
+            return
+        columns = ", ".join(f"{name} = ?" for name in fields)
+        with self.lock, self.connection:
+            self.connection.execute(
+                f"UPDATE studies SET {columns} WHERE id = ?", (*fields.values(), study_id)
+            )
+
+    def get_study(self, study_id):
+        with self.lock:
+            row = self.connection.execute("SELECT * FROM studies WHERE id = ?", (study_id,)).fetchone()
+        return dict(row) if row else None
+
+    def list_studies(self, patient_id, limit=None, offset=0):
+        sql = "SELECT * FROM studies WHERE patient_id = ? ORDER BY created_at DESC, id DESC"
+        params = [patient_id]
+        if limit is not None:
+            sql += " LIMIT ? OFFSET ?"
+            params.extend([limit, offset])
+
+        with self.lock:
+            rows = self.connection.execute(sql, params).fetchall()
+        return [dict(row) for row in rows]
+
+    # Рабочий список дня: все проанализированные исследования за дату (дд.мм.гггг) с данными пациента
+    # и комментарием из последнего сохранённого заключения. Для выгрузки отчётов за день.
+    def list_day_studies(self, study_date):
+        with self.lock:
+            rows = self.connection.execute(
+                "SELECT s.*, p.name AS patient_name, p.age AS patient_age, p.diagnosis AS patient_diagnosis, "
+                "(SELECT r.comments FROM reports r WHERE r.study_id = s.id "
+                "ORDER BY r.created_at DESC, r.id DESC LIMIT 1) AS comments "
+                "FROM studies s JOIN patients p ON p.id = s.patient_id "
+                "WHERE s.study_date = ? AND s.has_fracture IS NOT NULL "
+                "ORDER BY p.name, s.created_at, s.id",
+                (study_date,),
+            ).fetchall()
+        return [dict(row) for row in rows]
+
+    def add_report(self, patient_id, study_id=None, result_text="", description="", comments="", file_path=None):
+        with self.lock, self.connection:
+            cursor = self.connection.execute(
+                "INSERT INTO reports (patient_id, study_id, created_at, result_text, description, comments, file_path) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (
+                    patient_id, study_id, datetime.now().isoformat(timespec="seconds"),
+                    result_text, description, comments, str(file_path) if file_path else None,
+                ),
+            )
+        return cursor.lastrowid
@@ -0,0 +1,114 @@
+import os
+
+from PyQt6.QtCore import QMarginsF, QRectF, Qt
+from PyQt6.QtGui import QColor, QFont, QPageLayout, QPageSize, QPainter, QPdfWriter
+
+from image_view import array_to_qimage
+from reports import VERDICTS, lesion_lines
+
+
+PDF_RESOLUTION = 150
+
+PAGE_MARGIN_MM = 15
+
+# Наложение занимает не больше этой доли высоты страницы, чтобы под ним уместились метрики и очаги.
+IMAGE_MAX_HEIGHT = 0.5
+
+FONT_FAMILY = "Arial"
+
+TEXT_FLAGS = Qt.AlignmentFlag.AlignLeft.value | Qt.TextFlag.TextWordWrap.value
+
+VERDICT_COLORS = {True: "#dc2626", False: "#16a34a"}
+
+
+# PDF с отчётами, A4. Рисуем через QPainter прямо в QPdfWriter: страница уходит в файл,
+# как только начата следующая, поэтому отчётов в одном файле может быть сколько угодно.
+# QPdfWriter не виджет, рисовать в него можно из фонового потока.
+class PdfReport:
+    def __init__(self, path):
+        self.writer = QPdfWriter(os.fspath(path))
+        self.writer.setResolution(PDF_RESOLUTION)
+        self.writer.setPageSize(QPageSize(QPageSize.PageSizeId.A4))
+        self.writer.setPageMargins(QMarginsF(*[PAGE_MARGIN_MM] * 4), QPageLayout.Unit.Millimeter)
+        self.writer.setCreator("МедАнализ")
+        self.writer.setTitle("Медицинское заключение")
+
+        self.painter = QPainter(self.writer)
+        page = self.writer.pageLayout().paintRectPixels(PDF_RESOLUTION)
+        self.width = page.width()
+        self.height = page.height()
+        self.spacing = PDF_RESOLUTION * 0.06
+        self.y = 0
+        self.started = False
+
+    def new_page(self):
+        self.writer.newPage()
+        self.y = 0
+
+    # Если блок не влезает в остаток страницы, переносим его на новую.
+    def ensure_space(self, height):
+        if self.y and self.y + height > self.height:
+            self.new_page()
+
+    def text(self, text, size=10, bold=False, color="#1f2937"):
+        font = QFont(FONT_FAMILY, size)
+        font.setBold(bold)
+        self.painter.setFont(font)
+        self.painter.setPen(QColor(color))
+
+        bounds = self.painter.boundingRect(QRectF(0, 0, self.width, self.height), TEXT_FLAGS, text)
+        self.ensure_space(bounds.height())
+        self.painter.drawText(QRectF(0, self.y, self.width, bounds.height()), TEXT_FLAGS, text)
+        self.y += bounds.height() + self.spacing
+
+    def image(self, array):
+        qimage = array_to_qimage(array)
+        scale = min(self.width / qimage.width(), self.height * IMAGE_MAX_HEIGHT / qimage.height())
+        width = qimage.width() * scale
+        height = qimage.height() * scale
+
+        self.ensure_space(height)
+        self.painter.drawImage(QRectF((self.width - width) / 2, self.y, width, height), qimage)
+        self.y += height + self.spacing
+
+    # Одно исследование: шапка, вывод, метрики, наложение, очаги и комментарий врача.
+    # Каждое исследование начинается с новой страницы, длинный список очагов переносится дальше.
+    def add_report(self, data):
+        if self.started:
+            self.new_page()
+        self.started = True
+
+        patient = data['patient']
+        study = data['study']
+
+        self.text("МЕДИЦИНСКОЕ ЗАКЛЮЧЕНИЕ", size=16, bold=True, color="#2c5aa0")
+        self.text(
+            f"Пациент: {patient['name']} (ID {patient['id']})\n"
+            f"Возраст: {patient['age']} лет\n"
+            f"Диагноз: {patient['diagnosis']}\n"
+            f"Дата исследования: {study['study_date']}\n"
+            f"Снимок: {os.path.basename(study['image_path'])}"
+        )
+        self.text(VERDICTS[data['has_fracture']], size=13, bold=True, color=VERDICT_COLORS[data['has_fracture']])
+
+        metrics = [
+            f"Уверенность модели: {data['confidence']}%",
+            f"Площадь изменений: {data['area_ratio'] * 100:.2f}%",
+        ]
+        if data['mask_threshold'] is not None:
+            metrics.append(f"Порог маски: {data['mask_threshold'] * 100:.0f}%")
+        self.text("   ".join(metrics), size=9, color="#4b5563")
+
+        if data['overlay'] is not None:
+            self.image(data['overlay'])
+
+        if data['lesions']:
+            self.text("НАЙДЕННЫЕ ОЧАГИ:", bold=True)
+            for line in lesion_lines(data['lesions']):
+                self.text(line, size=9)
+
+        self.text("КОММЕНТАРИИ МЕДИЦИНСКОГО РАБОТНИКА:", bold=True)
+        self.text(data['comments'] or "—")
+
+    def close(self):
+        self.painter.end()
@@ -0,0 +1,185 @@
+import multiprocessing
+import os
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from multiprocessing import shared_memory
+
+import numpy as np
+from PIL import Image
+
+from analysis import MASK_THRESHOLD, MIN_AREA_RATIO, analyze_image, available_memory, load_segmentation_model
+
+
+# Сколько процессов анализа поднимать. 0 - по числу ядер и свободной памяти, 1 - пул не нужен.
+WORKER_PROCESSES = int(os.environ.get("VKLADKI_WORKERS", "0"))
+
+# Примерная память одного процесса: TensorFlow, модель и снимки в работе.
+WORKER_MEMORY = 1536 * 1024 * 1024
+
+# Потоков TensorFlow на процесс по умолчанию. Несколько процессов по 2 потока грузят
+# многоядерную машину лучше, чем один процесс на все ядра: PIL и numpy вокруг модели тоже параллелятся.
+THREADS_PER_WORKER = 2
+
+# Сколько снимков на процесс держим в работе одновременно. Больше не нужно:
+# готовые маски лежат в общей памяти, пока их не заберут.
+IN_FLIGHT_PER_WORKER = 2
+
+# Перед массивом в блоке общей памяти - заголовок. Первый байт родитель ставит в 1, когда забрал массив.
+# Отступ в 8 байт, чтобы массив остался выровненным.
+SHARED_HEADER = 8
+
+
+# Сколько процессов поднимать на этой машине: по ядрам, но не больше, чем влезет в свободную память.
+def pick_worker_count(threads_per_worker=THREADS_PER_WORKER, memory=None):
+    if WORKER_PROCESSES:
+        return WORKER_PROCESSES
+
+    by_cpu = max(1, (os.cpu_count() or 1) // threads_per_worker)
+    memory = available_memory() if memory is None else memory
+    if not memory:
+        return by_cpu
+    return max(1, min(by_cpu, int(memory // WORKER_MEMORY)))
+
+
+# Блоки общей памяти, которые процесс анализа отдал родителю. Свой дескриптор держим открытым,
+# пока родитель не заберёт массив: в Windows именованная память пропадает вместе с последним
+# дескриптором, и родителю было бы нечего открывать.
+_shared_blocks = []
+
+
+# Кладём массив в общую память и возвращаем её описание.
+def put_shared(array):
+    array = np.ascontiguousarray(array)
+    block = shared_memory.SharedMemory(create=True, size=SHARED_HEADER + array.nbytes)
+    block.buf[0] = 0
+    np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf, offset=SHARED_HEADER)[...] = array
+    _shared_blocks.append(block)
+    return (block.name, array.shape, array.dtype.str)
+
+
+# Закрываем в процессе анализа блоки, которые родитель уже забрал.
+def release_taken():
+    for block in list(_shared_blocks):
+        if block.buf[0]:
+            _shared_blocks.remove(block)
+            block.close()
+
+
+# Забираем массив из общей памяти в обычный и отмечаем блок забранным.
+# В POSIX имя блока удаляем здесь же, в Windows память освободится, когда его закроет процесс анализа.
+def take_shared(descriptor):
+    name, shape, dtype = descriptor
+    block = shared_memory.SharedMemory(name=name)
+    try:
+        return np.ndarray(shape, dtype=np.dtype(dtype), buffer=block.buf, offset=SHARED_HEADER).copy()
+    finally:
+        block.buf[0] = 1
+        block.close()
+        block.unlink()
+
+
+# Модель процесса анализа. Своя в каждом процессе, грузится один раз при его старте.
+_worker_model = None
+
+
+def _init_worker(model_path, backend, num_threads):
+    global _worker_model
+
+    # До импорта TensorFlow и numpy-библиотек: иначе каждый процесс заберёт себе все ядра.
+    for name in ("OMP_NUM_THREADS", "TF_NUM_INTRAOP_THREADS", "OPENBLAS_NUM_THREADS", "MKL_NUM_THREADS"):
+        os.environ[name] = str(num_threads)
+    os.environ["TF_NUM_INTEROP_THREADS"] = "1"
+
+    _worker_model = load_segmentation_model(model_path, backend, num_threads)
+
+
+# Анализ одного снимка внутри процесса. Маску и наложение отдаём через общую память,
+# а по каналу между процессами идут только метрики и имена блоков.
+def _analyze_in_worker(image_path, params):
+    release_taken()
+    try:
+        result = analyze_image(_worker_model, image_path, **params)
+    except Exception as e:
+        return {'image_path': str(image_path), 'error': str(e)}
+
+    result.pop('binary_mask')
+    result['pred_mask'] = put_shared(result['pred_mask'].astype(np.float32))
+    overlay = result.pop('overlay_array')
+    if overlay is not None:
+        result['overlay_img'] = put_shared(overlay)
+    return result
+
+
+# Пул процессов анализа: каждый процесс держит свою модель и свои потоки TensorFlow.
+# Снимки процессы читают сами по пути, обратно приходят маска и наложение через общую память.
+# Процессы запускаются через spawn: fork процесса с уже запущенным TensorFlow или Qt небезопасен.
+class AnalysisProcessPool:
+    def __init__(self, workers=None, model_path=None, backend=None, threads_per_worker=None):
+        self.threads_per_worker = threads_per_worker or THREADS_PER_WORKER
+        self.workers = workers or pick_worker_count(self.threads_per_worker)
+        self.executor = ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker,
+            initargs=(model_path, backend, self.threads_per_worker),
+        )
+
+    def submit(self, image_path, mask_threshold=MASK_THRESHOLD, min_area_ratio=MIN_AREA_RATIO,
+               with_overlay=True, tiled=False, tile_overlap=None, overlay_mode='mask', colormap='jet', tta=False):
+        params = {
+            'mask_threshold': mask_threshold,
+            'min_area_ratio': min_area_ratio,
+            'with_overlay': with_overlay,
+            'tiled': tiled,
+            'tile_overlap': tile_overlap,
+            'overlay_mode': overlay_mode,
+            'colormap': colormap,
+            'tta': tta,
+        }
+        return self.executor.submit(_analyze_in_worker, str(image_path), params)
+
+    # Результат из процесса в том же виде, что у analyze_batch: маска и картинка наложения.
+    @staticmethod
+    def collect(future):
+        result = future.result()
+        if 'error' in result:
+            return result
+
+        result['pred_mask'] = take_shared(result['pred_mask'])
+        if 'overlay_img' in result:
+            result['overlay_img'] = Image.fromarray(take_shared(result['overlay_img']))
+        return result
+
+    # Прогоняем много снимков и отдаём результаты по мере готовности, как analyze_batch.
+    # В работе одновременно не больше IN_FLIGHT_PER_WORKER снимков на процесс,
+    # чтобы тысячи готовых масок не копились в общей памяти.
+    def analyze_many(self, image_paths, mask_threshold=MASK_THRESHOLD, **params):
+        pending = deque(image_paths)
+        running = set()
+        limit = self.workers * IN_FLIGHT_PER_WORKER
+
+        try:
+            while pending or running:
+                while pending and len(running) < limit:
+                    running.add(self.submit(pending.popleft(), mask_threshold, **params))
+
+                done, running = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield self.collect(future)
+        finally:
+            # Прогон прервали: недосчитанные снимки отменяем, а маски уже готовых освобождаем.
+            for future in running:
+                if not future.cancel():
+                    future.add_done_callback(self.discard)
+
+    # Забираем и выбрасываем результат, чтобы не оставить блоки общей памяти.
+    @classmethod
+    def discard(cls, future):
+        try:
+            cls.collect(future)
+        except Exception:
+            pass
+
+    # cancel_futures: снимки, которые ещё не начали считать, просто выбрасываем.
+    def shutdown(self, wait=True):
+        self.executor.shutdown(wait=wait, cancel_futures=True)
@@ -0,0 +1,187 @@
+import json
+import os
+from datetime import datetime
+from pathlib import Path
+
+import numpy as np
+
+from artifact_store import ArtifactStore
+from image_loader import load_image
+from lesions import lesion_in_image
+
+
+REPORT_TITLE = "Рентгенография: поиск переломов"
+
+VERDICTS = {True: "Обнаружен перелом", False: "Переломов не обнаружено"}
+
+
+# Строки про каждый очаг для карточки и заключения: где он на снимке, площадь и вероятность.
+def lesion_lines(lesions):
+    lines = []
+    if lesions:
+        lines.append(f"Очагов: {len(lesions)}")
+    for lesion in lesions:
+        lines.append(
+            f"Очаг {lesion['id']}: x={lesion['x']}, y={lesion['y']}, "
+            f"{lesion['width']}x{lesion['height']} пикс., площадь {lesion['area_percent']:.2f}%, "
+            f"вероятность макс. {lesion['max_prob'] * 100:.0f}% / средн. {lesion['mean_prob'] * 100:.0f}%"
+        )
+    return lines
+
+
+# Всё для отчёта по одному исследованию из базы: вывод, метрики, очаги в координатах снимка
+# и картинка наложения (перерисовываем по маске исследования, а без маски берём сам снимок).
+# OSError/KeyError/ValueError, если пропал снимок или файл маски.
+def report_data(patient, study, comments=""):
+    if study['mask_path']:
+        artifact = ArtifactStore.load(study['mask_path'])
+        overlay = ArtifactStore.render(
+            artifact, mask_threshold=study['mask_threshold'], image_path=study['image_path'],
+        )
+        original_size = artifact['original_size']
+    else:
+        decoded = load_image(study['image_path'])
+        overlay = np.array(decoded.preview.convert("RGB"))
+        original_size = decoded.original_size
+
+    return {
+        'patient': patient,
+        'study': study,
+        'has_fracture': bool(study['has_fracture']),
+        'confidence': study['confidence'],
+        'area_ratio': study['area_ratio'] or 0.0,
+        'mask_threshold': study['mask_threshold'],
+        'lesions': [lesion_in_image(lesion, original_size) for lesion in json.loads(study['lesions'] or "[]")],
+        'comments': comments or "",
+        'overlay': overlay,
+    }
+
+
+# Дата исследования хранится как в окне (дд.мм.гггг), в структурированном отчёте она в ISO.
+def iso_date(study_date):
+    try:
+        return datetime.strptime(study_date, "%d.%m.%Y").date().isoformat()
+    except ValueError:
+        return study_date
+
+
+def observation(observation_id, text, value, unit, components=None):
+    resource = {
+        'resourceType': 'Observation',
+        'id': observation_id,
+        'status': 'final',
+        'code': {'text': text},
+    }
+    if value is not None:
+        resource['valueQuantity'] = {'value': value, 'unit': unit}
+    if components:
+        resource['component'] = [
+            {'code': {'text': name}, 'valueQuantity': {'value': value, 'unit': unit}}
+            for name, value, unit in components
+        ]
+    return resource
+
+
+# Структурированный отчёт в духе HL7 FHIR DiagnosticReport: метрики и очаги - вложенные Observation.
+# pdf_name - имя PDF с тем же отчётом, попадает в presentedForm.
+def fhir_report(data, pdf_name=None):
+    patient = data['patient']
+    study = data['study']
+
+    observations = [
+        observation('confidence', "Уверенность модели", data['confidence'], "%"),
+        observation('area', "Площадь изменений", round(data['area_ratio'] * 100, 3), "%"),
+        observation('threshold', "Порог маски", data['mask_threshold'], "1"),
+    ]
+    for lesion in data['lesions']:
+        observations.append(observation(f"lesion-{lesion['id']}", f"Очаг {lesion['id']}", None, None, [
+            ("x", lesion['x'], "px"),
+            ("y", lesion['y'], "px"),
+            ("width", lesion['width'], "px"),
+            ("height", lesion['height'], "px"),
+            ("area", lesion['area_percent'], "%"),
+            ("max_prob", lesion['max_prob'], "1"),
+            ("mean_prob", lesion['mean_prob'], "1"),
+        ]))
+
+    report = {
+        'resourceType': 'DiagnosticReport',
+        'id': f"study-{study['id']}",
+        'status': 'final',
+        'code': {'text': REPORT_TITLE},
+        'subject': {'reference': f"Patient/{patient['id']}", 'display': patient['name']},
+        'effectiveDateTime': iso_date(study['study_date']),
+        'issued': datetime.now().astimezone().isoformat(timespec="seconds"),
+        'conclusion': VERDICTS[data['has_fracture']],
+        'contained': observations,
+        'result': [{'reference': f"#{item['id']}"} for item in observations],
+    }
+    if data['comments']:
+        report['note'] = [{'text': data['comments']}]
+    if pdf_name:
+        report['presentedForm'] = [{'contentType': 'application/pdf', 'url': pdf_name, 'title': REPORT_TITLE}]
+    return report
+
+
+# Пишем отчёты потоком: PDF (каждое исследование с новой страницы) и JSON-пакет (FHIR Bundle).
+# В памяти только текущее исследование, так что выгрузка рабочего дня не упирается в память.
+# Файлы пишутся во временные и появляются под своими именами только после close().
+class ReportWriter:
+    def __init__(self, pdf_path=None, json_path=None):
+        self.pdf_path = Path(pdf_path) if pdf_path else None
+        self.json_path = Path(json_path) if json_path else None
+        self.count = 0
+        self.pdf = None
+        self.json_file = None
+
+        if self.pdf_path:
+            # Qt нужен только для PDF, структурированный отчёт пишется и без него.
+            from pdf_report import PdfReport
+
+            self.pdf = PdfReport(self.tmp_path(self.pdf_path))
+        if self.json_path:
+            self.json_file = open(self.tmp_path(self.json_path), "w", encoding="utf-8")
+            self.json_file.write(
+                '{"resourceType": "Bundle", "type": "collection", '
+                f'"timestamp": {json.dumps(datetime.now().astimezone().isoformat(timespec="seconds"))}, '
+                '"entry": [\n'
+            )
+
+    @staticmethod
+    def tmp_path(path):
+        return path.with_name(path.name + ".tmp")
+
+    def add(self, data):
+        if self.pdf is not None:
+            self.pdf.add_report(data)
+        if self.json_file is not None:
+            if self.count:
+                self.json_file.write(",\n")
+            report = fhir_report(data, self.pdf_path.name if self.pdf_path else None)
+            self.json_file.write(json.dumps({'resource': report}, ensure_ascii=False))
+        self.count += 1
+
+    # discard=True - прогон отменили или он упал: временные файлы удаляем.
+    def close(self, discard=False):
+        if self.pdf is not None:
+            self.pdf.close()
+            self.pdf = None
+            self.finish(self.pdf_path, discard)
+        if self.json_file is not None:
+            self.json_file.write("\n]}\n")
+            self.json_file.close()
+            self.json_file = None
+            self.finish(self.json_path, discard)
+
+    def finish(self, path, discard):
+        tmp_path = self.tmp_path(path)
+        if discard:
+            tmp_path.unlink(missing_ok=True)
+        else:
+            os.replace(tmp_path, path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close(discard=exc_type is not None)
@@ -0,0 +1,128 @@
+import hashlib
+import io
+import json
+import os
+import threading
+from pathlib import Path
+
+import numpy as np
+
+
+BASE_DIR = Path(__file__).resolve().parent
+
+CACHE_DIR = BASE_DIR / "cache" / "results"
+
+# Сколько места на диске может занять кэш. Старые записи удаляются первыми.
+MAX_CACHE_BYTES = int(os.environ.get("VKLADKI_RESULT_CACHE_MB", "512")) * 1024 * 1024
+
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+# Хэши файлов запоминаем по (путь, размер, время изменения), чтобы не перечитывать
+# большой model.keras на каждый снимок.
+_hash_memo = {}
+_hash_lock = threading.Lock()
+
+
+# sha256 содержимого файла, читаем кусками.
+def file_hash(path):
+    path = Path(path)
+    stat = path.stat()
+    memo_key = (str(path.resolve()), stat.st_size, stat.st_mtime_ns)
+
+    with _hash_lock:
+        if memo_key in _hash_memo:
+            return _hash_memo[memo_key]
+
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+            digest.update(chunk)
+
+    with _hash_lock:
+        _hash_memo[memo_key] = digest.hexdigest()
+    return _hash_memo[memo_key]
+
+
+# Дисковый кэш результатов анализа. Ключ: содержимое снимка + файл модели + пороги.
+# На каждую запись один файл <ключ>.npz: маска вероятностей во float16 и метрики.
+# Наложение не храним, его по маске заново рисует analyze_image.
+class ResultCache:
+    def __init__(self, cache_dir=CACHE_DIR, max_bytes=MAX_CACHE_BYTES):
+        self.cache_dir = Path(cache_dir)
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+
+    # Ключ записи. Без пути к модели кэшировать нельзя: не понять, чьи это маски.
+    def make_key(self, image_path, model_path, params):
+        if not model_path:
+            return None
+
+        digest = hashlib.sha256()
+        digest.update(file_hash(image_path).encode())
+        digest.update(file_hash(model_path).encode())
+        digest.update(json.dumps(params, sort_keys=True).encode())
+        return digest.hexdigest()
+
+    def path(self, key):
+        return self.cache_dir / f"{key}.npz"
+
+    # Достаём результат. Заодно обновляем время доступа: по нему работает вытеснение.
+    def get(self, key):
+        if key is None:
+            return None
+
+        mask_path = self.path(key)
+
+        try:
+            with np.load(mask_path) as data:
+                pred_mask = data['pred_mask'].astype(np.float32)
+                metrics = json.loads(str(data['metrics']))
+            os.utime(mask_path)
+        except (OSError, KeyError, ValueError):
+            return None
+
+        metrics['pred_mask'] = pred_mask
+        return metrics
+
+    # Кладём результат. Пишем во временный файл и переименовываем, чтобы не оставить половину записи.
+    def put(self, key, result):
+        if key is None:
+            return
+
+        mask_path = self.path(key)
+        metrics = {
+            'has_fracture': result['has_fracture'],
+            'confidence': result['confidence'],
+            'area_ratio': result['area_ratio'],
+            'original_size': list(result['original_size']),
+        }
+
+        mask_buffer = io.BytesIO()
+        np.savez_compressed(
+            mask_buffer,
+            pred_mask=result['pred_mask'].astype(np.float16),
+            metrics=json.dumps(metrics),
+        )
+
+        with self.lock:
+            tmp_mask_path = mask_path.with_suffix(".npz.tmp")
+            tmp_mask_path.write_bytes(mask_buffer.getvalue())
+            os.replace(tmp_mask_path, mask_path)
+
+            self.evict()
+
+    # Удаляем давно не открывавшиеся записи, пока кэш не влезет в лимит.
+    def evict(self):
+        entries = []
+        for path in self.cache_dir.glob("*.npz"):
+            stat = path.stat()
+            entries.append((stat.st_mtime, stat.st_size, path))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            path.unlink(missing_ok=True)
+            total -= size
@@ -1,14 +1,25 @@
-import os
+import sys
+import time
+
 import numpy as np
-import visualkeras
-from tensorflow import keras  
-MODEL_PATH = r'D:\vkladki\best_model.keras'
-print("Файл существует:", os.path.exists(MODEL_PATH))
-model = keras.models.load_model(MODEL_PATH, compile=False)
-model.summary()
 
+from analysis import MODEL_INPUT_SIZE, load_segmentation_model
+
+# Путь к модели можно передать первым аргументом, иначе берём model.keras рядом с программой
+model_path = sys.argv[1] if len(sys.argv) > 1 else None
+
+model = load_segmentation_model(model_path)
+if hasattr(model, "model"):
+    model.model.summary()
+
+
+# Вход в том же виде, что после preprocess_input: 256x256x3 со значениями от -1 до 1
+test_image = np.random.uniform(-1.0, 1.0, (1, *MODEL_INPUT_SIZE, 3)).astype(np.float32)
 
-test_image = np.random.random((1, 224, 224, 3)).astype(np.float32)  
+started = time.perf_counter()
 prediction = model.predict(test_image)
-print("Предсказание:", prediction)  
+elapsed = time.perf_counter() - started
 
+print("Форма маски:", prediction.shape)
+print("Максимальная вероятность:", float(np.max(prediction)))
+print(f"Время предсказания: {elapsed * 1000:.1f} мс")
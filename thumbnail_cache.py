@@ -0,0 +1,89 @@
+import hashlib
+import os
+import threading
+from pathlib import Path
+
+from PIL import Image
+
+from image_loader import load_image
+
+
+BASE_DIR = Path(__file__).resolve().parent
+
+THUMBNAIL_DIR = BASE_DIR / "cache" / "thumbnails"
+
+# Размер миниатюры в истории снимков.
+THUMBNAIL_SIZE = (96, 96)
+
+# Сколько места на диске могут занять миниатюры. Давно не открывавшиеся удаляются первыми.
+MAX_THUMBNAIL_BYTES = int(os.environ.get("VKLADKI_THUMBNAIL_CACHE_MB", "64")) * 1024 * 1024
+
+# Чистим с запасом, до этой доли лимита, чтобы не пересматривать папку на каждой новой миниатюре.
+EVICT_TARGET = 0.9
+
+
+# Дисковый кэш миниатюр снимков. Ключ: путь, размер и время изменения файла,
+# так что перезаписанный снимок сам получает новую миниатюру, а читать файл целиком ради хэша не нужно.
+class ThumbnailCache:
+    def __init__(self, cache_dir=THUMBNAIL_DIR, size=THUMBNAIL_SIZE, max_bytes=MAX_THUMBNAIL_BYTES):
+        self.cache_dir = Path(cache_dir)
+        self.size = tuple(size)
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.total_bytes = None
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+
+    def make_key(self, image_path):
+        path = Path(image_path)
+        stat = path.stat()
+        digest = hashlib.sha256()
+        digest.update(str(path.resolve()).encode())
+        digest.update(f"{stat.st_size}:{stat.st_mtime_ns}:{self.size}".encode())
+        return digest.hexdigest()
+
+    def path(self, key):
+        return self.cache_dir / f"{key}.jpg"
+
+    # Миниатюра снимка: с диска, если уже есть, иначе читаем снимок в уменьшенном виде и сохраняем.
+    # OSError, если самого снимка уже нет.
+    def get(self, image_path):
+        thumb_path = self.path(self.make_key(image_path))
+
+        try:
+            with Image.open(thumb_path) as img:
+                thumbnail = img.convert("RGB")
+            os.utime(thumb_path)
+            return thumbnail
+        except (OSError, ValueError):
+            pass
+
+        # Читаем сразу уменьшенным и мимо общего кэша снимков, чтобы не вытеснять то, что открыто в окне.
+        thumbnail = load_image(image_path, self.size, use_cache=False).preview
+        thumbnail.thumbnail(self.size)
+        self.put(thumb_path, thumbnail)
+        return thumbnail
+
+    def put(self, thumb_path, thumbnail):
+        with self.lock:
+            tmp_path = thumb_path.with_suffix(".jpg.tmp")
+            thumbnail.save(tmp_path, format="JPEG", quality=85)
+            os.replace(tmp_path, thumb_path)
+
+            if self.total_bytes is None:
+                self.total_bytes = sum(path.stat().st_size for path in self.cache_dir.glob("*.jpg"))
+            else:
+                self.total_bytes += thumb_path.stat().st_size
+
+            if self.total_bytes > self.max_bytes:
+                self.evict()
+
+    # Удаляем давно не открывавшиеся миниатюры, пока кэш не влезет в лимит.
+    def evict(self):
+        entries = [(path, path.stat()) for path in self.cache_dir.glob("*.jpg")]
+        total = sum(stat.st_size for _, stat in entries)
+        for path, stat in sorted(entries, key=lambda entry: entry[1].st_mtime):
+            if total <= self.max_bytes * EVICT_TARGET:
+                break
+            path.unlink(missing_ok=True)
+            total -= stat.st_size
+        self.total_bytes = total
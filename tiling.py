@@ -0,0 +1,76 @@
+import numpy as np
+
+from analysis import MODEL_INPUT_SIZE, pick_batch_size, preprocess_input
+
+
+TILE_SIZE = MODEL_INPUT_SIZE[0]
+
+DEFAULT_OVERLAP = 0.25
+
+# Минимальный вес на краю плитки: края тоже учитываются, иначе у границ снимка получились бы дыры.
+MIN_TILE_WEIGHT = 1e-3
+
+
+# Начала плиток вдоль одной стороны. Последняя плитка прижата к краю, чтобы покрыть всё.
+def tile_positions(length, tile_size, stride):
+    if length <= tile_size:
+        return [0]
+
+    positions = list(range(0, length - tile_size, stride))
+    positions.append(length - tile_size)
+    return positions
+
+
+# Вес пикселей внутри плитки: в центре 1, к краям плавно падает.
+# Так на стыках плиток нет заметных швов.
+def blend_window(tile_size):
+    ramp = np.sin(np.pi * (np.arange(tile_size) + 0.5) / tile_size)
+    window = np.outer(ramp, ramp).astype(np.float32)
+    return np.maximum(window, MIN_TILE_WEIGHT)
+
+
+# Анализ снимка в полном разрешении: режем на перекрывающиеся плитки 256x256,
+# гоним их пачками через модель и сшиваем вероятности обратно с весами.
+# В памяти одновременно только одна пачка плиток и две карты размером со снимок.
+def predict_tiled(model, original_img, overlap=DEFAULT_OVERLAP, batch_size=None):
+    if not 0 <= overlap < 1:
+        raise ValueError("Перекрытие плиток должно быть от 0 до 1")
+
+    batch_size = batch_size or pick_batch_size()
+    image = np.asarray(original_img.convert("RGB"))
+    height, width = image.shape[:2]
+
+    # Снимок меньше плитки дополняем крайними пикселями, потом обрезаем обратно.
+    pad_y = max(0, TILE_SIZE - height)
+    pad_x = max(0, TILE_SIZE - width)
+    if pad_y or pad_x:
+        image = np.pad(image, ((0, pad_y), (0, pad_x), (0, 0)), mode="edge")
+
+    padded_height, padded_width = image.shape[:2]
+    stride = max(1, int(TILE_SIZE * (1 - overlap)))
+    window = blend_window(TILE_SIZE)
+
+    prob_sum = np.zeros((padded_height, padded_width), dtype=np.float32)
+    weight_sum = np.zeros((padded_height, padded_width), dtype=np.float32)
+
+    positions = [
+        (y, x)
+        for y in tile_positions(padded_height, TILE_SIZE, stride)
+        for x in tile_positions(padded_width, TILE_SIZE, stride)
+    ]
+
+    for start in range(0, len(positions), batch_size):
+        chunk = positions[start:start + batch_size]
+        tiles = np.empty((len(chunk), TILE_SIZE, TILE_SIZE, 3), dtype=np.float32)
+        for i, (y, x) in enumerate(chunk):
+            tiles[i] = image[y:y + TILE_SIZE, x:x + TILE_SIZE]
+        preprocess_input(tiles)
+
+        predictions = model.predict(tiles, verbose=0, batch_size=len(chunk))
+
+        for (y, x), prediction in zip(chunk, predictions):
+            prob_sum[y:y + TILE_SIZE, x:x + TILE_SIZE] += np.squeeze(prediction) * window
+            weight_sum[y:y + TILE_SIZE, x:x + TILE_SIZE] += window
+
+    prob_sum /= weight_sum
+    return prob_sum[:height, :width]
@@ -12,10 +12,16 @@ BASE_DIR = Path(__file__).resolve().parent
 
 APP_SCRIPT = BASE_DIR / "main.py"
 
+SERVER_SCRIPT = BASE_DIR / "inference_server.py"
+
+SERVER_INFO_FILE = BASE_DIR / ".inference_server.json"
+
 ICON_FILE = BASE_DIR / "app_icon.ico"
 
 app_process = None
 
+server_process = None
+
 CREATE_NO_WINDOW = 0x08000000
 
 # Ищет Python из виртуального окружения
@@ -55,6 +61,58 @@ def load_icon():
 def is_app_running():
     return app_process is not None and app_process.poll() is None
 
+
+def is_server_running():
+    return server_process is not None and server_process.poll() is None
+
+# Поднимает фоновый сервер анализа: он один раз грузит модель и держит её прогретой,
+# а окна программы подключаются к нему и не ждут загрузки TensorFlow
+def start_server(icon=None, item=None):
+
+    global server_process
+
+    if is_server_running() or not SERVER_SCRIPT.exists():
+        return
+
+    creation_flags = CREATE_NO_WINDOW if os.name == "nt" else 0
+
+    server_process = subprocess.Popen(
+        [get_python_executable(), str(SERVER_SCRIPT)],
+        cwd=str(BASE_DIR),
+        stdin=subprocess.DEVNULL,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+        creationflags=creation_flags,
+    )
+
+# Останавливает сервер анализа
+def stop_server():
+
+    global server_process
+
+    if is_server_running():
+        server_process.terminate()
+
+        try:
+            server_process.wait(timeout=5)
+        except subprocess.TimeoutExpired:
+            server_process.kill()
+
+    server_process = None
+    SERVER_INFO_FILE.unlink(missing_ok=True)
+
+# Перезапускает сервер анализа, например после замены model.keras
+def restart_server(icon=None, item=None):
+
+    stop_server()
+    start_server()
+
+    # Открытые окна при следующем анализе переподключатся к новому серверу,
+    # а если он ещё не готов - загрузят модель у себя.
+    if icon:
+        icon.notify("Сервер анализа перезапускается. Открытые окна переподключатся к нему "
+                    "или загрузят модель сами", "bonscanAI")
+
 # Запускает основную программу
 def start_app(icon=None, item=None):
     
@@ -65,6 +123,8 @@ def start_app(icon=None, item=None):
             icon.notify("Приложение уже запущено", "bonscanAI")
         return
 
+    start_server()
+
     if not APP_SCRIPT.exists():
         if icon:
             icon.notify(f"Не найден файл: {APP_SCRIPT}", "Ошибка")
@@ -106,6 +166,7 @@ def stop_app(icon=None, item=None):
 def exit_tray(icon, item):
     
     stop_app()
+    stop_server()
     icon.stop()
 
 
@@ -113,6 +174,7 @@ def main():
     menu = pystray.Menu(
         Item("Запустить bonscanAI", start_app, default=True),
         Item("Остановить bonscanAI", stop_app),
+        Item("Перезапустить сервер анализа", restart_server),
         Item("Выход", exit_tray),
     )
 
@@ -123,6 +185,7 @@ def main():
         menu=menu,
     )
 
+    start_server()
     tray_icon.run()
 
 if __name__ == "__main__":
@@ -0,0 +1,90 @@
+import numpy as np
+from PIL import Image
+
+from analysis import MODEL_INPUT_SIZE, preprocess_input
+
+
+INPUT_SIDE = MODEL_INPUT_SIZE[0]
+
+# Масштабы снимка сверх исходного: чуть отдалить и чуть приблизить.
+TTA_SCALES = (0.9, 1.1)
+
+# Отражения по осям массива: None - без отражения, 1 - слева направо, 0 - сверху вниз.
+TTA_FLIPS = (None, 1, 0)
+
+# Поля вокруг уменьшенного снимка - чёрные, после нормализации это -1.
+PAD_VALUE = -1.0
+
+
+# Варианты снимка (отражение, масштаб). Первый - исходный снимок, он покрывает всю маску.
+def augmentations(scales=TTA_SCALES):
+    return [(flip, 1.0) for flip in TTA_FLIPS] + [(None, scale) for scale in scales]
+
+
+# Где исходный квадрат side x side лежит внутри снимка, растянутого до size x size.
+# Отступ положительный - вход модели вырезан из середины, отрицательный - снимок стоит посреди полей.
+def scale_offset(side, scale):
+    size = max(1, int(round(side * scale)))
+    return size, (size - side) // 2
+
+
+def scaled_input(original_img, scale):
+    size, offset = scale_offset(INPUT_SIDE, scale)
+    resized = original_img.resize((size, size))
+    array = preprocess_input(np.array(resized, dtype=np.float32))
+    if offset >= 0:
+        return array[offset:offset + INPUT_SIDE, offset:offset + INPUT_SIDE]
+
+    canvas = np.full((INPUT_SIDE, INPUT_SIDE, array.shape[2]), PAD_VALUE, dtype=np.float32)
+    canvas[-offset:-offset + size, -offset:-offset + size] = array
+    return canvas
+
+
+# Входы модели для всех вариантов одного снимка, в порядке augmentations().
+def tta_inputs(original_img, scales=TTA_SCALES):
+    inputs = []
+    for flip, scale in augmentations(scales):
+        array = scaled_input(original_img, scale)
+        inputs.append(np.flip(array, axis=flip) if flip is not None else array)
+    return inputs
+
+
+def resize_map(values, side):
+    return np.asarray(Image.fromarray(values).resize((side, side), Image.Resampling.BILINEAR))
+
+
+# Возвращаем маску варианта в координаты исходного снимка. Вместе с ней - вес каждого пикселя:
+# приближенный вариант видел только середину снимка, края у него не считаются.
+def restore_mask(pred_mask, flip, scale):
+    if flip is not None:
+        pred_mask = np.flip(pred_mask, axis=flip)
+    side = pred_mask.shape[0]
+    if scale == 1.0:
+        return pred_mask, np.ones_like(pred_mask)
+
+    size, offset = scale_offset(side, scale)
+    prob = np.zeros((size, size), dtype=np.float32)
+    weight = np.zeros((size, size), dtype=np.float32)
+    if offset >= 0:
+        prob[offset:offset + side, offset:offset + side] = pred_mask
+        weight[offset:offset + side, offset:offset + side] = 1.0
+    else:
+        prob[:] = pred_mask[-offset:-offset + size, -offset:-offset + size]
+        weight[:] = 1.0
+    return resize_map(prob, side), resize_map(weight, side)
+
+
+# Усредняем вероятности всех вариантов одного снимка (маски в порядке augmentations()).
+def merge_tta(pred_masks, scales=TTA_SCALES):
+    prob_sum = None
+    weight_sum = None
+    for pred_mask, (flip, scale) in zip(pred_masks, augmentations(scales)):
+        prob, weight = restore_mask(np.squeeze(pred_mask).astype(np.float32), flip, scale)
+        if prob_sum is None:
+            prob_sum = prob * weight
+            weight_sum = weight.copy()
+        else:
+            prob_sum += prob * weight
+            weight_sum += weight
+    return prob_sum / weight_sum
+
@@ -0,0 +1,232 @@
+from PyQt6.QtCore import QObject, QRunnable, pyqtSignal
+from PyQt6.QtGui import QImage
+
+from analysis import MASK_THRESHOLD, StageTimer, analyze_batch, analyze_image, load_segmentation_model
+from inbox_watcher import patient_id_for
+from inference_server import connect_to_server
+from metrics import profile, span
+from reports import ReportWriter, report_data
+
+
+# Переводим PIL-картинку в QImage. Копия нужна, чтобы QImage не ссылался на временный буфер.
+def pil_to_qimage(img):
+    img = img.convert("RGB")
+    data = img.tobytes("raw", "RGB")
+    qimage = QImage(data, img.width, img.height, img.width * 3, QImage.Format.Format_RGB888)
+    return qimage.copy()
+
+
+class ModelLoadSignals(QObject):
+    loaded = pyqtSignal(object)
+    failed = pyqtSignal(str)
+
+
+class ModelLoadWorker(QRunnable):
+    # Грузим TensorFlow и модель в фоне, пока окно уже открыто.
+    # Если трей уже держит прогретый сервер анализа, просто подключаемся к нему.
+    # local=True - сервер только что пропал, грузим модель сами и к нему не стучимся.
+    def __init__(self, local=False):
+        super().__init__()
+        self.local = local
+        self.signals = ModelLoadSignals()
+
+    def run(self):
+        try:
+            model = (None if self.local else connect_to_server()) or load_segmentation_model()
+        except Exception as e:
+            self.signals.failed.emit(str(e))
+            return
+
+        self.signals.loaded.emit(model)
+
+
+class AnalysisSignals(QObject):
+    started = pyqtSignal(dict)
+    stage_finished = pyqtSignal(dict, str, float)
+    finished = pyqtSignal(dict, dict)
+    # Третий аргумент - упало ли чтение снимка (а не модель или сохранение).
+    failed = pyqtSignal(dict, str, bool)
+
+
+class AnalysisWorker(QRunnable):
+    # Одна задача анализа: снимок и всё, что нужно знать о пациенте на момент запуска.
+    # cache - общий ResultCache окна, чтобы повторный анализ того же снимка был мгновенным.
+    # artifacts - ArtifactStore, куда сохраняется маска исследования (путь приходит в 'artifact_path').
+    # Без пациента (снимок из входящих с незнакомым ID) исследование не запишут, маску не сохраняем.
+    def __init__(self, model, job, cache=None, artifacts=None):
+        super().__init__()
+        self.model = model
+        self.job = job
+        self.cache = cache
+        self.artifacts = artifacts
+        self.signals = AnalysisSignals()
+
+    # Выполняется в пуле потоков, в главное окно результат уходит только через сигналы.
+    def run(self):
+        self.signals.started.emit(self.job)
+        timer = StageTimer(self.report_stage)
+
+        try:
+            # Профиль (если включён VKLADKI_PROFILE) снимаем с анализа целиком, вместе с сохранением.
+            with profile("analysis"), span("analysis_total"):
+                result = analyze_image(
+                    self.model,
+                    self.job['image_path'],
+                    timer=timer,
+                    cache=self.cache,
+                    tiled=self.job.get('tiled', False),
+                    overlay_mode=self.job.get('overlay_mode', 'mask'),
+                    tta=self.job.get('tta', False),
+                )
+                if self.artifacts is not None and self.job['patient'] is not None:
+                    result['artifact_path'] = str(self.artifacts.save(
+                        result, MASK_THRESHOLD, self.job.get('overlay_mode', 'mask'),
+                    ))
+                timer.finish('save')
+        except Exception as e:
+            self.signals.failed.emit(self.job, str(e), 'decode' not in timer.timings)
+            return
+
+        self.signals.finished.emit(self.job, result)
+
+    # Каждый законченный этап сразу отправляем в окно, чтобы прогресс был настоящим.
+    def report_stage(self, stage, seconds):
+        self.signals.stage_finished.emit(self.job, stage, seconds)
+
+
+class BatchSignals(QObject):
+    item_finished = pyqtSignal(dict, dict)
+    progress = pyqtSignal(dict, int, int)
+    finished = pyqtSignal(dict, dict)
+    failed = pyqtSignal(dict, str)
+
+
+class BatchAnalysisWorker(QRunnable):
+    # Пакетная задача: пачка снимков одного пациента или целая папка рабочего списка.
+    # С process_pool (AnalysisProcessPool) снимки расходятся по процессам анализа,
+    # иначе идут пачками через модель окна.
+    def __init__(self, model, job, batch_size=None, process_pool=None, artifacts=None):
+        super().__init__()
+        self.model = model
+        self.job = job
+        self.batch_size = batch_size
+        self.process_pool = process_pool
+        self.artifacts = artifacts
+        self.signals = BatchSignals()
+
+    # Гоним снимки пачками и отдаём результат по каждому, как только он готов.
+    # Сами результаты не копим: в конце уходят только счётчики для сводки.
+    # У снимков из папки пациента нет, его ID ищем так же, как для входящих ('patient_id').
+    def run(self):
+        image_paths = self.job['image_paths']
+        counts = {'done': 0, 'failed': 0, 'fractures': 0}
+
+        if self.process_pool is not None:
+            items = self.process_pool.analyze_many(image_paths, with_overlay=False, tta=self.job.get('tta', False))
+        else:
+            items = analyze_batch(self.model, image_paths, self.batch_size, tta=self.job.get('tta', False))
+
+        try:
+            for result in items:
+                if 'error' in result:
+                    counts['failed'] += 1
+                else:
+                    counts['fractures'] += int(bool(result['has_fracture']))
+                    if self.job['patient'] is None:
+                        result['patient_id'] = patient_id_for(result['image_path'])
+                    # Маску сохраняем, только если снимок есть к кому привязать.
+                    if self.artifacts is not None and (self.job['patient'] is not None or result['patient_id']):
+                        result['artifact_path'] = str(self.artifacts.save(result, MASK_THRESHOLD))
+                counts['done'] += 1
+                self.signals.item_finished.emit(self.job, result)
+                self.signals.progress.emit(self.job, counts['done'], len(image_paths))
+        except Exception as e:
+            self.signals.failed.emit(self.job, str(e))
+            return
+
+        self.signals.finished.emit(self.job, counts)
+
+
+class ThumbnailSignals(QObject):
+    loaded = pyqtSignal(int, QImage)
+    finished = pyqtSignal()
+
+
+class ThumbnailWorker(QRunnable):
+    # Подгружаем миниатюры истории снимков в фоне. items - пары (метка строки в галерее, путь к снимку).
+    # Если пациента сменили, старый загрузчик отменяется и дальше не читает.
+    def __init__(self, cache, items):
+        super().__init__()
+        self.cache = cache
+        self.items = list(items)
+        self.cancelled = False
+        self.signals = ThumbnailSignals()
+
+    def cancel(self):
+        self.cancelled = True
+
+    def run(self):
+        for token, image_path in self.items:
+            if self.cancelled:
+                break
+            try:
+                thumbnail = self.cache.get(image_path)
+            except Exception:
+                # Снимок удалили или не читается: строка в истории просто останется без миниатюры.
+                continue
+            self.signals.loaded.emit(token, pil_to_qimage(thumbnail))
+
+        self.signals.finished.emit()
+
+
+class ReportSignals(QObject):
+    progress = pyqtSignal(int, int)
+    finished = pyqtSignal(dict)
+    failed = pyqtSignal(str)
+
+
+class ReportWorker(QRunnable):
+    # Отчёты в фоне: items - тройки (пациент, исследование из базы, комментарий врача).
+    # Одно заключение или весь рабочий день - одна задача, файлы пишутся потоком (см. ReportWriter).
+    # Исследование, у которого пропал снимок или маска, пропускаем и сообщаем о нём в итоге.
+    def __init__(self, items, pdf_path=None, json_path=None):
+        super().__init__()
+        self.items = list(items)
+        self.pdf_path = pdf_path
+        self.json_path = json_path
+        self.cancelled = False
+        self.signals = ReportSignals()
+
+    def cancel(self):
+        self.cancelled = True
+
+    def run(self):
+        skipped = []
+        try:
+            writer = ReportWriter(self.pdf_path, self.json_path)
+            with writer:
+                for done, (patient, study, comments) in enumerate(self.items, start=1):
+                    if self.cancelled:
+                        writer.close(discard=True)
+                        return
+                    try:
+                        data = report_data(patient, study, comments)
+                    except (OSError, KeyError, ValueError) as e:
+                        skipped.append(f"{patient['name']}, {study['image_path']}: {e}")
+                    else:
+                        with span("report"):
+                            writer.add(data)
+                    self.signals.progress.emit(done, len(self.items))
+                # Ни одного отчёта не вышло: пустые файлы не оставляем.
+                if writer.count == 0:
+                    writer.close(discard=True)
+        except Exception as e:
+            self.signals.failed.emit(str(e))
+            return
+
+        self.signals.finished.emit({
+            'pdf_path': self.pdf_path,
+            'json_path': self.json_path,
+            'written': writer.count,
+            'skipped': skipped,
+        })